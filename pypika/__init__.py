@@ -19,6 +19,31 @@ pypika.functions
 
 Wrappers for common SQL functions are stored in this package.
 
+pypika.rewrites
+---------------
+
+Optional rewrite passes which turn a query into an equivalent one that is cheaper for the database to execute.
+
+pypika.partitions
+-----------------
+
+Helpers for running a query over disjoint partitions of its rows and combining the partial results.
+
+pypika.execution
+----------------
+
+Executes queries through DB-API 2 drivers with a pool of connections.
+
+pypika.aio
+----------
+
+Executes queries from ``asyncio`` code with a limit on the number of concurrent queries.
+
+pypika.caching
+--------------
+
+Caches the results of queries executed with a pool of connections.
+
 pypika.enums
 ------------
 
@@ -33,9 +58,11 @@ This contains all of the utility classes such as exceptions and decorators.
 """
 
 from .enums import Order, JoinType, DatePart
-from .queries import Query, Table, make_tables as Tables
-from .terms import Field, Case, Interval, Rollup
-from .utils import JoinException, GroupingException, CaseException, UnionException, RollupException
+from .queries import Query, Table, ShardedTable, AliasedQuery, RecursiveCTE, make_tables as Tables
+from .terms import (Field, Case, Interval, Rollup, Cube, GroupingSets, Exists, NotExists, Preceding, Following,
+                    CURRENT_ROW)
+from .utils import (JoinException, GroupingException, CaseException, UnionException, RollupException, QueryException,
+                    ExecutionException)
 
 __author__ = "Timothy Heys"
 __email__ = "theys@kayak.com"
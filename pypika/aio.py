@@ -0,0 +1,421 @@
+# coding: utf8
+"""
+Executes queries from ``asyncio`` code.  An ``AsyncPool`` limits the number of queries which run concurrently on a
+backend and renders queries in an executor, so that rendering large queries does not block the event loop.  Queries
+are sent to the database by an ``AsyncDriver``.  ``ThreadedDriver`` adapts a ``pypika.execution.ConnectionPool`` of
+a synchronous DB-API 2 driver, such as ``sqlite3``, by running its calls in a thread pool.  A ``BatchLoader`` combines
+the point lookups issued at the same time into one query.
+
+This module requires Python 3.7 or later.
+"""
+import asyncio
+import copy
+import functools
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from itertools import islice
+
+from pypika.enums import Equality
+from pypika.execution import _iterate_rows
+from pypika.queries import QueryBuilder
+from pypika.terms import (AggregateFunction, AnalyticFunction, Field, conjoin, field_key, iter_terms,
+                          normalize_comparison, split_conjuncts)
+
+__author__ = "Timothy Heys"
+__email__ = "theys@kayak.com"
+
+
+class AsyncDriver(object):
+    """
+    The interface of the drivers of an ``AsyncPool``.  ``paramstyle`` is the DB-API 2 paramstyle of the driver.
+    """
+    paramstyle = 'qmark'
+
+    async def fetch(self, sql, parameters):
+        """
+        Executes a statement and returns the list of rows it returns.
+        """
+        raise NotImplementedError()
+
+    def stream(self, sql, parameters, batch_size):
+        """
+        Executes a statement and returns an asynchronous iterator of the rows it returns, which are fetched from the
+        database in batches of ``batch_size`` rows.
+        """
+        raise NotImplementedError()
+
+    async def close(self):
+        pass
+
+
+class ThreadedDriver(AsyncDriver):
+    def __init__(self, pool, executor=None, cancel=None):
+        """
+        Runs the calls of a synchronous DB-API 2 driver in a thread pool.
+
+        :param pool:
+            Type: pypika.execution.ConnectionPool
+
+            The pool of connections of the driver.
+        :param executor:
+            (Optional) The ``concurrent.futures.Executor`` to run the calls in.  Defaults to the executor of the
+            event loop.
+        :param cancel:
+            (Optional) A function which aborts the statement running on a connection when the task waiting for it
+            is cancelled.  Defaults to calling the ``interrupt`` or ``cancel`` method of the connection, such as
+            ``sqlite3.Connection.interrupt`` and ``psycopg2.connection.cancel``, if there is one.
+        """
+        self.pool = pool
+        self.paramstyle = pool.paramstyle
+        self.executor = executor
+        self.cancel = cancel or _cancel
+
+    async def fetch(self, sql, parameters):
+        async with self._connection() as connection:
+            return await self._run(connection, _fetchall, connection, sql, parameters)
+
+    async def stream(self, sql, parameters, batch_size):
+        async with self._connection() as connection:
+            rows = _iterate_rows(connection, sql, parameters, batch_size, self.pool.vendor)
+            try:
+                while True:
+                    batch = await self._run(connection, _next_batch, rows, batch_size)
+                    if not batch:
+                        break
+                    for row in batch:
+                        yield row
+            finally:
+                await self._in_executor(rows.close)
+
+    async def close(self):
+        await self._in_executor(self.pool.close)
+
+    @asynccontextmanager
+    async def _connection(self):
+        connection = await self._checkout()
+        failed = False
+        try:
+            yield connection
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            # The connection is released in the executor even if this task is cancelled again
+            await asyncio.shield(self._in_executor(_release, self.pool, connection, failed))
+
+    async def _checkout(self):
+        future = self._in_executor(self.pool.checkout)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            future.add_done_callback(functools.partial(_checkin_later, self.pool))
+            raise
+
+    async def _run(self, connection, function, *args):
+        future = self._in_executor(function, *args)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            self.cancel(connection)
+            # The connection can only be released once the statement has stopped
+            await asyncio.wait([future])
+            if not future.cancelled():
+                future.exception()
+            raise
+
+    def _in_executor(self, function, *args):
+        return asyncio.get_event_loop().run_in_executor(self.executor, functools.partial(function, *args))
+
+
+class AsyncPool(object):
+    def __init__(self, driver, max_concurrency=10, render_executor=None, offload_render=True):
+        """
+        Executes queries on a backend with at most ``max_concurrency`` queries running at the same time.
+
+        :param driver:
+            Type: AsyncDriver
+
+            The driver of the backend.
+        :param max_concurrency:
+            (Optional) The maximum number of queries which run concurrently.  Further queries wait for a running one
+            to complete.
+        :param render_executor:
+            (Optional) The ``concurrent.futures.Executor`` which renders queries.  Defaults to the executor of the
+            event loop.
+        :param offload_render:
+            (Optional) Whether to render queries in the executor.  Rendering small queries in the event loop is
+            faster than handing them to a thread.
+        """
+        self.driver = driver
+        self.max_concurrency = max_concurrency
+        self.render_executor = render_executor
+        self.offload_render = offload_render
+        self._semaphore = None
+
+    async def fetch(self, query, parameters=None):
+        """
+        Executes a query and returns the list of rows it returns.
+
+        :param query:
+            A ``QueryBuilder``, which is sent with its values as parameters, or a SQL string.
+        :param parameters:
+            (Optional) The parameters of a SQL string.
+        """
+        async with self._slot():
+            sql, parameters = await self._render(query, parameters)
+            return await self.driver.fetch(sql, parameters)
+
+    async def fetch_many(self, queries):
+        """
+        Executes several queries concurrently, up to the concurrency limit of the pool.  If one of the queries fails,
+        the others are cancelled.
+
+        :return:
+            The list of the rows returned by each query, in the order of the queries.
+        """
+        tasks = [asyncio.ensure_future(self.fetch(query)) for query in queries]
+        try:
+            return await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.wait(tasks)
+            raise
+
+    async def stream(self, query, parameters=None, batch_size=1000):
+        """
+        Executes a query and yields the rows it returns, which are fetched in batches of ``batch_size`` rows.  The
+        query counts towards the concurrency limit until the iteration completes or is closed.
+        """
+        async with self._slot():
+            sql, parameters = await self._render(query, parameters)
+            rows = self.driver.stream(sql, parameters, batch_size)
+            try:
+                async for row in rows:
+                    yield row
+            finally:
+                await rows.aclose()
+
+    async def close(self):
+        await self.driver.close()
+
+    @asynccontextmanager
+    async def _slot(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self._semaphore:
+            yield
+
+    async def _render(self, query, parameters):
+        if not hasattr(query, 'get_parameterized_sql'):
+            return query, parameters if parameters is not None else ()
+
+        if not self.offload_render:
+            return query.get_parameterized_sql(self.driver.paramstyle)
+
+        return await asyncio.get_event_loop().run_in_executor(
+            self.render_executor, query.get_parameterized_sql, self.driver.paramstyle)
+
+
+class BatchLoader(object):
+    def __init__(self, pool, max_batch=1000):
+        """
+        Combines point lookups into fewer queries.  Lookups which are loaded in the same iteration of the event loop
+        and differ only in the value of an equality on the same key field, such as ``t.id == 1`` and ``t.id == 2``,
+        are executed as one query with ``t.id.isin([1, 2])``.  The rows are then distributed to the callers by their
+        value of the key field.  More than ``max_batch`` values are split into several queries.  Only values of the
+        same type are combined, and when the database returns a key which is not one of the values, for example
+        ``1`` for ``t.id == '1'``, the lookups of the batch are executed one by one instead.
+
+        Queries whose rows depend on each other, with a GROUP BY, DISTINCT, LIMIT, aggregates or analytic functions,
+        and queries without an equality on a field are executed on their own.
+
+        :param pool:
+            Type: AsyncPool
+
+            The pool which executes the queries.
+        :param max_batch:
+            (Optional) The maximum number of values of the key field in one query.
+        """
+        self.pool = pool
+        self.max_batch = max_batch
+        self._batches = OrderedDict()
+
+    async def load(self, query, key=None):
+        """
+        Returns the rows of a query, which is executed together with the other queries of the same shape loaded in
+        this iteration of the event loop.
+
+        :param query:
+            A ``QueryBuilder``.
+        :param key:
+            (Optional) The field, or the name of the field, whose equality differs between lookups.  Defaults to the
+            field of the last equality in the WHERE clause.
+        :return:
+            The list of rows of the query.
+        """
+        lookup = _point_lookup(query, key)
+        if lookup is None:
+            return await self.pool.fetch(query)
+
+        shape, base, field, value = lookup
+        loop = asyncio.get_event_loop()
+        if not self._batches:
+            loop.call_soon(self._dispatch)
+
+        batch = self._batches.get(shape)
+        if batch is None:
+            batch = self._batches[shape] = _Batch(base, field)
+
+        future = loop.create_future()
+        batch.lookups.append((value, future))
+        return await future
+
+    def _dispatch(self):
+        batches, self._batches = self._batches, OrderedDict()
+        for batch in batches.values():
+            asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch):
+        values = list(OrderedDict.fromkeys(value for value, _ in batch.lookups))
+
+        try:
+            rows_by_value = await self._fetch(batch, values)
+        except Exception as exception:
+            for _, future in batch.lookups:
+                if not future.done():
+                    future.set_exception(exception)
+            return
+
+        for value, future in batch.lookups:
+            if not future.done():
+                future.set_result(list(rows_by_value.get(value, [])))
+
+    async def _fetch(self, batch, values):
+        queries = [batch.query(values[i:i + self.max_batch])
+                   for i in range(0, len(values), self.max_batch)]
+        results = await self.pool.fetch_many(queries)
+
+        rows_by_value = {}
+        for rows in results:
+            for row in rows:
+                rows_by_value.setdefault(row[batch.index], []).append(batch.row(row))
+
+        if set(rows_by_value) <= set(values):
+            return rows_by_value
+
+        # The database converted the values it compared, so the rows cannot be told apart by their key
+        results = await self.pool.fetch_many([batch.query([value]) for value in values])
+        return dict((value, [batch.row(row) for row in rows]) for value, rows in zip(values, results))
+
+
+class _Batch(object):
+    """
+    The lookups of the same shape loaded in an iteration of the event loop.  ``base`` is their query without the
+    equality on the key ``field``.
+    """
+
+    def __init__(self, base, field):
+        self.base = base
+        self.field = field
+        self.lookups = []
+
+        self.index = next((i for i, term in enumerate(base._selects)
+                           if isinstance(term, Field) and field_key(term) == field_key(field)), None)
+        self.appended = self.index is None
+        if self.appended:
+            # The key is needed to distribute the rows, so it is selected last and removed from the rows afterwards
+            self.index = -1
+
+    def query(self, values):
+        query, field = copy.deepcopy((self.base, self.field))
+        if self.appended:
+            query._selects.append(field)
+
+        conjuncts = split_conjuncts(query._wheres) if query._wheres is not None else []
+        query._wheres = conjoin(conjuncts + [field.isin(values)])
+        return query
+
+    def row(self, row):
+        return row[:-1] if self.appended else row
+
+
+def _point_lookup(query, key):
+    """
+    Splits a lookup into its shape, its query without the equality on the key field, the key field and its value.
+    Returns ``None`` if the query cannot be combined with other lookups.
+    """
+    if not isinstance(query, QueryBuilder) or query._wheres is None or query._groupbys or query._havings is not None \
+            or query._distinct or query._limit is not None or query._offset or query._top or query._unions \
+            or query._insert_table is not None:
+        return None
+
+    if any(isinstance(term, (AggregateFunction, AnalyticFunction))
+           for select in query._selects
+           for term in iter_terms(select, descend=False)):
+        return None
+
+    base = copy.deepcopy(query)
+    conjuncts = split_conjuncts(base._wheres)
+
+    for i in reversed(range(len(conjuncts))):
+        normalized = normalize_comparison(conjuncts[i])
+        if normalized is None:
+            continue
+
+        comparator, field, value = normalized
+        if comparator is not Equality.eq or not isinstance(field, Field) or not _is_key(field, key):
+            continue
+
+        base._wheres = conjoin(conjuncts[:i] + conjuncts[i + 1:])
+        # Values of different types are not combined, since the database may compare them as equal, like 1 and '1'
+        return (base.get_sql(), field.get_sql(), type(value)), base, field, value
+
+    return None
+
+
+def _is_key(field, key):
+    if key is None:
+        return True
+    if isinstance(key, Field):
+        return field.name == key.name and getattr(field.table, 'table_name', None) == \
+            getattr(key.table, 'table_name', None)
+    return field.name == key
+
+
+def _fetchall(connection, sql, parameters):
+    cursor = connection.cursor()
+    try:
+        cursor.execute(sql, parameters)
+        return cursor.fetchall() if cursor.description is not None else []
+    finally:
+        cursor.close()
+
+
+def _next_batch(rows, batch_size):
+    return list(islice(rows, batch_size))
+
+
+def _release(pool, connection, failed):
+    discard = False
+    try:
+        if failed:
+            connection.rollback()
+        else:
+            connection.commit()
+    except Exception:
+        discard = True
+    pool.checkin(connection, discard=discard)
+
+
+def _checkin_later(pool, future):
+    if not future.cancelled() and future.exception() is None:
+        pool.checkin(future.result())
+
+
+def _cancel(connection):
+    for name in ('interrupt', 'cancel'):
+        method = getattr(connection, name, None)
+        if method is not None:
+            method()
+            return
@@ -0,0 +1,581 @@
+# coding: utf8
+"""
+Caches the results of queries executed on a ``pypika.execution.ConnectionPool``, keyed by the SQL and the parameters
+of each query.  A ``ResultCache`` keeps the rows in memory.  A ``DiskCache`` keeps results as memory-mapped columns in
+a directory which is shared by all processes using it.
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from pypika.execution import MappedResult, _clock, _write_json
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+__author__ = "Timothy Heys"
+__email__ = "theys@kayak.com"
+
+# String literals and quoted identifiers, whose whitespace is kept, or runs of whitespace
+_whitespace = re.compile(r'(\'(?:[^\']|\'\')*\'|"(?:[^"]|"")*"|`[^`]*`)|\s+')
+
+# SQL statements which only read rows and whose results can be cached
+_reading = re.compile(r'\s*\(*\s*(SELECT|WITH)\b', re.IGNORECASE)
+
+
+class CacheMetrics(object):
+    """
+    Counters of a ``ResultCache``.
+
+    - ``hits``: the number of queries answered from the cache.
+    - ``misses``: the number of queries executed on the database.
+    - ``shared``: the number of queries which waited for an identical query running at the same time instead of
+      executing it again.
+    - ``evictions``: the number of results removed to stay within the size of the cache.
+    - ``expirations``: the number of results removed because their time to live passed.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @property
+    def hit_ratio(self):
+        lookups = self.hits + self.misses + self.shared
+        return (self.hits + self.shared) / float(lookups) if lookups else 0.0
+
+
+class ResultCache(object):
+    def __init__(self, pool, max_bytes=64 * 1024 * 1024, max_entries=None, ttl=None):
+        """
+        Caches the rows returned by queries executed on a connection pool.  The least recently used results are
+        evicted when the cache exceeds ``max_bytes`` or ``max_entries``.  When several threads execute the same query
+        at the same time, it is executed once and all of them get its result.
+
+        :param pool:
+            Type: pypika.execution.ConnectionPool
+
+            The pool which executes the queries.
+        :param max_bytes:
+            (Optional) The maximum size of the cached rows in bytes, as estimated by ``sys.getsizeof``.  Larger
+            results are not cached.
+        :param max_entries:
+            (Optional) The maximum number of cached results.  By default only the size is limited.
+        :param ttl:
+            (Optional) The number of seconds a result is kept.  By default results are kept until they are evicted.
+        """
+        self.pool = pool
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.metrics = CacheMetrics()
+        self.size = 0
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._flights = {}
+        # The number of times each table was invalidated, with the invalidations of any table counted under None, and
+        # the number of times the cache was cleared, so that results read during an invalidation are not cached
+        self._invalidations = {}
+        self._clears = 0
+
+    def execute(self, query, parameters=None, ttl=None):
+        """
+        Returns the rows of a query from the cache, or executes it on the pool and caches them.  Statements which do
+        not read, such as ``INSERT`` queries or SQL strings which do not start with ``SELECT`` or ``WITH``, are always
+        executed and never cached.  Executing an ``INSERT`` query invalidates the results which read its table, and
+        executing any other such statement invalidates all results, since the tables it writes are not known.
+
+        :param query:
+            A ``QueryBuilder`` or a SQL string.
+        :param parameters:
+            (Optional) The parameters of a SQL string.
+        :param ttl:
+            (Optional) The number of seconds to keep the result, instead of the ``ttl`` of the cache.
+        :return:
+            A list of the rows returned by the query.
+        """
+        if getattr(query, '_insert_table', None) is not None:
+            try:
+                return self.pool.execute(query, parameters)
+            finally:
+                self.invalidate_tables(query.tables_written())
+
+        sql, parameters = self.pool.render(query, parameters)
+        if not _reading.match(sql):
+            try:
+                return self.pool.execute(sql, parameters)
+            finally:
+                self.clear()
+
+        key = _key(sql, parameters)
+
+        tables = query.tables_read() if hasattr(query, 'tables_read') else None
+
+        with self._lock:
+            rows = self._get(key)
+            if rows is not None:
+                self.metrics.hits += 1
+                return list(rows)
+
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                self.metrics.misses += 1
+                leader = True
+                invalidations = self._read_invalidations(tables)
+            else:
+                self.metrics.shared += 1
+                leader = False
+
+        if not leader:
+            return list(flight.wait())
+
+        try:
+            rows = self.pool.execute(sql, parameters)
+        except BaseException as exception:
+            with self._lock:
+                del self._flights[key]
+            flight.fail(exception)
+            raise
+
+        with self._lock:
+            del self._flights[key]
+            # The rows may be stale if their tables were written to while the query was executed
+            if self._read_invalidations(tables) == invalidations:
+                self._put(key, rows, self.ttl if ttl is None else ttl, tables)
+        flight.succeed(rows)
+        return list(rows)
+
+    def key(self, query, parameters=None):
+        """
+        Returns the key of a query in the cache: its SQL, with runs of whitespace outside of quotes replaced by a
+        space, and its parameters.
+        """
+        return _key(*self.pool.render(query, parameters))
+
+    def invalidate(self, query, parameters=None):
+        """
+        Removes the result of a query from the cache.
+        """
+        with self._lock:
+            self._remove(self.key(query, parameters))
+
+    def invalidate_tables(self, tables):
+        """
+        Removes the results which read any of the given tables from the cache, for example after they were written to
+        by statements not executed with this cache.  Results of SQL strings are always removed, since the tables they
+        read are not known.
+
+        :param tables:
+            A collection of the (name, schema) of each table, as returned by ``QueryBuilder.tables_written``.
+        """
+        tables = set(tables)
+        with self._lock:
+            for table in tables | {None}:
+                self._invalidations[table] = self._invalidations.get(table, 0) + 1
+
+            for key, entry in list(self._entries.items()):
+                if entry[3] is None or entry[3] & tables:
+                    self._remove(key)
+
+    def clear(self):
+        """
+        Removes all results from the cache.
+        """
+        with self._lock:
+            self._clears += 1
+            self._entries.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _read_invalidations(self, tables):
+        """
+        Returns the number of invalidations of the tables read by a query, or of any table if they are not known.
+        """
+        if tables is None:
+            return self._clears, self._invalidations.get(None, 0)
+        return self._clears, dict((table, self._invalidations.get(table, 0)) for table in tables)
+
+    def _get(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+
+        rows, size, expires, _ = entry
+        if expires is not None and expires <= _clock():
+            self.size -= size
+            self.metrics.expirations += 1
+            return None
+
+        # Reinserting the entry marks it as the most recently used one
+        self._entries[key] = entry
+        return rows
+
+    def _put(self, key, rows, ttl, tables):
+        size = _sizeof(rows)
+        if size > self.max_bytes:
+            return
+
+        self._remove(key)
+        self._entries[key] = (rows, size, None if ttl is None else _clock() + ttl, tables)
+        self.size += size
+
+        while self.size > self.max_bytes or (self.max_entries is not None and len(self._entries) > self.max_entries):
+            _, entry = self._entries.popitem(last=False)
+            self.size -= entry[1]
+            self.metrics.evictions += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+
+class DiskCache(object):
+    # The name of the file which lists the cached results
+    index = 'index.json'
+
+    def __init__(self, pool, directory, max_bytes=1024 * 1024 * 1024, ttl=None, batch_size=10000):
+        """
+        Caches the results of queries as memory-mapped columns in a directory, which can be shared by several
+        processes.  Results are written with ``ConnectionPool.spill_columns`` to a temporary directory and renamed
+        into place, so that they are never seen half written.  A query is executed by one process at a time, holding a
+        file lock, and the other processes wait for its result.  The least recently used results are evicted when the
+        results exceed ``max_bytes`` on disk.  This requires NumPy, and the file locks require ``fcntl``.
+
+        :param pool:
+            Type: pypika.execution.ConnectionPool
+
+            The pool which executes the queries.
+        :param directory:
+            The directory of the cache.  It is created if it does not exist.
+        :param max_bytes:
+            (Optional) The maximum size of the cached results in bytes.  The latest result is kept even if it is
+            larger.
+        :param ttl:
+            (Optional) The number of seconds a result is kept.  By default results are kept until they are evicted.
+        :param batch_size:
+            (Optional) The number of rows to fetch at a time.
+
+        The ``metrics`` of the cache count the lookups of this process only.
+        """
+        self.pool = pool
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.batch_size = batch_size
+        self.metrics = CacheMetrics()
+
+        for path in (directory, os.path.join(directory, 'locks')):
+            if not os.path.isdir(path):
+                try:
+                    os.makedirs(path)
+                except OSError:
+                    # Created by another process in the meantime
+                    if not os.path.isdir(path):
+                        raise
+
+    def execute(self, query, parameters=None, ttl=None):
+        """
+        Returns the result of a query from the cache, or executes it on the pool and caches it.  ``INSERT`` queries
+        are executed and never cached, and they invalidate the results which read their table.  SQL strings which do
+        not start with ``SELECT`` or ``WITH`` are executed and never cached, and they invalidate all results.
+
+        :param query:
+            A ``QueryBuilder`` or a SQL string.
+        :param parameters:
+            (Optional) The parameters of a SQL string.
+        :param ttl:
+            (Optional) The number of seconds to keep the result, instead of the ``ttl`` of the cache.
+        :return:
+            A ``pypika.execution.MappedResult``, or the list of rows returned by a statement which is not cached.
+        """
+        if getattr(query, '_insert_table', None) is not None:
+            try:
+                return self.pool.execute(query, parameters)
+            finally:
+                self.invalidate_tables(query.tables_written())
+
+        sql, rendered = self.pool.render(query, parameters)
+        if not _reading.match(sql):
+            try:
+                return self.pool.execute(sql, rendered)
+            finally:
+                self.clear()
+
+        ttl = self.ttl if ttl is None else ttl
+        fingerprint = _fingerprint(sql, rendered)
+
+        result = self._lookup(fingerprint, ttl)
+        if result is not None:
+            self.metrics.hits += 1
+            return result
+
+        with _file_lock(self._lock_path(fingerprint)):
+            # Another process may have written the result while this one was waiting for the lock
+            result = self._lookup(fingerprint, ttl, expire=False)
+            if result is not None:
+                self.metrics.shared += 1
+                return result
+
+            self.metrics.misses += 1
+            tables = sorted(query.tables_read()) if hasattr(query, 'tables_read') else None
+            with self._state() as state:
+                invalidations = self._read_invalidations(state, tables)
+
+            temporary = os.path.join(self.directory, 'tmp-{id}'.format(id=uuid.uuid4().hex))
+            self.pool.spill_columns(query, parameters, batch_size=self.batch_size, directory=temporary)
+
+            with self._state() as state:
+                if self._read_invalidations(state, tables) != invalidations:
+                    # The tables were written to while the query was executed, so the result is not cached.  Its
+                    # files stay readable after they are removed, since they are mapped when the result is opened.
+                    result = _open(temporary)
+                    shutil.rmtree(temporary, ignore_errors=True)
+                    return result
+
+                self._discard(fingerprint)
+                os.rename(temporary, os.path.join(self.directory, fingerprint))
+
+                index = state['results']
+                index[fingerprint] = {
+                    'sql': sql,
+                    'size': _directory_size(os.path.join(self.directory, fingerprint)),
+                    'tables': tables,
+                }
+                self._evict(index, keep=fingerprint)
+
+        return _open(os.path.join(self.directory, fingerprint))
+
+    def fingerprint(self, query, parameters=None):
+        """
+        Returns the name of the result of a query in the cache, a hash of its SQL, with runs of whitespace outside of
+        quotes replaced by a space, and its parameters.
+        """
+        return _fingerprint(*self.pool.render(query, parameters))
+
+    def invalidate(self, query, parameters=None):
+        """
+        Removes the result of a query from the cache.
+        """
+        fingerprint = self.fingerprint(query, parameters)
+        with self._index() as index:
+            index.pop(fingerprint, None)
+            self._discard(fingerprint)
+
+    def invalidate_tables(self, tables):
+        """
+        Removes the results which read any of the given tables from the cache.  Results of SQL strings are always
+        removed, since the tables they read are not known.
+
+        :param tables:
+            A collection of the (name, schema) of each table, as returned by ``QueryBuilder.tables_written``.
+        """
+        tables = set(tables)
+        with self._state() as state:
+            invalidations = state['invalidations']
+            for key in [_table_key(table) for table in tables] + ['*']:
+                invalidations[key] = invalidations.get(key, 0) + 1
+
+            index = state['results']
+            for fingerprint, entry in list(index.items()):
+                if entry['tables'] is None or tables & set(tuple(table) for table in entry['tables']):
+                    del index[fingerprint]
+                    self._discard(fingerprint)
+
+    def clear(self):
+        """
+        Removes all results from the cache.
+        """
+        with self._state() as state:
+            state['clears'] += 1
+
+            index = state['results']
+            for fingerprint in list(index):
+                del index[fingerprint]
+                self._discard(fingerprint)
+
+    @property
+    def size(self):
+        with self._index() as index:
+            return sum(entry['size'] for entry in index.values())
+
+    def __len__(self):
+        with self._index() as index:
+            return len(index)
+
+    def _lookup(self, fingerprint, ttl, expire=True):
+        path = os.path.join(self.directory, fingerprint)
+        try:
+            created = os.path.getmtime(os.path.join(path, MappedResult.metadata))
+            if ttl is not None and created + ttl <= time.time():
+                if expire:
+                    self.metrics.expirations += 1
+                return None
+
+            result = _open(path)
+            # The modification time of the directory orders results by their last use for eviction
+            os.utime(path, None)
+            return result
+        except (IOError, OSError):
+            # Missing, or evicted by another process while being opened
+            return None
+
+    def _evict(self, index, keep):
+        for fingerprint in list(index):
+            if not os.path.isdir(os.path.join(self.directory, fingerprint)):
+                del index[fingerprint]
+
+        size = sum(entry['size'] for entry in index.values())
+        used = sorted((os.path.getmtime(os.path.join(self.directory, fingerprint)), fingerprint)
+                      for fingerprint in index
+                      if fingerprint != keep)
+
+        for _, fingerprint in used:
+            if size <= self.max_bytes:
+                break
+            size -= index.pop(fingerprint)['size']
+            self._discard(fingerprint)
+            self.metrics.evictions += 1
+
+    def _discard(self, fingerprint):
+        """
+        Removes the files of a result.  The directory is renamed first so that no process opens it afterwards, while
+        results opened before keep their mapped files.
+        """
+        path = os.path.join(self.directory, fingerprint)
+        trash = os.path.join(self.directory, 'trash-{id}'.format(id=uuid.uuid4().hex))
+        try:
+            os.rename(path, trash)
+        except OSError:
+            return
+        shutil.rmtree(trash, ignore_errors=True)
+
+    def _lock_path(self, fingerprint):
+        # A fixed number of lock files is shared by all results
+        return os.path.join(self.directory, 'locks', fingerprint[:2] + '.lock')
+
+    def _read_invalidations(self, state, tables):
+        """
+        Returns the number of invalidations of the tables read by a query, or of any table if they are not known.
+        """
+        invalidations = state['invalidations']
+        if tables is None:
+            return state['clears'], invalidations.get('*', 0)
+        return state['clears'], [invalidations.get(_table_key(table), 0) for table in tables]
+
+    @contextmanager
+    def _index(self):
+        with self._state() as state:
+            yield state['results']
+
+    @contextmanager
+    def _state(self):
+        """
+        Locks and returns the contents of the index: the cached ``results`` by their fingerprint, the number of
+        ``invalidations`` of each table, with the invalidations of any table counted under ``*``, and the number of
+        ``clears``, so that results read while their tables are invalidated are not cached.
+        """
+        path = os.path.join(self.directory, self.index)
+
+        with _file_lock(os.path.join(self.directory, 'locks', 'index.lock')):
+            try:
+                with open(path) as file:
+                    state = json.load(file)
+            except (IOError, OSError, ValueError):
+                state = {}
+
+            if 'results' not in state:
+                state = {'results': {}, 'invalidations': {}, 'clears': 0}
+
+            before = json.dumps(state, sort_keys=True)
+            yield state
+
+            if json.dumps(state, sort_keys=True) != before:
+                _write_json(path, state)
+
+
+class _Flight(object):
+    """
+    A query which is being executed, whose result is waited for by the threads executing the same query.
+    """
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._rows = None
+        self._exception = None
+
+    def succeed(self, rows):
+        self._rows = rows
+        self._done.set()
+
+    def fail(self, exception):
+        self._exception = exception
+        self._done.set()
+
+    def wait(self):
+        self._done.wait()
+        if self._exception is not None:
+            raise self._exception
+        return self._rows
+
+
+def _key(sql, parameters):
+    sql = _whitespace.sub(lambda match: match.group(1) or ' ', sql).strip()
+
+    if isinstance(parameters, dict):
+        return sql, tuple(sorted(parameters.items()))
+    return sql, tuple(parameters)
+
+
+def _fingerprint(sql, parameters):
+    return hashlib.sha1(repr(_key(sql, parameters)).encode('utf8')).hexdigest()
+
+
+def _table_key(table):
+    return json.dumps(list(table))
+
+
+def _sizeof(rows):
+    return sys.getsizeof(rows) + sum(sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row)
+                                     for row in rows)
+
+
+def _open(path):
+    result = MappedResult(path)
+    # Mapping the files right away keeps them readable even if the result is evicted
+    for name in result.names:
+        result[name]
+    return result
+
+
+def _directory_size(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+@contextmanager
+def _file_lock(path):
+    with open(path, 'a') as file:
+        if fcntl is not None:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(file.fileno(), fcntl.LOCK_UN)
@@ -44,6 +44,7 @@ class Order(Enum):
 
 class JoinType(Enum):
     left = ''
+    left_outer = 'LEFT OUTER'
     right = 'RIGHT'
     inner = 'INNER'
     outer = 'OUTER'
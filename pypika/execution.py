@@ -0,0 +1,887 @@
+# coding: utf8
+"""
+Executes queries on databases through DB-API 2 drivers.  Connections are taken from a bounded, thread-safe pool and
+queries are sent with their values as parameters.  ``sqlite_pool`` creates a pool for the ``sqlite3`` module of the
+standard library, which serves as the reference backend.
+"""
+import importlib
+import json
+import numbers
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import date, datetime
+from decimal import Decimal
+
+from pypika.enums import SqlTypes
+from pypika.functions import Cast
+from pypika.terms import Star
+from pypika.utils import ExecutionException
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__author__ = "Timothy Heys"
+__email__ = "theys@kayak.com"
+
+_clock = getattr(time, 'perf_counter', time.time)
+
+# sqlite3 accepts URI filenames, with which connections can share an in-memory database, from Python 3.4
+_sqlite_uri = sys.version_info >= (3, 4)
+
+_string_types = (str, type(u''))
+
+_binary_types = (bytes, bytearray, memoryview)
+
+_date_pattern = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+_timestamp_pattern = re.compile(r'^\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}(:\d{2}(\.\d+)?)?$')
+
+# NumPy types of the columns of a CAST to a SQL type
+_cast_dtypes = {
+    'SIGNED': 'int64',
+    'INT': 'int64',
+    'INTEGER': 'int64',
+    'SMALLINT': 'int64',
+    'BIGINT': 'int64',
+    'UNSIGNED': 'uint64',
+    'FLOAT': 'float64',
+    'REAL': 'float64',
+    'DOUBLE': 'float64',
+    'DOUBLE PRECISION': 'float64',
+    'DECIMAL': 'float64',
+    'NUMERIC': 'float64',
+    'BOOL': 'bool',
+    'BOOLEAN': 'bool',
+    'DATE': 'datetime64[D]',
+    'DATETIME': 'datetime64[us]',
+    'TIMESTAMP': 'datetime64[us]',
+}
+
+
+class PoolMetrics(object):
+    """
+    Counters of a ``ConnectionPool``.  Times are in seconds.
+
+    - ``checkouts``: the number of connections checked out of the pool.
+    - ``timeouts``: the number of checkouts which timed out waiting for a connection.
+    - ``wait_time`` and ``max_wait``: the total and longest time spent waiting for a connection.
+    - ``checkout_time`` and ``max_checkout``: the total and longest time connections were checked out.
+    """
+
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+        self.checkout_time = 0.0
+        self.max_checkout = 0.0
+
+    @property
+    def mean_wait(self):
+        return self.wait_time / self.checkouts if self.checkouts else 0.0
+
+    def _record_wait(self, seconds):
+        self.checkouts += 1
+        self.wait_time += seconds
+        self.max_wait = max(self.max_wait, seconds)
+
+    def _record_checkout(self, seconds):
+        self.checkout_time += seconds
+        self.max_checkout = max(self.max_checkout, seconds)
+
+
+class ConnectionPool(object):
+    def __init__(self, connect, max_size=5, timeout=None, paramstyle='qmark', vendor=None):
+        """
+        A pool of at most ``max_size`` DB-API 2 connections which can be shared by several threads.  Connections are
+        opened when they are first needed and reused afterwards.
+
+        :param connect:
+            A function without arguments which opens a new connection.
+        :param max_size:
+            (Optional) The maximum number of open connections.
+        :param timeout:
+            (Optional) The number of seconds to wait for a connection when all connections are checked out before
+            an ``ExecutionException`` is raised.  By default there is no timeout.
+        :param paramstyle:
+            (Optional) The paramstyle of the driver, given by its module attribute ``paramstyle``.
+        :param vendor:
+            (Optional) The database vendor, which determines how rows are streamed by ``iterate``.
+        """
+        if max_size < 1:
+            raise ExecutionException('A pool needs at least one connection.')
+
+        self.max_size = max_size
+        self.timeout = timeout
+        self.paramstyle = paramstyle
+        self.vendor = vendor
+        self.metrics = PoolMetrics()
+
+        self._connect = connect
+        self._condition = threading.Condition()
+        self._idle = []
+        self._size = 0
+        self._checked_out = {}
+        self._closed = False
+
+    def checkout(self):
+        """
+        Takes a connection from the pool, waiting for one to be checked in if all of them are in use.  The connection
+        must be returned with ``checkin``.  Prefer ``connection``, which returns it automatically.
+        """
+        start = _clock()
+        deadline = None if self.timeout is None else start + self.timeout
+
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise ExecutionException('The connection pool is closed.')
+                if self._idle or self._size < self.max_size:
+                    break
+
+                remaining = None if deadline is None else deadline - _clock()
+                if remaining is not None and remaining <= 0:
+                    self.metrics.timeouts += 1
+                    raise ExecutionException('Timed out waiting for a connection after {timeout} seconds.'.format(
+                        timeout=self.timeout))
+                self._condition.wait(remaining)
+
+            connection = self._idle.pop() if self._idle else None
+            if connection is None:
+                # Reserve the slot before connecting outside of the lock
+                self._size += 1
+
+        if connection is None:
+            try:
+                connection = self._connect()
+            except Exception:
+                with self._condition:
+                    self._size -= 1
+                    self._condition.notify()
+                raise
+
+        checked_out = _clock()
+        with self._condition:
+            self.metrics._record_wait(checked_out - start)
+            self._checked_out[id(connection)] = checked_out
+        return connection
+
+    def checkin(self, connection, discard=False):
+        """
+        Returns a connection to the pool.
+
+        :param discard:
+            (Optional) Close the connection instead of reusing it, for example because it is broken.
+        """
+        with self._condition:
+            self.metrics._record_checkout(_clock() - self._checked_out.pop(id(connection)))
+
+            if discard or self._closed:
+                self._size -= 1
+            else:
+                self._idle.append(connection)
+            self._condition.notify()
+
+        if discard or self._closed:
+            connection.close()
+
+    @contextmanager
+    def connection(self):
+        """
+        A context manager which checks out a connection.  The transaction is committed when the block completes and
+        rolled back when it raises an exception or is left early, such as when a generator is closed.  The connection
+        is returned to the pool afterwards.
+        """
+        connection = self.checkout()
+        discard = False
+        try:
+            yield connection
+            connection.commit()
+        except BaseException:
+            try:
+                connection.rollback()
+            except Exception:
+                discard = True
+            raise
+        finally:
+            self.checkin(connection, discard=discard)
+
+    def execute(self, query, parameters=None):
+        """
+        Executes a query on a connection from the pool and commits it.
+
+        :param query:
+            A ``QueryBuilder``, which is sent with its values as parameters, or a SQL string.
+        :param parameters:
+            (Optional) The parameters of a SQL string.
+        :return:
+            The list of rows returned by the query, which is empty for statements which do not return rows.
+        """
+        sql, parameters = self.render(query, parameters)
+
+        with self.connection() as connection:
+            cursor = connection.cursor()
+            try:
+                cursor.execute(sql, parameters)
+                return cursor.fetchall() if cursor.description is not None else []
+            finally:
+                cursor.close()
+
+    def iterate(self, query, parameters=None, batch_size=1000):
+        """
+        Executes a query and yields the rows it returns without holding all of them in memory.  Rows are fetched from
+        the database in batches of ``batch_size`` rows.  For ``'postgresql'`` the query is run in a server-side cursor
+        with ``DECLARE ... CURSOR`` and ``FETCH``, and for ``'mysql'`` an unbuffered cursor is used.  Otherwise the
+        rows are fetched with ``fetchmany``, which the driver may or may not buffer.
+
+        This is a generator.  The connection is checked out until the iteration completes or the generator is closed.
+
+        :param query:
+            A ``QueryBuilder`` or a SQL string.
+        :param parameters:
+            (Optional) The parameters of a SQL string.
+        :param batch_size:
+            (Optional) The number of rows to fetch at a time.
+        """
+        sql, parameters = self.render(query, parameters)
+
+        with self.connection() as connection:
+            for row in _iterate_rows(connection, sql, parameters, batch_size, self.vendor):
+                yield row
+
+    def fetch_columns(self, query, parameters=None, batch_size=10000):
+        """
+        Executes a query and returns its result as NumPy arrays, one per column.  Rows are fetched in batches of
+        ``batch_size`` rows like with ``iterate`` and copied into arrays which grow as needed.  This requires NumPy.
+
+        The type of a column is taken from a ``Cast`` in the SELECT clause or inferred from the values in the first
+        batch: integers give ``int64``, or ``float64`` if there are nulls, other numbers ``float64``, dates and
+        timestamps, including strings in ISO format, ``datetime64`` and everything else ``object``.  Nulls become NaN
+        and NaT.  A column is converted to a wider type if a later batch does not fit.
+
+        :param query:
+            A ``QueryBuilder``, whose ``select_aliases`` name the columns, or a SQL string.
+        :param parameters:
+            (Optional) The parameters of a SQL string.
+        :param batch_size:
+            (Optional) The number of rows to fetch at a time.
+        :return:
+            An ``OrderedDict`` of the arrays by column name.
+        """
+        names, columns = self._fetch_into_columns(query, parameters, batch_size,
+                                                  lambda index, dtype: _Column(dtype, batch_size))
+
+        return OrderedDict((name, column.array())
+                           for name, column in zip(names, columns))
+
+    def spill_columns(self, query, parameters=None, batch_size=10000, directory=None):
+        """
+        Executes a query and writes its result to a file per column in a directory, for results which do not fit in
+        memory.  The rows are fetched in batches like with ``fetch_columns`` and the types of the columns are
+        determined in the same way.  Numbers and dates are written as raw arrays which are read back with
+        ``numpy.memmap``.  Strings are written as their UTF-8 bytes and offsets, and bytes likewise.  Booleans mixed
+        with nulls are written as floats like integers mixed with nulls, and timestamps with a time zone are written
+        in UTC.  Columns of other values raise an ``ExecutionException``.  This requires NumPy.
+
+        :param query:
+            A ``QueryBuilder``, whose ``select_aliases`` name the columns, or a SQL string.
+        :param parameters:
+            (Optional) The parameters of a SQL string.
+        :param batch_size:
+            (Optional) The number of rows to fetch at a time.
+        :param directory:
+            (Optional) An empty or missing directory for the files.  Defaults to a new temporary directory.  The
+            caller is responsible for deleting it, for example with ``MappedResult.delete``.
+        :return:
+            A ``MappedResult`` of the directory.
+        """
+        created = directory is None or not os.path.isdir(directory)
+        if directory is None:
+            directory = tempfile.mkdtemp(prefix='pypika-')
+        elif created:
+            os.makedirs(directory)
+
+        columns = []
+
+        def spill(index, dtype):
+            columns.append(_SpilledColumn(os.path.join(directory, str(index)), dtype))
+            return columns[-1]
+
+        try:
+            try:
+                names, columns = self._fetch_into_columns(query, parameters, batch_size, spill)
+            finally:
+                for column in columns:
+                    column.close()
+        except BaseException:
+            if created:
+                shutil.rmtree(directory, ignore_errors=True)
+            raise
+
+        _write_json(os.path.join(directory, MappedResult.metadata), {
+            'length': columns[0].size if columns else 0,
+            'columns': [dict(name=name, **column.metadata())
+                        for name, column in zip(names, columns)],
+        })
+        return MappedResult(directory)
+
+    def _fetch_into_columns(self, query, parameters, batch_size, column):
+        if numpy is None:
+            raise ExecutionException('Fetching columns requires NumPy.')
+
+        sql, parameters = self.render(query, parameters)
+        dtypes = _declared_dtypes(query)
+
+        with self.connection() as connection:
+            with _streaming_cursor(connection, sql, parameters, self.vendor) as cursor:
+                columns = None
+                for rows in _batches(cursor, batch_size):
+                    if columns is None:
+                        columns = [column(index, dtype)
+                                   for index, dtype in enumerate(dtypes or [None] * len(rows[0]))]
+                    for values, column_values in zip(columns, zip(*rows)):
+                        values.extend(column_values)
+
+                names = _column_names(query, cursor.description)
+
+        if columns is None:
+            columns = [column(index, dtype)
+                       for index, dtype in enumerate(dtypes or [None] * len(names))]
+
+        return names, columns
+
+    def render(self, query, parameters=None):
+        """
+        Returns the SQL and the parameters to execute a query with the paramstyle of this pool.
+        """
+        if hasattr(query, 'get_parameterized_sql'):
+            return query.get_parameterized_sql(self.paramstyle)
+        return query, parameters if parameters is not None else ()
+
+    def close(self):
+        """
+        Closes the idle connections of the pool.  Connections which are checked out are closed when they are checked
+        in.  A closed pool cannot be used anymore.
+        """
+        with self._condition:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._condition.notify_all()
+
+        for connection in idle:
+            connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def sqlite_pool(database=':memory:', max_size=5, timeout=None, **kwargs):
+    """
+    Creates a pool of connections to a SQLite database with the ``sqlite3`` module.  The connections may be used by
+    any thread.  An in-memory database is shared by all connections of the pool and exists as long as one of them is
+    open.  Before Python 3.4 the connections cannot share one, so the pool of an in-memory database holds a single
+    connection.
+
+    :param database:
+        (Optional) The path of the database file.  Defaults to a new in-memory database.
+    :param kwargs:
+        (Optional) Further arguments of ``sqlite3.connect``.
+    """
+    import sqlite3
+
+    if database == ':memory:':
+        if _sqlite_uri:
+            database = 'file:pypika-{id}?mode=memory&cache=shared'.format(id=uuid.uuid4().hex)
+            kwargs['uri'] = True
+        else:
+            max_size = 1
+
+    def connect():
+        return sqlite3.connect(database, check_same_thread=False, **kwargs)
+
+    return ConnectionPool(connect, max_size=max_size, timeout=timeout, paramstyle=sqlite3.paramstyle, vendor='sqlite')
+
+
+def _iterate_rows(connection, sql, parameters, batch_size, vendor):
+    with _streaming_cursor(connection, sql, parameters, vendor) as cursor:
+        for rows in _batches(cursor, batch_size):
+            for row in rows:
+                yield row
+
+
+def _batches(cursor, batch_size):
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield rows
+
+
+@contextmanager
+def _streaming_cursor(connection, sql, parameters, vendor):
+    """
+    Executes a statement in a cursor whose rows are not read into memory before they are fetched.
+    """
+    if vendor == 'postgresql':
+        cursor = _DeclaredCursor(connection.cursor())
+    elif vendor == 'mysql':
+        cursor = _unbuffered_cursor(connection)
+    else:
+        cursor = connection.cursor()
+
+    try:
+        cursor.execute(sql, parameters)
+        yield cursor
+    finally:
+        cursor.close()
+
+
+class _DeclaredCursor(object):
+    """
+    Reads the rows of a statement from a server-side cursor with ``DECLARE ... CURSOR`` and ``FETCH``.
+    """
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.name = 'pypika_{id}'.format(id=uuid.uuid4().hex)
+        self.exhausted = False
+
+    @property
+    def description(self):
+        return self.cursor.description
+
+    def execute(self, sql, parameters):
+        self.cursor.execute('DECLARE "{name}" NO SCROLL CURSOR FOR {sql}'.format(name=self.name, sql=sql),
+                            parameters)
+
+    def fetchmany(self, size):
+        self.cursor.execute('FETCH {size} FROM "{name}"'.format(size=size, name=self.name))
+        rows = self.cursor.fetchall()
+        self.exhausted = not rows
+        return rows
+
+    def close(self):
+        try:
+            if self.exhausted:
+                self.cursor.execute('CLOSE "{name}"'.format(name=self.name))
+        finally:
+            self.cursor.close()
+
+
+def _unbuffered_cursor(connection):
+    """
+    Opens a cursor which does not read the whole result into memory with the MySQL drivers pymysql, mysqlclient and
+    MySQL Connector.  Other drivers get a regular cursor.
+    """
+    package = type(connection).__module__.split('.')[0]
+    if package in ('pymysql', 'MySQLdb'):
+        return connection.cursor(importlib.import_module(package + '.cursors').SSCursor)
+    if package == 'mysql':
+        return connection.cursor(buffered=False)
+    return connection.cursor()
+
+
+def _column_names(query, description):
+    if _has_star(query) or not hasattr(query, 'select_aliases'):
+        return [column[0] for column in description or ()]
+    return query.select_aliases()
+
+
+def _declared_dtypes(query):
+    if _has_star(query) or not hasattr(query, '_selects'):
+        return None
+
+    dtypes = []
+    for term in query._selects:
+        dtype = None
+        if isinstance(term, Cast):
+            as_type = getattr(term.params[1], 'value', term.params[1])
+            if isinstance(as_type, SqlTypes):
+                as_type = as_type.value
+            dtype = _cast_dtypes.get(str(as_type).split('(')[0].strip().upper())
+        dtypes.append(numpy.dtype(dtype) if dtype else None)
+    return dtypes
+
+
+def _has_star(query):
+    return any(isinstance(term, Star) for term in getattr(query, '_selects', ()))
+
+
+class _Column(object):
+    """
+    A growable NumPy array which is filled with the values of a column batch by batch.
+    """
+
+    def __init__(self, dtype, capacity):
+        self.declared = dtype
+        self.capacity = capacity
+        self.data = None
+        self.size = 0
+
+    def extend(self, values):
+        array = _convert(values, None if self.data is None else self.data.dtype, self.declared)
+
+        if self.data is None:
+            self.data = numpy.empty(max(self.capacity, len(array)), dtype=array.dtype)
+        elif self.data.dtype != array.dtype:
+            self.data = self.data.astype(array.dtype)
+
+        end = self.size + len(array)
+        if end > len(self.data):
+            grown = numpy.empty(max(end, 2 * len(self.data)), dtype=self.data.dtype)
+            grown[:self.size] = self.data[:self.size]
+            self.data = grown
+
+        self.data[self.size:end] = array
+        self.size = end
+
+    def array(self):
+        if self.data is None:
+            return numpy.empty(0, dtype=self.declared or 'float64')
+        if self.size == len(self.data):
+            return self.data
+        return self.data[:self.size].copy()
+
+
+class _SpilledColumn(object):
+    """
+    Appends the values of a column batch by batch to files starting with ``path``.  Strings and bytes are written to
+    ``path.data`` with their offsets in ``path.offsets`` and their nulls in ``path.nulls``.  Other values are written to
+    ``path.bin`` as an array.
+    """
+
+    def __init__(self, path, dtype):
+        self.path = path
+        self.declared = dtype
+        self.dtype = None
+        # MappedResult.strings or MappedResult.binary once the column is written as variable-length values
+        self.layout = None
+        self.size = 0
+        self.files = {}
+
+    def extend(self, values):
+        if self.layout is not None:
+            self._write_values(values)
+            return
+
+        values = _spillable(values)
+        array = _convert(values, self.dtype, self.declared)
+
+        if array.dtype.kind == 'O':
+            self._to_values(values)
+            self._write_values(values)
+            return
+
+        if self.dtype is not None and array.dtype != self.dtype:
+            self._widen(array.dtype)
+
+        self.dtype = array.dtype
+        array.tofile(self._file('bin'))
+        self.size += len(array)
+
+    def close(self):
+        for file in self.files.values():
+            file.close()
+
+    def metadata(self):
+        if self.layout is not None:
+            return {'type': self.layout, 'file': os.path.basename(self.path)}
+
+        if self.dtype is None:
+            self.dtype = self.declared or numpy.dtype('float64')
+            open(self.path + '.bin', 'wb').close()
+        return {'type': self.dtype.str, 'file': os.path.basename(self.path)}
+
+    def _file(self, extension):
+        if extension not in self.files:
+            self.files[extension] = open('{path}.{extension}'.format(path=self.path, extension=extension), 'wb')
+        return self.files[extension]
+
+    def _widen(self, dtype):
+        written = self._read()
+        self.files.pop('bin').close()
+        written.astype(dtype).tofile(self._file('bin'))
+
+    def _to_values(self, values):
+        if any(isinstance(value, _string_types) for value in values):
+            layout = MappedResult.strings
+        elif any(isinstance(value, _binary_types) for value in values):
+            layout = MappedResult.binary
+        else:
+            types = sorted(set(type(value).__name__ for value in values if value is not None))
+            raise ExecutionException('The column in {path} has values of type {types}, which cannot be spilled.  Only '
+                                     'columns of numbers, booleans, dates, timestamps, strings or bytes can be spilled.'
+                                     .format(path=self.path, types=', '.join(types)))
+
+        written = self._read() if self.dtype is not None else numpy.empty(0)
+        if not numpy.isnan(written).all():
+            raise ExecutionException('The column in {path} mixes {layout} and other values.'.format(
+                path=self.path, layout=layout))
+
+        if 'bin' in self.files:
+            self.files.pop('bin').close()
+            os.remove(self.path + '.bin')
+
+        self.layout = layout
+        self.size = 0
+        self._file('offsets').write(numpy.zeros(1, dtype='int64').tobytes())
+        self._offset = 0
+        self._write_values([None] * len(written))
+
+    def _write_values(self, values):
+        types = _string_types if self.layout == MappedResult.strings else _binary_types
+        if not all(value is None or isinstance(value, types) for value in values):
+            raise ExecutionException('The column in {path} mixes {layout} and other values.'.format(
+                path=self.path, layout=self.layout))
+
+        encoded = [b'' if value is None else value.encode('utf8') if self.layout == MappedResult.strings
+                   else bytes(value)
+                   for value in values]
+        offsets = numpy.cumsum([len(value) for value in encoded], dtype='int64') + self._offset
+        nulls = numpy.array([value is None for value in values], dtype='bool')
+
+        self._file('data').write(b''.join(encoded))
+        self._file('offsets').write(offsets.tobytes())
+        self._file('nulls').write(nulls.tobytes())
+        self._offset = int(offsets[-1]) if len(offsets) else self._offset
+        self.size += len(values)
+
+    def _read(self):
+        self.files['bin'].flush()
+        return numpy.fromfile(self.path + '.bin', dtype=self.dtype)
+
+
+def _spillable(values):
+    """
+    Converts the values of a batch which have no NumPy type: booleans mixed with nulls to floats, like integers mixed
+    with nulls, and timestamps with a time zone to timestamps in UTC.
+    """
+    kinds = set(map(type, values))
+    if kinds == {bool, type(None)}:
+        return [numpy.nan if value is None else float(value) for value in values]
+
+    if datetime in kinds:
+        return [value.replace(tzinfo=None) - value.utcoffset()
+                if isinstance(value, datetime) and value.tzinfo is not None else value
+                for value in values]
+    return values
+
+
+class MappedResult(object):
+    """
+    The result of a query in the files written by ``ConnectionPool.spill_columns``.  Columns are mapped into memory
+    when they are first accessed, so that slicing them reads only the rows of the slice from disk and does not copy
+    them.  Numbers and dates are ``numpy.memmap`` arrays and strings and bytes are ``MappedStrings``.
+
+    A result can be pickled and sent to other processes, which map the files again, and can be reopened from its
+    directory later.
+    """
+    # The name of the file which describes the columns
+    metadata = 'columns.json'
+
+    # The type of string columns in the metadata
+    strings = 'strings'
+
+    # The type of bytes columns in the metadata
+    binary = 'binary'
+
+    def __init__(self, directory):
+        self.directory = directory
+
+        with open(os.path.join(directory, self.metadata)) as file:
+            metadata = json.load(file)
+
+        self.length = metadata['length']
+        self._columns = OrderedDict((column['name'], column) for column in metadata['columns'])
+        self._mapped = {}
+
+    @property
+    def names(self):
+        return list(self._columns)
+
+    def keys(self):
+        return self.names
+
+    def __len__(self):
+        return self.length
+
+    def __contains__(self, name):
+        return name in self._columns
+
+    def __getitem__(self, name):
+        if name not in self._mapped:
+            self._mapped[name] = self._map(self._columns[name])
+        return self._mapped[name]
+
+    def delete(self):
+        """
+        Deletes the files of the result.
+        """
+        self._mapped = {}
+        shutil.rmtree(self.directory)
+
+    def __getstate__(self):
+        return {'directory': self.directory}
+
+    def __setstate__(self, state):
+        self.__init__(state['directory'])
+
+    def _map(self, column):
+        path = os.path.join(self.directory, column['file'])
+
+        if column['type'] in (self.strings, self.binary):
+            return MappedStrings(_map_array(path + '.offsets', 'int64', self.length + 1),
+                                 _map_array(path + '.data', 'uint8', None),
+                                 _map_array(path + '.nulls', 'bool', self.length),
+                                 binary=column['type'] == self.binary)
+
+        return _map_array(path + '.bin', column['type'], self.length)
+
+
+class MappedStrings(object):
+    """
+    A column of strings in memory-mapped files.  The UTF-8 bytes of all strings are in ``data`` and the bytes of
+    string ``i`` are ``data[offsets[i]:offsets[i + 1]]``.  ``nulls`` tells which values are null.  The values of a
+    ``binary`` column are returned as bytes instead of being decoded.
+    """
+
+    def __init__(self, offsets, data, nulls, binary=False):
+        self.offsets = offsets
+        self.data = data
+        self.nulls = nulls
+        self.binary = binary
+
+    def __len__(self):
+        return len(self.nulls)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self[index] for index in range(*item.indices(len(self)))]
+
+        if item < 0:
+            item += len(self)
+        if self.nulls[item]:
+            return None
+        value = self.data[self.offsets[item]:self.offsets[item + 1]].tobytes()
+        return value if self.binary else value.decode('utf8')
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+
+def _map_array(path, dtype, length):
+    # Empty files cannot be mapped
+    if not length and not os.path.getsize(path):
+        return numpy.empty(0, dtype=dtype)
+    return numpy.memmap(path, dtype=dtype, mode='r', shape=length and (length,))
+
+
+def _write_json(path, value):
+    # Readers never see a partial file as it is renamed into place
+    temporary = '{path}.{id}'.format(path=path, id=uuid.uuid4().hex)
+    with open(temporary, 'w') as file:
+        json.dump(value, file)
+    os.rename(temporary, path)
+
+
+def _convert(values, dtype, declared):
+    """
+    Converts a batch of values of a column to an array.  The type of the array is the type of the column ``dtype``,
+    or a wider type if the values do not fit.  The type of the first batch is ``declared`` or inferred.
+    """
+    inferred = _infer_dtype(values)
+
+    if dtype is None:
+        if declared is not None and _fits(inferred, declared):
+            dtype = declared
+        else:
+            dtype = inferred or numpy.dtype('float64')
+    elif not _fits(inferred, dtype):
+        dtype = _common_dtype(dtype, inferred)
+
+    try:
+        return _to_array(values, dtype)
+    except (TypeError, ValueError, OverflowError):
+        return _to_array(values, numpy.dtype(object))
+
+
+def _infer_dtype(values):
+    """
+    Returns the NumPy type of a batch of values of a column, or None if all of them are null.
+    """
+    kinds = set(map(type, values))
+    nulls = type(None) in kinds
+    kinds.discard(type(None))
+
+    if not kinds:
+        return None
+
+    if kinds == {bool}:
+        return numpy.dtype(object if nulls else 'bool')
+
+    if all(issubclass(kind, numbers.Integral) for kind in kinds):
+        return numpy.dtype('float64' if nulls else 'int64')
+
+    if all(issubclass(kind, (numbers.Real, Decimal)) for kind in kinds):
+        return numpy.dtype('float64')
+
+    if all(issubclass(kind, date) for kind in kinds):
+        if any(value.tzinfo is not None for value in values if isinstance(value, datetime)):
+            return numpy.dtype(object)
+        return numpy.dtype('datetime64[D]' if datetime not in kinds else 'datetime64[us]')
+
+    if all(issubclass(kind, _string_types) for kind in kinds):
+        strings = [value for value in values if value is not None]
+        if all(_date_pattern.match(value) for value in strings):
+            return numpy.dtype('datetime64[D]')
+        if all(_timestamp_pattern.match(value) for value in strings):
+            return numpy.dtype('datetime64[us]')
+
+    return numpy.dtype(object)
+
+
+def _fits(inferred, dtype):
+    if dtype.kind == 'O':
+        return True
+    if inferred is None:
+        return dtype.kind in 'fM'
+    if dtype.kind == 'M':
+        return inferred.kind == 'M'
+    if dtype.kind in 'iu':
+        return inferred.kind in 'biu'
+    if dtype.kind == 'f':
+        return inferred.kind in 'biuf'
+    return inferred == dtype
+
+
+def _common_dtype(dtype, inferred):
+    if inferred is None:
+        return numpy.dtype('float64' if dtype.kind in 'biu' else object)
+    if dtype.kind in 'biuf' and inferred.kind in 'biuf':
+        return numpy.dtype('float64')
+    if dtype.kind == 'M' and inferred.kind == 'M':
+        return numpy.dtype('datetime64[us]')
+    return numpy.dtype(object)
+
+
+def _to_array(values, dtype):
+    if dtype.kind == 'O':
+        # Assigning to an empty array keeps sequences as values instead of adding dimensions
+        array = numpy.empty(len(values), dtype=object)
+        array[:] = values
+        return array
+    return numpy.array(values, dtype=dtype)
@@ -2,15 +2,21 @@
 """
 Package for SQL functions wrappers
 """
+from __future__ import division
+
+import math
+
 from pypika.enums import SqlTypes
-from pypika.terms import Function, Star
+from pypika.terms import Function, Star, AggregateFunction, AnalyticFunction
 from pypika.utils import builder
 
 __author__ = "Timothy Heys"
 __email__ = "theys@kayak.com"
 
 
-class Count(Function):
+class Count(AggregateFunction):
+    combine = 'SUM'
+
     def __init__(self, param, alias=None):
         is_star = isinstance(param, str) and '*' == param
         super(Count, self).__init__('COUNT', Star() if is_star else param, alias=alias)
@@ -25,39 +31,102 @@ class Count(Function):
     @builder
     def distinct(self):
         self._distinct = True
+        # Rows counted in one partition may also be counted in another
+        self.combine = None
         return self
 
+    def partials(self):
+        if self._distinct and not self._include_over:
+            return [self.params[0]]
+        return super(Count, self).partials()
+
+    def merge(self, values):
+        if self._distinct:
+            return len(values[0])
+        # The sum of the partial counts is null when there are no partial rows
+        return values[0] or 0
+
 
 # Arithmetic Functions
-class Sum(Function):
+class Sum(AggregateFunction):
+    combine = 'SUM'
+
     def __init__(self, term, alias=None):
         super(Sum, self).__init__('SUM', term, alias=alias)
 
 
-class Avg(Function):
+class Avg(AggregateFunction):
     def __init__(self, term, alias=None):
         super(Avg, self).__init__('AVG', term, alias=alias)
 
+    def partials(self):
+        if self._include_over:
+            return None
+        return [Sum(self.params[0]), Count(self.params[0])]
+
+    def merge(self, values):
+        total, count = values
+        if not count or total is None:
+            return None
+        return total / count
+
+
+class Min(AggregateFunction):
+    combine = 'MIN'
 
-class Min(Function):
     def __init__(self, term, alias=None):
         super(Min, self).__init__('MIN', term, alias=alias)
 
 
-class Max(Function):
+class Max(AggregateFunction):
+    combine = 'MAX'
+
     def __init__(self, term, alias=None):
         super(Max, self).__init__('MAX', term, alias=alias)
 
 
-class Std(Function):
+class Std(AggregateFunction):
     def __init__(self, term, alias=None):
         super(Std, self).__init__('STD', term, alias=alias)
 
+    def partials(self):
+        if self._include_over:
+            return None
+        term = self.params[0]
+        return [Count(term), Sum(term), Sum(term * term)]
+
+    def merge(self, values):
+        return _standard_deviation(values, sample=False)
+
 
-class StdDev(Function):
+class StdDev(AggregateFunction):
     def __init__(self, term, alias=None):
         super(StdDev, self).__init__('STDDEV', term, alias=alias)
 
+    def partials(self):
+        if self._include_over:
+            return None
+        term = self.params[0]
+        return [Count(term), Sum(term), Sum(term * term)]
+
+    def merge(self, values):
+        # STDDEV is the sample standard deviation in most databases, but the population standard deviation in MySQL
+        return _standard_deviation(values, sample=True)
+
+
+def _standard_deviation(values, sample):
+    count, total, sum_of_squares = values
+    if not count or (sample and count == 1):
+        return None
+
+    variance = (sum_of_squares - total * total / count) / (count - 1 if sample else count)
+    return math.sqrt(max(variance, 0))
+
+
+class Grouping(Function):
+    def __init__(self, *terms, **kwargs):
+        super(Grouping, self).__init__('GROUPING', *terms, **kwargs)
+
 
 class Coalesce(Function):
     def __init__(self, term, default_value, alias=None):
@@ -169,3 +238,41 @@ class Extract(Function):
             part=self.params[0],
             field=self.params[1],
         )
+
+
+# Analytic Functions
+class RowNumber(AnalyticFunction):
+    def __init__(self, alias=None):
+        super(RowNumber, self).__init__('ROW_NUMBER', alias=alias)
+
+
+class Rank(AnalyticFunction):
+    def __init__(self, alias=None):
+        super(Rank, self).__init__('RANK', alias=alias)
+
+
+class DenseRank(AnalyticFunction):
+    def __init__(self, alias=None):
+        super(DenseRank, self).__init__('DENSE_RANK', alias=alias)
+
+
+class Lag(AnalyticFunction):
+    def __init__(self, term, offset=1, default=None, alias=None):
+        params = [term, offset] if default is None else [term, offset, default]
+        super(Lag, self).__init__('LAG', *params, alias=alias)
+
+
+class Lead(AnalyticFunction):
+    def __init__(self, term, offset=1, default=None, alias=None):
+        params = [term, offset] if default is None else [term, offset, default]
+        super(Lead, self).__init__('LEAD', *params, alias=alias)
+
+
+class FirstValue(AnalyticFunction):
+    def __init__(self, term, alias=None):
+        super(FirstValue, self).__init__('FIRST_VALUE', term, alias=alias)
+
+
+class LastValue(AnalyticFunction):
+    def __init__(self, term, alias=None):
+        super(LastValue, self).__init__('LAST_VALUE', term, alias=alias)
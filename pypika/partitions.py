@@ -0,0 +1,842 @@
+# coding: utf8
+"""
+Helpers for running a query as several queries over disjoint partitions of its rows, for example in parallel on
+several connections, and for combining the results of those queries into the result of the original query.  Conversely,
+``merge_queries`` runs several queries over the same rows as one query and splits its result.
+"""
+import copy
+import heapq
+from collections import OrderedDict
+from datetime import date, datetime, time, timedelta
+from operator import itemgetter
+
+from pypika.enums import DatePart, Equality, Order
+from pypika.terms import (AggregateFunction, AnalyticFunction, BetweenCriterion, ContainsCriterion, Field, ListField,
+                          Star, ValueWrapper, conjoin, field_key, iter_terms, normalize_comparison, param_value,
+                          split_conjuncts)
+from pypika.utils import QueryException, add_months, as_date
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__author__ = "Timothy Heys"
+__email__ = "theys@kayak.com"
+
+# Recombination of a select term whose partial rows are concatenated
+CONCAT = 'concat'
+
+# Recombination of a GROUP BY term by which partial rows are grouped by again
+GROUP = 'group'
+
+# Recombination of a term which is grouped by in the partial query to collect its distinct values
+DISTINCT = 'distinct'
+
+# Functions which combine the partial results of an aggregate, ignoring nulls like their SQL counterparts
+_combiners = {
+    'SUM': sum,
+    'MIN': min,
+    'MAX': max,
+    DISTINCT: set,
+}
+
+# NumPy functions which combine numeric partial results in place, and the initial value for each group
+if numpy is not None:
+    _ufuncs = {
+        'SUM': (numpy.add, lambda values: 0),
+        'MIN': (numpy.minimum, lambda values: values.max()),
+        'MAX': (numpy.maximum, lambda values: values.min()),
+    }
+
+# Vendors which sort nulls as larger than any other value
+_nulls_last_vendors = ('postgresql', 'oracle')
+
+# The number of months in the periods which are aligned to the start of a month
+_months = {
+    DatePart.month: 1,
+    DatePart.quarter: 3,
+    DatePart.year: 12,
+}
+
+
+def recombination(query, field=None):
+    """
+    Describes how to combine the results of a query executed over disjoint partitions of its rows into the result of
+    the query over all rows.
+
+    The partial rows of a query which does not aggregate, or which groups by the field the rows are partitioned by,
+    are simply concatenated, since no group can span two partitions.  The partial rows of a DISTINCT query are grouped
+    again by all of their columns.  Otherwise the partial rows are grouped again by the GROUP BY terms, which must be
+    selected, and each aggregate is combined with the aggregate named by its ``combine`` attribute, for example the
+    partial results of ``Count`` are summed.
+
+    :param query:
+        Type: QueryBuilder
+
+        The query which is executed over each partition.
+    :param field:
+        (Optional) The field the rows are partitioned by.
+    :return:
+        An ``OrderedDict`` mapping the alias of each select term, as returned by ``select_aliases``, to ``CONCAT``,
+        ``GROUP`` or the name of the aggregate function which combines the partial results, such as ``'SUM'``.
+    """
+    aggregates = _aggregates(query, field)
+    if aggregates is None:
+        method = GROUP if query._distinct else CONCAT
+        return OrderedDict((alias, method) for alias in query.select_aliases())
+
+    for term in query._groupbys:
+        if _select_index(query, term) is None:
+            raise QueryException('The partial results cannot be grouped by {term} again, since it is not selected.'
+                                 .format(term=term.get_sql()))
+
+    combination = OrderedDict()
+    for alias, term, aggregated in zip(query.select_aliases(), query._selects, aggregates):
+        if not aggregated:
+            combination[alias] = GROUP
+        elif isinstance(term, AggregateFunction) and term.combine is not None:
+            combination[alias] = term.combine
+        else:
+            raise QueryException('The partial results of {term} cannot be combined.'.format(term=term.get_sql()))
+
+    return combination
+
+
+def _aggregates(query, field=None):
+    """
+    Returns for each select term of a query whether it contains an aggregate, or ``None`` if the query does not
+    aggregate or groups by ``field``, so that the partial rows are concatenated.
+    """
+    for term in query._selects:
+        if any(isinstance(node, AnalyticFunction) and node._include_over for node in iter_terms(term)):
+            raise QueryException('A query with window functions cannot be executed over partitions of its rows.')
+
+    group_keys = [field_key(term) for term in query._groupbys if isinstance(term, Field)]
+    aggregates = [any(isinstance(node, AggregateFunction) for node in iter_terms(term)) for term in query._selects]
+
+    if not (query._groupbys or any(aggregates)) \
+            or (field is not None and field_key(field) in group_keys):
+        return None
+
+    if query._havings is not None:
+        raise QueryException('A HAVING clause cannot be evaluated over partitions of the groups of a query.')
+
+    return aggregates
+
+
+def combine(recombination, results):
+    """
+    Combines the results of a query executed over disjoint partitions of its rows into the result of the query over
+    all rows.
+
+    :param recombination:
+        The description of how to combine the results returned by ``recombination``.
+    :param results:
+        An iterable with the list of rows returned for each partition.  Each row is a sequence of values in the order
+        of the select terms.
+    :return:
+        A list of the combined rows as tuples.  Grouped rows are returned in the order their group first appears.
+    """
+    methods = list(recombination.values())
+    return Combiner(methods, [(None, [i]) for i in range(len(methods))]).combine(results)
+
+
+def decompose(query):
+    """
+    Rewrites an aggregating query into a partial query, which is executed over each partition of the rows, for
+    example on each shard, and a ``Combiner`` which merges the partial results into the result of the query.
+
+    Each aggregate is replaced with the partial aggregates it declares in its ``partials`` method.  For example
+    ``Avg(x)`` is replaced with ``Sum(x)`` and ``Count(x)``, ``Std(x)`` and ``StdDev(x)`` with the count, sum and sum of
+    squares of ``x``, and ``Count(x).distinct()`` with grouping by ``x``.
+
+    :param query:
+        Type: QueryBuilder
+
+        The query to decompose.  It may not be ordered, limited or have a HAVING clause, since these apply to the
+        combined rows.
+    :return:
+        A tuple of the partial query and the ``Combiner``.
+    """
+    if query._orderbys or query._limit is not None or query._offset is not None or query._top is not None \
+            or query._unions:
+        raise QueryException('An ordered or limited query cannot be decomposed.  Order the combined rows instead.')
+
+    aggregates = _aggregates(query)
+    if aggregates is None:
+        methods = [GROUP if query._distinct else CONCAT] * len(query._selects)
+        return copy.deepcopy(query), Combiner(methods, [(None, [i]) for i in range(len(methods))])
+
+    partial_query = copy.deepcopy(query)
+    terms, partial_query._selects = partial_query._selects, []
+    methods, finals = [], []
+    for term, aggregated in zip(terms, aggregates):
+        partials = term.partials() if isinstance(term, AggregateFunction) else [term] if not aggregated else None
+        if partials is None:
+            raise QueryException('{term} cannot be decomposed into partial aggregates.'.format(term=term.get_sql()))
+
+        finals.append((term if aggregated else None, list(range(len(methods), len(methods) + len(partials)))))
+        partial_query._selects += partials
+
+        for partial in partials:
+            if not aggregated:
+                methods.append(GROUP)
+            elif isinstance(partial, AggregateFunction):
+                methods.append(partial.combine)
+            else:
+                methods.append(DISTINCT)
+                partial_query._groupbys.append(partial)
+
+    # GROUP BY terms which are not selected are selected in the partial query, so that their groups are not merged
+    for term, partial in zip(query._groupbys, partial_query._groupbys):
+        if _select_index(query, term) is None:
+            methods.append(GROUP)
+            partial_query._selects.append(partial)
+
+    return partial_query, Combiner(methods, finals)
+
+
+class Combiner(object):
+    """
+    Merges the rows returned by a query for disjoint partitions of its rows, as returned by ``decompose``.  Partial
+    results of numeric aggregates are combined with NumPy when it is installed.
+
+    :param methods:
+        For each column of the partial rows, ``CONCAT``, ``GROUP``, ``DISTINCT`` or the name of the aggregate which
+        combines its values.
+    :param finals:
+        For each column of the combined rows, a tuple of the aggregate whose ``merge`` method computes it, or ``None``
+        to use the combined value directly, and the list of indices of the partial columns it is computed from.
+    """
+
+    def __init__(self, methods, finals):
+        self.methods = methods
+        self.finals = finals
+
+    def combine(self, results):
+        """
+        :param results:
+            An iterable with the list of rows returned for each partition.
+        :return:
+            A list of the combined rows as tuples.  Grouped rows are returned in the order their group first appears.
+        """
+        rows = [row for partial_rows in results for row in partial_rows]
+        if all(method == CONCAT for method in self.methods):
+            columns = list(zip(*rows)) if rows else [[] for _ in self.methods]
+            return self._merge(columns, len(rows))
+
+        keys = [i for i, method in enumerate(self.methods) if method == GROUP]
+        groups, inverse = OrderedDict(), []
+        for row in rows:
+            inverse.append(groups.setdefault(tuple(row[i] for i in keys), len(groups)))
+
+        if not keys and not groups:
+            # Aggregates without a GROUP BY clause return one row even when there are no rows to aggregate
+            groups[()] = 0
+
+        columns = [[key[keys.index(i)] for key in groups] if method == GROUP
+                   else _combine_column(method, [row[i] for row in rows], inverse, len(groups))
+                   for i, method in enumerate(self.methods)]
+        return self._merge(columns, len(groups))
+
+    def _merge(self, columns, size):
+        return [tuple(columns[indices[0]][row] if term is None else term.merge([columns[i][row] for i in indices])
+                      for term, indices in self.finals)
+                for row in range(size)]
+
+
+def _combine_column(method, values, inverse, size):
+    """
+    Combines the values of a partial column for each group.  ``inverse`` contains the index of the group of each
+    value.
+    """
+    if numpy is not None and method in _ufuncs and values:
+        array = numpy.array(values)
+        # Integer sums would silently wrap around, whereas Python integers do not overflow
+        if array.dtype.kind == 'f' or (array.dtype.kind in 'iu' and method != 'SUM'):
+            ufunc, initial = _ufuncs[method]
+            combined = numpy.full(size, initial(array), dtype=array.dtype)
+            ufunc.at(combined, numpy.array(inverse), array)
+            return combined.tolist()
+
+    groups = [[] for _ in range(size)]
+    for value, group in zip(values, inverse):
+        if value is not None:
+            groups[group].append(value)
+
+    if method == DISTINCT:
+        return [set(group) for group in groups]
+    return [_combiners[method](group) if group else None for group in groups]
+
+
+def push_down_order(query, vendor=None):
+    """
+    Prepares an ordered or limited query which is executed over several partitions of its rows, for example on each
+    shard, for a merge of the partial results.  The ORDER BY clause and the limit are pushed down into the query for
+    each partition, so that each partition returns at most ``offset + limit`` rows, already in order.  The returned
+    ``OrderedMerge`` streams the rows of all partitions in order with a k-way merge, reading only as many rows from
+    each partition as are needed.
+
+    The ORDER BY terms which are not selected by the query are added to the end of the SELECT clause of the query for
+    the partitions and removed from the merged rows.
+
+    :param query:
+        Type: QueryBuilder
+
+        The query to push down.  Aggregating queries must be decomposed with ``decompose`` first.
+    :param vendor:
+        (Optional) The database vendor of the partitions.  For ``'postgresql'`` and ``'oracle'`` nulls are ordered as
+        larger than any other value and otherwise as smaller.
+    :return:
+        A tuple of the query for the partitions and the ``OrderedMerge``.
+    """
+    if query._distinct or query._unions or _aggregates(query) is not None:
+        raise QueryException('Only queries which do not aggregate or select distinct rows can be merged in order.')
+
+    partition_query = copy.deepcopy(query)
+    indices = []
+    for field, _ in partition_query._orderbys:
+        index = _select_index(partition_query, field)
+        if index is None:
+            index = len(partition_query._selects)
+            partition_query._selects.append(field)
+        indices.append(index)
+
+    # The columns selected by a star are unknown, so columns after a star are indexed from the end of a row
+    stars = [i for i, term in enumerate(partition_query._selects) if isinstance(term, Star)]
+    if stars and any(stars[0] < index < stars[-1] for index in indices):
+        raise QueryException('Columns between two stars cannot be ordered by.')
+
+    size = len(partition_query._selects)
+    keys = [(index - size if stars and index > stars[-1] else index, order is Order.desc)
+            for index, (_, order) in zip(indices, partition_query._orderbys)]
+
+    offset = query._offset or 0
+    limit = query._limit if query._limit is not None else query._top
+    partition_query._offset = None
+    if query._limit is not None:
+        partition_query._limit = offset + query._limit
+
+    extra = size - len(query._selects)
+    return partition_query, OrderedMerge(keys, extra, offset, limit, nulls_last=vendor in _nulls_last_vendors)
+
+
+def _select_index(query, term):
+    sql = term.get_sql(with_quotes=True)
+    for i, select in enumerate(query._selects):
+        if select.get_sql(with_quotes=True) == sql or (isinstance(term, Field) and term.table is query._from
+                                                       and select.alias is not None and select.alias == term.name):
+            return i
+    return None
+
+
+class OrderedMerge(object):
+    """
+    Merges the ordered rows returned by a query for disjoint partitions of its rows, as returned by
+    ``push_down_order``.
+
+    :param keys:
+        A list of tuples of the index of a column in the partial rows to order by and whether it is descending.
+    :param extra:
+        The number of columns at the end of the partial rows which are only selected for ordering.
+    :param offset:
+        The number of merged rows to skip.
+    :param limit:
+        The maximum number of merged rows, or ``None``.
+    :param nulls_last:
+        Whether nulls are larger than any other value.
+    """
+
+    def __init__(self, keys, extra, offset, limit, nulls_last=False):
+        self.keys = keys
+        self.extra = extra
+        self.offset = offset
+        self.limit = limit
+        self.nulls_last = nulls_last
+
+    def merge(self, results):
+        """
+        Merges the rows of each partition in order.  This is a generator which reads the next row of a partition
+        only when the previous one has been yielded.
+
+        :param results:
+            A list with an iterable of the rows returned for each partition, such as DB-API cursors.
+        :return:
+            The merged rows as tuples.
+        """
+        heap = []
+        for i, rows in enumerate(results):
+            rows = iter(rows)
+            for row in rows:
+                heap.append((self._sort_key(row), i, row, rows))
+                break
+        heapq.heapify(heap)
+
+        position, end = 0, None if self.limit is None else self.offset + self.limit
+        while heap and (end is None or position < end):
+            _, i, row, rows = heap[0]
+            if position >= self.offset:
+                yield tuple(row[:len(row) - self.extra])
+            position += 1
+            if end is not None and position >= end:
+                return
+
+            for row in rows:
+                heapq.heapreplace(heap, (self._sort_key(row), i, row, rows))
+                break
+            else:
+                heapq.heappop(heap)
+
+    def _sort_key(self, row):
+        key = []
+        for index, descending in self.keys:
+            value = (1 if self.nulls_last else -1, None) if row[index] is None else (0, row[index])
+            key.append(_Descending(value) if descending else value)
+        return tuple(key)
+
+
+class _Descending(object):
+    """
+    Reverses the order of a value in a sort key.
+    """
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+
+def merge_queries(queries):
+    """
+    Merges queries which differ only in their SELECT clause into one query, so that the rows they read are scanned
+    once.  Queries are merged when everything but their SELECT clause renders the same: the FROM, JOIN, WHERE, GROUP BY,
+    HAVING and ORDER BY clauses and the limit, and when either both or neither of them aggregate.  The merged query
+    selects each distinct select term of its queries once.  Queries which select a star, are DISTINCT, have unions or
+    insert rows are not merged with others, and neither are queries which use the same alias for different terms.
+
+    :param queries:
+        A list of ``QueryBuilder``.
+    :return:
+        A tuple of the list of merged queries, one for each set of queries which were merged, and the ``Splitter`` which
+        splits their results into the results of the given queries.
+    """
+    merged = []
+    selections = []
+    for query in queries:
+        signature = _merge_signature(query)
+        target = None
+        if signature is not None:
+            target = next((candidate for candidate in merged
+                           if candidate.signature == signature and candidate.accepts(query)), None)
+
+        if target is None:
+            target = _MergedQuery(signature, query)
+            merged.append(target)
+
+        selections.append((merged.index(target), target.add(query)))
+
+    return [target.query for target in merged], Splitter(selections)
+
+
+def _merge_signature(query):
+    """
+    Returns the SQL of a query without its SELECT clause and whether the query aggregates, or ``None`` if the query
+    cannot be merged.  An aggregating query returns one row per group, or a single row, so it cannot be merged with a
+    query that returns every row even if the rest of their SQL is the same.
+    """
+    if query._insert_table is not None or query._unions or query._distinct or query._select_star \
+            or query._select_star_tables or any(isinstance(term, Star) for term in query._selects):
+        return None
+
+    aggregates = bool(query._groupbys) or any(isinstance(node, AggregateFunction) and not node._include_over
+                                              for term in query._selects for node in iter_terms(term))
+
+    shape = copy.deepcopy(query)
+    shape._selects = [Star()]
+    return shape.get_sql(), aggregates
+
+
+class _MergedQuery(object):
+    """
+    A query which selects the terms of the queries merged into it.  ``columns`` are the positions of the terms by
+    their key and ``aliases`` the keys of the terms by their alias.
+    """
+
+    def __init__(self, signature, query):
+        self.signature = signature
+        self.query = copy.deepcopy(query)
+        self.columns = {}
+        self.aliases = {}
+
+        if signature is not None:
+            self.query._selects = []
+
+    def accepts(self, query):
+        return all(self.aliases.get(term.alias, key) == key
+                   for term, key in _select_keys(query)
+                   if term.alias)
+
+    def add(self, query):
+        """
+        Adds the select terms of a query and returns their positions in the merged query, or ``None`` if the query is
+        not merged and its rows are returned as they are.
+        """
+        if self.signature is None:
+            return None
+
+        # The queries have the same FROM and JOIN clauses, so their tables correspond by position
+        tables = dict(zip(query._selectables, self.query._selectables.values()))
+
+        indexes = []
+        for term, key in _select_keys(query):
+            if key not in self.columns:
+                term = copy.deepcopy(term)
+                for field in term.fields():
+                    field.table = tables.get(getattr(field.table, 'item_id', None), self.query._from)
+
+                self.columns[key] = len(self.query._selects)
+                self.query._selects.append(term)
+            if term.alias:
+                self.aliases.setdefault(term.alias, key)
+            indexes.append(self.columns[key])
+        return indexes
+
+
+def _select_keys(query):
+    """
+    Returns the select terms of a query with a key which is the same for equal terms of queries with the same FROM and
+    JOIN clauses: the SQL of the term and the positions of the tables of its fields.
+    """
+    positions = dict((item_id, i) for i, item_id in enumerate(query._selectables))
+    return [(term, (term.get_sql(with_alias=False),
+                    tuple(positions.get(getattr(field.table, 'item_id', None), 0) for field in term.fields())))
+            for term in query._selects]
+
+
+class Splitter(object):
+    """
+    Splits the results of the queries returned by ``merge_queries`` into the results of the queries which were merged.
+    ``selections`` are the position of the merged query of each query and the positions of its columns in the rows of
+    the merged query.
+    """
+
+    def __init__(self, selections):
+        self.selections = selections
+
+    def split(self, results):
+        """
+        :param results:
+            A list with an iterable of the rows returned for each merged query.
+        :return:
+            A list with the list of rows of each query, in the order of the queries given to ``merge_queries``.
+        """
+        results = [list(rows) for rows in results]
+
+        split = []
+        for index, columns in self.selections:
+            if columns is None:
+                split.append([tuple(row) for row in results[index]])
+            elif len(columns) == 1:
+                split.append([(row[columns[0]],) for row in results[index]])
+            else:
+                getter = itemgetter(*columns)
+                split.append([getter(row) for row in results[index]])
+        return split
+
+
+def route(query):
+    """
+    Routes a query on ``ShardedTable`` to the shards it touches.  The shards are determined by the equality and IN
+    criteria on the shard keys in the WHERE clause.  The IN lists are split so that each shard only receives the
+    values which belong to it.  A query without such criteria is sent to every shard.
+
+    The sharded tables of a query must have the same shards, that is they must be sharded alike, so that rows which
+    are joined are stored on the same shard.  In the query for each shard, the sharded tables are renamed to their
+    name in that shard.
+
+    :param query:
+        Type: QueryBuilder
+
+        The query to route.
+    :return:
+        A list of tuples of a shard and the query to execute on it, in the order of the shards of the tables.
+    """
+    from pypika.queries import QueryBuilder, ShardedTable
+
+    tables = [item for item in query._selectables.values() if isinstance(item, ShardedTable)]
+    if not tables:
+        raise QueryException('The query does not select from a sharded table.')
+
+    shards = tables[0].shards
+    if any(table.shards != shards for table in tables[1:]):
+        raise QueryException('The sharded tables of a query must have the same shards.')
+
+    for node in iter_terms(query):
+        if isinstance(node, QueryBuilder) and node is not query \
+                and any(isinstance(item, ShardedTable) for item in node._selectables.values()):
+            raise QueryException('Sharded tables in subqueries cannot be routed.')
+
+    conjuncts = split_conjuncts(query._wheres) if query._wheres is not None else []
+    targets = set(shards)
+    splits = {}
+    for i, criterion in enumerate(conjuncts):
+        key_values = _shard_key_values(criterion, tables)
+        if key_values is None:
+            continue
+
+        table, values = key_values
+        values_by_shard = OrderedDict()
+        for value in values:
+            values_by_shard.setdefault(table.shard_function(value), []).append(value)
+
+        targets &= set(values_by_shard)
+        if isinstance(criterion, ContainsCriterion):
+            splits[i] = values_by_shard
+
+    routed = []
+    for shard in shards:
+        if shard not in targets:
+            continue
+
+        shard_query = copy.deepcopy(query)
+        shard_conjuncts = split_conjuncts(shard_query._wheres) if splits else []
+        for i, values_by_shard in splits.items():
+            shard_conjuncts[i].container = ListField([ValueWrapper(value) for value in values_by_shard[shard]])
+
+        for item in shard_query._selectables.values():
+            if isinstance(item, ShardedTable):
+                item.table_name = item.shard_name(shard)
+
+        routed.append((shard, shard_query))
+
+    return routed
+
+
+def _shard_key_values(criterion, tables):
+    """
+    Returns a tuple of the sharded table and the list of values of its shard key that a criterion restricts the shard
+    key to, or ``None``.
+    """
+    if isinstance(criterion, ContainsCriterion):
+        if criterion._is_negated or not isinstance(criterion.container, ListField) \
+                or not all(isinstance(value, ValueWrapper) for value in criterion.container.values):
+            return None
+        field, values = criterion.field, [value.value for value in criterion.container.values]
+
+    else:
+        normalized = normalize_comparison(criterion)
+        if normalized is None or normalized[0] is not Equality.eq:
+            return None
+        _, field, value = normalized
+        values = [value]
+
+    if not isinstance(field, Field):
+        return None
+
+    for table in tables:
+        if field_key(field) == (table.item_id, table.shard_key):
+            return table, values
+
+    return None
+
+
+def split_boundaries(lower, upper, n):
+    """
+    Computes the boundaries which split the range ``[lower, upper]`` into ``n`` ranges of equal width.  Works with
+    numbers, dates and datetimes.  Boundaries which are repeated because the range is too narrow are dropped.
+
+    :return:
+        A list of up to ``n - 1`` increasing boundaries.
+    """
+    boundaries = []
+    for i in range(1, n):
+        step = (upper - lower) * i
+        boundary = lower + (step / n if isinstance(step, float) else step // n)
+        if lower < boundary and (not boundaries or boundaries[-1] < boundary):
+            boundaries.append(boundary)
+    return boundaries
+
+
+def range_criteria(field, boundaries):
+    """
+    Builds the range criteria on ``field`` for the partitions between the given increasing boundaries.  The first
+    partition is unbounded below and also contains the rows where ``field`` is null, and the last partition is
+    unbounded above, so that together the partitions contain every row.
+
+    :return:
+        A list of ``len(boundaries) + 1`` criteria.
+    """
+    if not boundaries:
+        return [None]
+
+    criteria = [(field < boundaries[0]) | field.isnull()]
+    criteria += [(field >= lower) & (field < upper) for lower, upper in zip(boundaries, boundaries[1:])]
+    criteria.append(field >= boundaries[-1])
+    return criteria
+
+
+def where_bounds(query, field):
+    """
+    Finds the lower and upper bounds of ``field`` implied by the range criteria of the WHERE clause of a query.
+
+    :return:
+        A tuple of the lower and upper bound, either of which is ``None`` if it is not constrained.
+    """
+    lower, _, upper, _ = _where_range(query, field)
+    return lower, upper
+
+
+def _where_range(query, field):
+    """
+    Returns a tuple of the lower bound of ``field`` in the WHERE clause of a query, whether the lower bound is
+    exclusive, the upper bound and the list of the conjuncts of the WHERE clause which constrain the range of ``field``.
+    """
+    lower, lower_exclusive, upper, conjuncts = None, False, None, []
+    if query._wheres is None:
+        return lower, lower_exclusive, upper, conjuncts
+
+    key = field_key(field)
+    for criterion in split_conjuncts(query._wheres):
+        if isinstance(criterion, BetweenCriterion):
+            if isinstance(criterion.field, Field) and field_key(criterion.field) == key:
+                lower, lower_exclusive = param_value(criterion.start), False
+                upper = param_value(criterion.end)
+                conjuncts.append(criterion)
+            continue
+
+        normalized = normalize_comparison(criterion)
+        if normalized is None or not isinstance(normalized[1], Field) or field_key(normalized[1]) != key:
+            continue
+
+        comparator, _, value = normalized
+        if comparator in (Equality.gt, Equality.gte):
+            lower, lower_exclusive = value, comparator is Equality.gt
+            conjuncts.append(criterion)
+        elif comparator in (Equality.lt, Equality.lte):
+            upper = value
+            conjuncts.append(criterion)
+
+    lower, upper = (as_date(value) if isinstance(value, str) else value
+                    for value in (lower, upper))
+    return lower, lower_exclusive, upper, conjuncts
+
+
+class TimeBucket(object):
+    """
+    A query over the rows of a calendar period, as returned by ``split_by_period``.
+
+    ``start`` and ``end`` are the bounds of the half-open period.  ``complete`` is true when the period has ended and
+    the result of the query will not change anymore, so that it can be cached.  ``clipped`` is true when the period
+    is only partially covered by the range of the original query, in which case the query also contains the criteria
+    of the range.
+    """
+
+    def __init__(self, start, end, query, complete, clipped):
+        self.start = start
+        self.end = end
+        self.query = query
+        self.complete = complete
+        self.clipped = clipped
+
+    def __repr__(self):
+        return 'TimeBucket({start!r}, {end!r}, complete={complete!r})'.format(
+            start=self.start, end=self.end, complete=self.complete)
+
+
+def split_by_period(query, field, period, now=None):
+    """
+    Splits a query with a range criterion on a date field into queries over calendar periods, such as days, weeks
+    (starting on Monday) or months, so that the results for periods which have ended can be cached and only the
+    current period needs to be queried again.
+
+    The queries for periods covered entirely by the range of the original query do not contain its range criteria, so
+    the same query is generated for a period regardless of the range it was split from, for example for a sliding
+    range like the last 30 days.
+
+    :param query:
+        Type: QueryBuilder
+
+        The query to split.  Its WHERE clause must contain a ``BetweenCriterion`` or a lower bound on ``field``.
+    :param field:
+        The date or datetime field to split the query by.
+    :param period:
+        ``DatePart.day``, ``DatePart.week``, ``DatePart.month``, ``DatePart.quarter`` or ``DatePart.year``.
+    :param now:
+        (Optional) The current date or datetime.  Periods which end after ``now`` are not complete.  Queries without
+        an upper bound on ``field`` are split up to ``now``.  Defaults to the current time.
+    :return:
+        A tuple of the list of ``TimeBucket`` in chronological order and the description of how to combine their
+        results returned by ``recombination``.
+    """
+    if period is not DatePart.day and period is not DatePart.week and period not in _months:
+        raise QueryException('A query cannot be split by {period}.'.format(period=period))
+
+    if query._limit is not None or query._offset is not None or query._top is not None or query._unions:
+        raise QueryException('A query with a limit or a union cannot be split.')
+
+    lower, lower_exclusive, upper, conjuncts = _where_range(query, field)
+    if not isinstance(lower, date):
+        raise QueryException('The query must have a lower bound on {field} to be split into periods.'.format(
+            field=field.get_sql(with_quotes=False)))
+
+    if isinstance(lower, datetime) or isinstance(upper, datetime):
+        lower, upper, now = (_as_datetime(value) for value in (lower, upper, now or datetime.now()))
+    elif now is None or isinstance(now, datetime):
+        # A period of dates has ended when its end is not after the current date
+        now = (now or datetime.now()).date()
+
+    # The query for the periods covered entirely by the range, without the criteria of the range
+    unbounded = copy.deepcopy(query)
+    unbounded._wheres = conjoin([criterion for criterion in split_conjuncts(query._wheres)
+                                 if all(criterion is not conjunct for conjunct in conjuncts)])
+
+    last = upper if upper is not None else now
+
+    buckets = []
+    start = _period_start(lower, period)
+    while start < last or (start == last and (upper is None or _inclusive_upper(conjuncts))):
+        end = _period_end(start, period)
+        clipped = (start <= lower if lower_exclusive else start < lower) or (upper is not None and upper < end)
+        bucket_query = query if clipped else unbounded
+        buckets.append(TimeBucket(start, end, bucket_query.where((field >= start) & (field < end)),
+                                  complete=end <= now, clipped=clipped))
+        start = end
+
+    return buckets, recombination(query, field)
+
+
+def _as_datetime(value):
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.combine(value, time())
+
+
+def _inclusive_upper(conjuncts):
+    return any(isinstance(criterion, BetweenCriterion) or normalize_comparison(criterion)[0] is Equality.lte
+               for criterion in conjuncts)
+
+
+def _period_start(value, period):
+    day = value.replace(hour=0, minute=0, second=0, microsecond=0) if isinstance(value, datetime) else value
+
+    if period is DatePart.day:
+        return day
+    if period is DatePart.week:
+        return day - timedelta(days=day.weekday())
+
+    months = _months[period]
+    return day.replace(month=(day.month - 1) // months * months + 1, day=1)
+
+
+def _period_end(start, period):
+    if period is DatePart.day:
+        return start + timedelta(days=1)
+    if period is DatePart.week:
+        return start + timedelta(days=7)
+    return add_months(start, _months[period])
@@ -1,15 +1,48 @@
 # coding: utf8
+import copy
+import re
 import uuid
 from collections import OrderedDict
+from functools import reduce
 
-from pypika.enums import JoinType, UnionType
-from pypika.utils import JoinException, UnionException, RollupException
+from aenum import Enum
+
+from pypika.enums import JoinType, UnionType, Order
+from pypika.utils import JoinException, UnionException, RollupException, QueryException, GroupingException
 from pypika.utils import builder
-from .terms import Field, Star, Term, Function, ArithmeticExpression, Rollup
+from .terms import Field, Star, Term, Function, ArithmeticExpression, Rollup, Cube, GroupingSets, ValueWrapper, Tuple
+from .terms import iter_terms
 
 __author__ = "Timothy Heys"
 __email__ = "theys@kayak.com"
 
+# Vendors which do not support CUBE and GROUPING SETS
+_no_grouping_sets_vendors = ('mysql', 'sqlite')
+
+# Vendors which use OFFSET ... FETCH NEXT ... instead of LIMIT ... OFFSET ...
+_fetch_next_vendors = ('mssql', 'oracle')
+
+# The LIMIT which is used by vendors that do not allow OFFSET without a LIMIT
+_no_limit = {
+    'mysql': '18446744073709551615',
+    'sqlite': '-1',
+}
+
+# Vendors which do not support comparing row values
+_no_row_value_vendors = ('mssql', 'oracle')
+
+# The placeholder for the i-th parameter of a query in each DB-API paramstyle
+_placeholders = {
+    'qmark': lambda i: '?',
+    'format': lambda i: '%s',
+    'numeric': lambda i: ':{}'.format(i + 1),
+    'named': lambda i: ':p{}'.format(i),
+    'pyformat': lambda i: '%(p{})s'.format(i),
+}
+
+# Marks the parameters in the SQL of a query before they are replaced by placeholders
+_parameter_marker = re.compile('\x00(\\d+)\x00')
+
 
 class Selectable(object):
     def __init__(self, alias):
@@ -35,10 +68,22 @@ class Selectable(object):
 
 
 class Table(Selectable):
-    def __init__(self, name, schema=None):
+    def __init__(self, name, schema=None, unique_keys=None):
+        """
+        :param name:
+            The name of the table.
+        :param schema:
+            (Optional) The schema the table belongs to.
+        :param unique_keys:
+            (Optional) A list of column names or tuples of column names which uniquely identify a row in the table,
+            such as the primary key.  This is used as a hint by rewrites that need to know whether a join can
+            match more than one row.
+        """
         super(Table, self).__init__(None)
         self.table_name = name
         self.schema = schema
+        self.unique_keys = [(key,) if isinstance(key, str) else tuple(key)
+                            for key in unique_keys or []]
 
     def get_sql(self, **kwargs):
         # FIXME escape
@@ -72,6 +117,179 @@ class Table(Selectable):
         return self.get_sql()
 
 
+class ShardedTable(Table):
+    def __init__(self, name, shard_key, shard_function, shards, schema=None, unique_keys=None, table_format=None):
+        """
+        A table whose rows are partitioned across several shards by the value of a column, the shard key.  Queries
+        on sharded tables are routed to the shards they touch with ``pypika.partitions.route``.
+
+        :param name:
+            The name of the table.
+        :param shard_key:
+            The name of the column which determines the shard of a row.
+        :param shard_function:
+            A function which returns the shard of a row given its value of the shard key.
+        :param shards:
+            A list of all of the shards.  Shards can be any hashable value, such as a database name.
+        :param schema:
+            (Optional) The schema the table belongs to.
+        :param unique_keys:
+            (Optional) See ``Table``.
+        :param table_format:
+            (Optional) A format string for the name of the table in a shard with the ``name`` and ``shard`` keys,
+            such as ``'{name}_{shard}'``.  By default the table has the same name in every shard.
+        """
+        super(ShardedTable, self).__init__(name, schema=schema, unique_keys=unique_keys)
+        self.shard_key = shard_key
+        self.shard_function = shard_function
+        self.shards = list(shards)
+        self.table_format = table_format
+
+    def shard_name(self, shard):
+        """
+        Returns the name of this table in the given shard.
+        """
+        if self.table_format is None:
+            return self.table_name
+        return self.table_format.format(name=self.table_name, shard=shard)
+
+
+class AliasedQuery(Selectable):
+    """
+    A reference to a query by name, such as a common table expression defined with ``QueryBuilder.with_``.
+    """
+
+    def __init__(self, name, query=None):
+        """
+        :param name:
+            The name the query is referenced by.
+        :param query:
+            (Optional) The query which is named.  This is only required when defining a common table expression.
+        """
+        super(AliasedQuery, self).__init__(None)
+        self.query_name = name
+        self.query = query
+
+    def get_sql(self, **kwargs):
+        if self.alias:
+            return "\"{name}\" \"{alias}\"".format(
+                name=self.query_name,
+                alias=self.alias,
+            )
+
+        return "\"{name}\"".format(
+            name=self.query_name,
+        )
+
+    def get_with_sql(self):
+        return '"{name}" AS ({query})'.format(
+            name=self.query_name,
+            query=self.query.get_sql(with_unions=True),
+        )
+
+    def __str__(self):
+        return self.get_sql()
+
+
+class RecursiveCTE(AliasedQuery):
+    """
+    A recursive common table expression, which is rendered in a ``WITH RECURSIVE`` clause.  It is defined by an anchor
+    query which selects the first rows and a recursive member which joins back to the expression to select the rows
+    of the next level.  All rows are combined with ``UNION ALL``.
+
+    .. code-block:: python
+
+        tree = RecursiveCTE('tree', Query.from_(categories).select(categories.id).where(categories.id == 1))
+        tree = tree.recursive(
+            Query.from_(categories).join(tree).on(categories.parent_id == tree.id).select(categories.id)
+        )
+
+        query = Query.with_(tree).from_(tree).select('*')
+    """
+
+    def __init__(self, name, anchor, depth=None, max_depth=None, columns=None):
+        """
+        :param name:
+            The name the expression is referenced by.
+        :param anchor:
+            Type: Query
+
+            The query which selects the first level of rows.
+        :param depth:
+            (Optional) The name of a column to add to the expression containing the recursion depth of each row,
+            starting at 0 for the rows selected by the anchor.
+        :param max_depth:
+            (Optional) The maximum recursion depth.  Requires ``depth``.
+        :param columns:
+            (Optional) A list of names for the columns of the expression.  By default, the names of the fields
+            selected by the anchor are used when a column list is required.
+        """
+        if max_depth is not None and depth is None:
+            raise QueryException('A depth column is required to limit the recursion depth.')
+
+        super(RecursiveCTE, self).__init__(name, anchor)
+        self._anchor = anchor
+        self._depth = depth
+        self._max_depth = max_depth
+        self._columns = columns
+
+    @builder
+    def recursive(self, query):
+        """
+        Sets the recursive member of the expression.
+
+        :param query:
+            Type: Query
+
+            The query which selects the next level of rows.  It must select from or join this expression.
+
+        :returns
+            A copy of the expression with the recursive member set.
+        """
+        reference = query._selectables.get(self.item_id)
+        if reference is None:
+            raise JoinException('The recursive member of [%s] must select from or join it.' % self.query_name)
+
+        anchor = self._anchor
+        if self._depth is not None:
+            depth = Field(self._depth, table=reference)
+            anchor = anchor.select(ValueWrapper(0))
+            query = query.select(depth + 1)
+
+            if self._max_depth is not None:
+                query = query.where(depth < self._max_depth)
+
+        self.query = anchor.union_all(query)
+
+    def get_with_sql(self):
+        return '"{name}"{columns} AS ({query})'.format(
+            name=self.query_name,
+            columns=self._columns_sql(),
+            query=self.query.get_sql(with_unions=True),
+        )
+
+    def _columns_sql(self):
+        columns = self._columns
+        if columns is None and self._depth is None:
+            return ''
+
+        if columns is None:
+            columns = []
+            for term in self._anchor._selects:
+                if not (isinstance(term, Field) and not isinstance(term, Star) or term.alias):
+                    raise QueryException('Cannot determine the column name of [%s] in the anchor of [%s].  '
+                                         'Use an alias or set the columns of the expression.'
+                                         % (term, self.query_name))
+                columns.append(term.alias or term.name)
+
+        if self._depth is not None and self._depth not in columns:
+            columns = list(columns) + [self._depth]
+
+        return '({columns})'.format(
+            columns=','.join('"{}"'.format(column) for column in columns)
+        )
+
+
 def make_tables(*names, **kwargs):
     return [Table(name, schema=kwargs.get('schema')) for name in names]
 
@@ -114,6 +332,25 @@ class Query(object):
         """
         return QueryBuilder().into(table)
 
+    @staticmethod
+    def with_(selectable, name=None):
+        """
+        Query builder entry point.  Initializes query building with a common table expression.  The expression can be
+        selected from by passing an ``AliasedQuery`` with the same name to ``from_`` or ``join``.
+
+        :param selectable:
+            Type: Query or RecursiveCTE
+
+            The query to name, or a recursive expression.
+        :param name:
+            Type: str
+
+            The name of the common table expression.  Not required for a recursive expression.
+
+        :returns QueryBuilder
+        """
+        return QueryBuilder().with_(selectable, name)
+
     @staticmethod
     def select(*terms):
         """
@@ -144,6 +381,7 @@ class QueryBuilder(Selectable, Term):
 
         self._from = None
         self._insert_table = None
+        self._with = []
 
         self._selects = []
         self._columns = []
@@ -157,6 +395,11 @@ class QueryBuilder(Selectable, Term):
         self._joins = []
         self._unions = []
 
+        self._limit = None
+        self._offset = None
+        self._top = None
+        self._limit_vendor = None
+
         self._select_star = False
         self._select_star_tables = set()
         self._mysql_rollup = False
@@ -182,6 +425,32 @@ class QueryBuilder(Selectable, Term):
         self._from = Table(selectable) if isinstance(selectable, str) else selectable
         self._selectables[self._from.item_id] = self._from
 
+    @builder
+    def with_(self, selectable, name=None):
+        """
+        Adds a common table expression to the query which is rendered in a ``WITH`` clause.  The expression can be
+        selected from by passing an ``AliasedQuery`` with the same name to ``from_`` or ``join``.
+
+        :param selectable:
+            Type: ``Query`` or ``RecursiveCTE``
+
+            The query to name, or a recursive expression.
+        :param name:
+            Type: ``str``
+
+            The name of the common table expression.  Not required for a recursive expression.
+
+        :returns
+            A copy of the query with the common table expression added.
+        """
+        if isinstance(selectable, RecursiveCTE):
+            if selectable.query is selectable._anchor:
+                raise QueryException('The recursive member of [%s] must be set before it is used.'
+                                     % selectable.query_name)
+            self._with.append(selectable)
+        else:
+            self._with.append(AliasedQuery(name, selectable))
+
     @builder
     def into(self, table):
         if self._insert_table is not None:
@@ -279,6 +548,46 @@ class QueryBuilder(Selectable, Term):
         else:
             self._groupbys.append(Rollup(*fields))
 
+    @builder
+    def cube(self, *fields, **kwargs):
+        """
+        Adds a ``CUBE`` modifier to the GROUP BY clause, which aggregates over every combination of the given fields.
+
+        :param fields:
+            The fields to group by.
+        :param vendor:
+            (Optional) The database vendor the query is written for.  Raises a ``GroupingException`` for vendors which
+            do not support ``CUBE``.
+
+        :returns
+            A copy of the query with the modifier added.
+        """
+        self._check_grouping_sets_vendor('CUBE', kwargs.get('vendor'))
+        self._groupbys.append(self._replace_table_ref(Cube(*fields)))
+
+    @builder
+    def grouping_sets(self, *groups, **kwargs):
+        """
+        Adds a ``GROUPING SETS`` modifier to the GROUP BY clause, which aggregates over each of the given groups.
+
+        :param groups:
+            Each group is either a single field or a list or tuple of fields.  An empty tuple is the grand total.
+        :param vendor:
+            (Optional) The database vendor the query is written for.  Raises a ``GroupingException`` for vendors which
+            do not support ``GROUPING SETS``.
+
+        :returns
+            A copy of the query with the modifier added.
+        """
+        self._check_grouping_sets_vendor('GROUPING SETS', kwargs.get('vendor'))
+        self._groupbys.append(self._replace_table_ref(GroupingSets(*groups)))
+
+    @staticmethod
+    def _check_grouping_sets_vendor(modifier, vendor):
+        if vendor in _no_grouping_sets_vendors:
+            raise GroupingException('{modifier} is not supported by {vendor}.'.format(modifier=modifier,
+                                                                                       vendor=vendor))
+
     @builder
     def orderby(self, *fields, **kwargs):
         for field in fields:
@@ -290,12 +599,192 @@ class QueryBuilder(Selectable, Term):
             self._orderbys.append((field, kwargs.get('order')))
 
     @builder
-    def join(self, item, how=JoinType.left):
-        if isinstance(item, Table):
-            return TableJoiner(self, item, how)
+    def limit(self, limit, **kwargs):
+        """
+        Limits the number of rows returned by the query.
+
+        :param limit:
+            The maximum number of rows.
+        :param vendor:
+            (Optional) The database vendor the query is written for.  For ``'mssql'`` and ``'oracle'`` the limit is
+            rendered as ``OFFSET ... ROWS FETCH NEXT ... ROWS ONLY``, which requires an ORDER BY clause.
+
+        :returns
+            A copy of the query with the limit set.
+        """
+        self._limit = limit
+        self._limit_vendor = kwargs.get('vendor', self._limit_vendor)
+
+    @builder
+    def offset(self, offset, **kwargs):
+        """
+        Skips a number of rows before rows are returned by the query.
+
+        :param offset:
+            The number of rows to skip.
+        :param vendor:
+            (Optional) The database vendor the query is written for.  See ``limit``.
+
+        :returns
+            A copy of the query with the offset set.
+        """
+        self._offset = offset
+        self._limit_vendor = kwargs.get('vendor', self._limit_vendor)
+
+    @builder
+    def top(self, top):
+        """
+        Limits the number of rows returned by the query with a ``TOP`` clause as used by MSSQL.
+
+        :param top:
+            The maximum number of rows.
+
+        :returns
+            A copy of the query with the limit set.
+        """
+        self._top = top
+
+    def iter_pages(self, key_fields, page_size, **kwargs):
+        """
+        Generates queries which return the rows of this query in pages of ``page_size`` rows using keyset pagination.
+        Each page is selected with a range criterion on the key fields that continues after the last row of the
+        previous page, so every page costs about the same regardless of its position, unlike with ``OFFSET``.
+
+        This is a generator.  The first value is the query for the first page.  To get the query for the next page,
+        send the values of the key fields in the last row of the current page.  The generator stops when ``None`` is
+        sent.
+
+        .. code-block:: python
+
+            pages = query.iter_pages([table.id], 100)
+            page = next(pages)
+            while True:
+                rows = execute(page)
+                if len(rows) < 100:
+                    break
+                page = pages.send([rows[-1][0]])
+
+        :param key_fields:
+            A list of fields which uniquely identify a row of this query.  The rows are ordered by these fields.
+        :param page_size:
+            The number of rows in each page.
+        :param order:
+            (Optional) ``Order.asc`` or ``Order.desc``.  Defaults to ascending.
+        :param vendor:
+            (Optional) The database vendor the query is written for.  For vendors which do not support row value
+            comparisons, such as ``'mssql'`` and ``'oracle'``, the comparison is expanded into a disjunction.
+        """
+        if self._orderbys:
+            raise QueryException('A query that is already ordered cannot be paginated by key.')
+
+        order = kwargs.get('order') or Order.asc
+        vendor = kwargs.get('vendor')
+        first_page = self.orderby(*key_fields, order=order).limit(page_size, vendor=vendor)
+
+        last_values = yield first_page
+        while last_values is not None:
+            last_values = yield first_page.where(self._seek_criterion(key_fields, last_values, order, vendor))
+
+    @staticmethod
+    def _seek_criterion(key_fields, last_values, order, vendor):
+        if len(key_fields) != len(last_values):
+            raise QueryException('A value is required for each key field to get the next page.')
+
+        after = (lambda term, value: term > value) if order == Order.asc else (lambda term, value: term < value)
+
+        if len(key_fields) == 1:
+            return after(key_fields[0], last_values[0])
+
+        if vendor not in _no_row_value_vendors:
+            return after(Tuple(*key_fields), Tuple(*last_values))
+
+        # (k1, k2) > (v1, v2) is equivalent to k1 > v1 OR (k1 = v1 AND k2 > v2)
+        return reduce(lambda left, right: left | right, [
+            reduce(lambda left, right: left & right,
+                   [field == value for field, value in zip(key_fields[:i], last_values[:i])]
+                   + [after(key_fields[i], last_values[i])])
+            for i in range(len(key_fields))
+        ])
+
+    def split(self, field, n=None, boundaries=None, lower=None, upper=None):
+        """
+        Splits this query into queries over disjoint ranges of ``field``, which together select every row of this
+        query, so that a large scan can be executed in parallel on several connections.
+
+        The ranges are either given as a list of increasing ``boundaries`` or computed by splitting the range of
+        ``field`` into ``n`` ranges of equal width.  The range is given by ``lower`` and ``upper`` or else taken from
+        the range criteria on ``field`` in the WHERE clause.  The first and last ranges are unbounded and the first
+        range also contains null values, so rows outside of the range are not lost.
+
+        .. code-block:: python
+
+            queries, recombination = query.split(table.id, 4, lower=0, upper=1000000)
+
+        :param field:
+            The numeric or date field to split the query by.
+        :param n:
+            (Optional) The number of queries to split this query into.  Fewer queries are returned if the range is
+            too narrow.
+        :param boundaries:
+            (Optional) A list of increasing values of ``field`` at which to split the query.
+        :param lower:
+            (Optional) The lowest value of ``field`` when splitting into ``n`` queries.
+        :param upper:
+            (Optional) The highest value of ``field`` when splitting into ``n`` queries.
+
+        :returns
+            A tuple of the list of queries and the description of how to combine their results returned by
+            ``pypika.partitions.recombination``.
+        """
+        from pypika import partitions
+
+        if self._limit is not None or self._offset is not None or self._top is not None or self._unions:
+            raise QueryException('A query with a limit or a union cannot be split.')
+
+        if boundaries is None:
+            if n is None or n < 1:
+                raise QueryException('Either a number of queries or the boundaries are required to split a query.')
+
+            where_lower, where_upper = partitions.where_bounds(self, field)
+            lower = where_lower if lower is None else lower
+            upper = where_upper if upper is None else upper
+            if n > 1 and (lower is None or upper is None):
+                raise QueryException('The range of {field} is required to split the query into {n} queries.'.format(
+                    field=field.get_sql(with_quotes=False), n=n))
+
+            boundaries = partitions.split_boundaries(lower, upper, n)
+
+        elif any(not low < high for low, high in zip(boundaries, boundaries[1:])):
+            raise QueryException('The boundaries to split a query at must be increasing.')
+
+        combination = partitions.recombination(self, field)
+        queries = [copy.deepcopy(self) if criterion is None else self.where(criterion)
+                   for criterion in partitions.range_criteria(field, boundaries)]
+        return queries, combination
+
+    @builder
+    def join(self, item, how=JoinType.left, unique=False):
+        """
+        Joins a table or subquery to the query.  Returns a ``Joiner`` on which ``on`` must be called with the join
+        criterion.
+
+        :param item:
+            Type: ``Table`` or ``Query``
+        :param how:
+            Type: ``JoinType``
+
+            The type of join.  Defaults to ``JoinType.left``.
+        :param unique:
+            Declares that the join matches at most one row of ``item`` for each row of the query.
+
+        :returns
+            A ``Joiner`` for the table or subquery.
+        """
+        if isinstance(item, (Table, AliasedQuery)):
+            return TableJoiner(self, item, how, unique)
 
         elif isinstance(item, QueryBuilder):
-            return SubqueryJoiner(self, item, how)
+            return SubqueryJoiner(self, item, how, unique)
 
         raise ValueError("Cannot join on type '%s'" % type(item))
 
@@ -370,9 +859,36 @@ class QueryBuilder(Selectable, Term):
         """
         return self._list_aliases(self._groupbys)
 
-    def do_join(self, item, criterion, how):
+    def tables_read(self):
+        """
+        Gets the tables this query reads from, in its FROM and JOIN clauses and in those of its subqueries, common table
+        expressions and unions, including subqueries in criteria such as ``isin`` and ``exists``.  Common table
+        expressions themselves are not tables.
+
+        :return:
+            A set of the (name, schema) of each table.
+        """
+        return set((selectable.table_name, selectable.schema)
+                   for root in [self] + [value for row in self._values for value in row]
+                   for node in iter_terms(root)
+                   if isinstance(node, QueryBuilder)
+                   for selectable in node._selectables.values()
+                   if isinstance(selectable, Table))
+
+    def tables_written(self):
+        """
+        Gets the tables this query writes to, which is the table of an INSERT query.
+
+        :return:
+            A set of the (name, schema) of each table.
+        """
+        if self._insert_table is None:
+            return set()
+        return {(self._insert_table.table_name, self._insert_table.schema)}
+
+    def do_join(self, item, criterion, how, unique=False):
         self._selectables[item.item_id] = item
-        self._joins.append(Join(item.item_id, criterion, how))
+        self._joins.append(Join(item.item_id, criterion, how, unique))
 
         for field in criterion.fields():
             self._replace_table_ref(field)
@@ -421,6 +937,9 @@ class QueryBuilder(Selectable, Term):
             if self._insert_table:
                 querystring += self._into_sql()
 
+        if self._with:
+            querystring = self._with_sql() + querystring
+
         if self._from:
             querystring += self._from_sql()
 
@@ -444,6 +963,9 @@ class QueryBuilder(Selectable, Term):
         if self._orderbys:
             querystring += self._orderby_sql()
 
+        if self._limit is not None or self._offset is not None:
+            querystring += self._limit_sql()
+
         if subquery:
             querystring = '({query})'.format(
                 query=querystring,
@@ -457,9 +979,69 @@ class QueryBuilder(Selectable, Term):
 
         return querystring
 
+    def get_parameterized_sql(self, paramstyle='qmark', **kwargs):
+        """
+        Renders this query with placeholders in place of the literal values which are compared to or inserted, so
+        that the values are passed to the database driver separately as parameters.  Literal values which are
+        arguments of functions, such as the type of a ``Cast``, and the limit are not replaced.
+
+        :param paramstyle:
+            The DB-API 2 paramstyle of the database driver, one of ``'qmark'``, ``'format'``, ``'numeric'``,
+            ``'named'`` and ``'pyformat'``.  The module attribute ``paramstyle`` of the driver gives its style.
+
+        :returns
+            A tuple of the SQL and the parameters, a list for positional paramstyles or a dict for ``'named'`` and
+            ``'pyformat'``.
+        """
+        if paramstyle not in _placeholders:
+            raise QueryException('Unknown paramstyle {paramstyle}.'.format(paramstyle=paramstyle))
+
+        query = copy.deepcopy(self)
+        wrappers = query._parameters()
+        for i, wrapper in enumerate(wrappers):
+            wrapper.placeholder = '\x00{}\x00'.format(i)
+
+        sql = query.get_sql(**kwargs)
+        if paramstyle in ('format', 'pyformat'):
+            sql = sql.replace('%', '%%')
+
+        values = []
+
+        def placeholder(match):
+            values.append(wrappers[int(match.group(1))].value)
+            return _placeholders[paramstyle](len(values) - 1)
+
+        sql = _parameter_marker.sub(placeholder, sql)
+
+        if paramstyle in ('named', 'pyformat'):
+            return sql, dict(('p{}'.format(i), value) for i, value in enumerate(values))
+        return sql, values
+
+    def _parameters(self):
+        """
+        Returns the list of the ``ValueWrapper`` of this query and its subqueries which can be replaced by parameters.
+        """
+        nodes = [node
+                 for root in [self] + [value for row in self._values for value in row]
+                 for node in iter_terms(root)]
+        arguments = set(id(param) for node in nodes if isinstance(node, Function) for param in node.params)
+
+        wrappers = OrderedDict()
+        for node in nodes:
+            if isinstance(node, ValueWrapper) and not isinstance(node.value, Enum) and id(node) not in arguments:
+                wrappers[id(node)] = node
+        return list(wrappers.values())
+
+    def _with_sql(self):
+        return 'WITH {recursive}{expressions} '.format(
+            recursive='RECURSIVE ' if any(isinstance(expression, RecursiveCTE) for expression in self._with) else '',
+            expressions=','.join(expression.get_with_sql() for expression in self._with)
+        )
+
     def _select_sql(self):
-        return 'SELECT {distinct}{select}'.format(
+        return 'SELECT {distinct}{top}{select}'.format(
             distinct='distinct ' if self._distinct else '',
+            top='TOP {top} '.format(top=self._top) if self._top is not None else '',
             select=','.join(term.get_sql(with_quotes=True, with_alias=True)
                             for term in self._selects),
         )
@@ -530,6 +1112,22 @@ class QueryBuilder(Selectable, Term):
             )
         )
 
+    def _limit_sql(self):
+        if self._limit_vendor in _fetch_next_vendors:
+            return ' OFFSET {offset} ROWS{fetch}'.format(
+                offset=self._offset or 0,
+                fetch=' FETCH NEXT {limit} ROWS ONLY'.format(limit=self._limit) if self._limit is not None else '',
+            )
+
+        limit = self._limit
+        if limit is None and self._limit_vendor in _no_limit:
+            limit = _no_limit[self._limit_vendor]
+
+        return '{limit}{offset}'.format(
+            limit=' LIMIT {limit}'.format(limit=limit) if limit is not None else '',
+            offset=' OFFSET {offset}'.format(offset=self._offset) if self._offset else '',
+        )
+
     def _queryalias_sql(self, querystring):
         return '{query} \"{alias}\"'.format(
             query=querystring,
@@ -554,42 +1152,44 @@ class QueryBuilder(Selectable, Term):
 
 
 class Joiner(object):
-    def __init__(self, query, how):
+    def __init__(self, query, how, unique=False):
         self.query = query
         self.how = how
+        self.unique = unique
 
     def on(self, criterion):
         raise NotImplementedError()
 
 
 class TableJoiner(Joiner):
-    def __init__(self, query, table, how):
-        super(TableJoiner, self).__init__(query, how)
+    def __init__(self, query, table, how, unique=False):
+        super(TableJoiner, self).__init__(query, how, unique)
         self.table = table
 
     def on(self, criterion):
         if criterion is None:
             raise JoinException("Parameter 'on' is required when joining a table but was not supplied.")
 
-        self.query.do_join(self.table, criterion, self.how)
+        self.query.do_join(self.table, criterion, self.how, self.unique)
         return self.query
 
 
 class SubqueryJoiner(Joiner):
-    def __init__(self, query, subquery, how):
-        super(SubqueryJoiner, self).__init__(query, how)
+    def __init__(self, query, subquery, how, unique=False):
+        super(SubqueryJoiner, self).__init__(query, how, unique)
         self.subquery = subquery
 
     def on(self, criterion):
         if criterion is None:
             raise JoinException("Parameter 'on' is required when joining a subquery but was not supplied.")
 
-        self.query.do_join(self.subquery, criterion, self.how)
+        self.query.do_join(self.subquery, criterion, self.how, self.unique)
         return self.query
 
 
 class Join(object):
-    def __init__(self, table_id, criteria, how):
+    def __init__(self, table_id, criteria, how, unique=False):
         self.table_id = table_id
         self.criteria = criteria
         self.how = how
+        self.unique = unique
@@ -0,0 +1,879 @@
+# coding: utf8
+"""
+Optional rewrite passes for queries.  Each pass takes a ``QueryBuilder`` and returns a rewritten copy which is
+equivalent to the original but cheaper for the database to execute.  The original query is never modified.
+"""
+import copy
+from collections import OrderedDict
+from datetime import MAXYEAR, MINYEAR, date, datetime, timedelta
+from itertools import count
+
+from pypika.enums import Boolean, DatePart, Equality, JoinType, SqlTypes
+from pypika.functions import Cast, Date, Extract, Timestamp
+from pypika.terms import (BasicCriterion, BetweenCriterion, ComplexCriterion, ContainsCriterion, Exists, Field,
+                          ListField, NotExists, NullCriterion, Star, ValueWrapper, conjoin, field_key, iter_terms,
+                          nested_queries, normalize_comparison, param_value, query_clauses, split_conjuncts,
+                          subqueries)
+from pypika.utils import add_months, as_date
+
+__author__ = "Timothy Heys"
+__email__ = "theys@kayak.com"
+
+_left_joins = (JoinType.left, JoinType.left_outer)
+
+# Vendors which execute an anti-join written as LEFT JOIN ... IS NULL faster than NOT EXISTS
+_anti_join_vendors = ('mysql',)
+
+
+
+def sargable_dates(query):
+    """
+    Rewrites predicates which wrap a date column in a function into half-open ranges on the bare column so that an
+    index on the column can be used.  The following expressions are rewritten when compared to a literal:
+
+    - ``Date(field)``, ``Cast(field, SqlTypes.DATE)``
+    - ``Timestamp(field)``
+    - ``Extract(DatePart.year, field)``
+    - ``Extract`` on ``quarter``, ``month``, ``day`` and ``hour`` when the coarser parts of the same field are also
+      constrained with an equality in the same conjunction, for example year and month.
+
+    For example, ``Extract(DatePart.year, t.ts) == 2016`` becomes ``ts>='2016-01-01' AND ts<'2017-01-01'``.
+
+    :param query:
+        Type: QueryBuilder
+
+        The query to rewrite.
+    :return:
+        A rewritten copy of the query.
+    """
+    query = copy.deepcopy(query)
+    _sargable_dates(query)
+    return query
+
+
+def _sargable_dates(query):
+    if query._wheres is not None:
+        query._wheres = _rewrite_dates(query._wheres)
+
+    for join in query._joins:
+        join.criteria = _rewrite_dates(join.criteria)
+
+    for subquery in nested_queries(query):
+        _sargable_dates(subquery)
+
+
+def prune_joins(query):
+    """
+    Removes ``JoinType.left_outer`` joins whose table or subquery is not referenced anywhere else in the query, that is
+    in the SELECT, WHERE, GROUP BY, HAVING or ORDER BY clauses or in the criteria of another join.  Other joins are
+    kept, since they drop the rows without a match.  This includes ``JoinType.left``, which renders a plain ``JOIN``.
+
+    A join is only removed when it matches at most one row for each row of the query, since otherwise removing it
+    would change the number of rows returned.  This is the case when
+
+    - the join was declared with ``unique=True``,
+    - the join criterion equates every column of one of the joined table's ``unique_keys``, or
+    - the joined subquery is grouped or distinct on the columns equated in the join criterion.
+
+    :param query:
+        Type: QueryBuilder
+
+        The query to rewrite.
+    :return:
+        A rewritten copy of the query.
+    """
+    query = copy.deepcopy(query)
+    _prune_joins(query)
+    return query
+
+
+def _prune_joins(query):
+    for subquery in nested_queries(query):
+        _prune_joins(subquery)
+
+    # Later joins are checked first so that a chain of unused joins is removed in a single pass
+    for i in reversed(range(len(query._joins))):
+        join = query._joins[i]
+        if join.how is not JoinType.left_outer or not _is_unique_join(query, join):
+            continue
+
+        referenced = _referenced_table_ids(query, skip=join)
+        if referenced is None or join.table_id in referenced:
+            continue
+
+        del query._joins[i]
+        del query._selectables[join.table_id]
+
+
+def _is_unique_join(query, join):
+    if join.unique:
+        return True
+
+    from pypika.queries import QueryBuilder, Table
+    item = query._selectables[join.table_id]
+    columns = set(_equated_columns(join.criteria, join.table_id))
+
+    if isinstance(item, Table):
+        return any(set(key) <= columns for key in item.unique_keys)
+
+    if isinstance(item, QueryBuilder):
+        if item._groupbys and not item._mysql_rollup:
+            keys = item._groupbys
+        elif item._distinct:
+            keys = item._selects
+        else:
+            return False
+
+        if all(isinstance(term, Field) and not isinstance(term, Star) for term in keys):
+            return set(term.alias or term.name for term in keys) <= columns
+
+    return False
+
+
+def _equated_columns(criterion, table_id):
+    """
+    Yields the names of the columns of the table ``table_id`` which are equated to an expression on other tables in
+    the conjunction ``criterion``.
+    """
+    for conjunct in split_conjuncts(criterion):
+        if not isinstance(conjunct, BasicCriterion) or isinstance(conjunct, ComplexCriterion) \
+                or conjunct.comparator is not Equality.eq:
+            continue
+
+        for column, other in ((conjunct.left, conjunct.right), (conjunct.right, conjunct.left)):
+            if isinstance(column, Field) and _table_id(column) == table_id \
+                    and all(_table_id(field) != table_id for field in other.fields()):
+                yield column.name
+
+
+def _table_id(field):
+    return getattr(field.table, 'item_id', None)
+
+
+def _referenced_table_ids(query, skip=None):
+    """
+    Returns the set of ids of the tables referenced in the clauses of a query, ignoring the join ``skip``.  Returns
+    ``None`` if the query selects an unqualified star, which references every table.
+    """
+    ids = set()
+    for clause in query_clauses(query, skip):
+        for node in iter_terms(clause):
+            if isinstance(node, Star) and node.table is None:
+                return None
+            if isinstance(node, Field):
+                ids.add(_table_id(node))
+    return ids
+
+
+def propagate_predicates(query):
+    """
+    Copies predicates which compare a column to literals across the equi-join equalities of the query.  For example,
+    with the join criterion ``a.id == b.a_id`` and the filter ``a.id == 5``, the filter ``b.a_id == 5`` is added so
+    that both tables can be filtered using their own indexes.
+
+    Equalities, inequalities, ``IN`` lists and ``BETWEEN`` ranges in the WHERE clause are propagated using the
+    equalities in the criteria of inner and left joins.  Predicates derived for a column of a left joined table are
+    added to the criterion of that join rather than to the WHERE clause, so that the rows returned do not change.
+
+    :param query:
+        Type: QueryBuilder
+
+        The query to rewrite.
+    :return:
+        A rewritten copy of the query.
+    """
+    query = copy.deepcopy(query)
+    _propagate_predicates(query)
+    return query
+
+
+def _propagate_predicates(query):
+    for subquery in nested_queries(query):
+        _propagate_predicates(subquery)
+
+    classes = _equivalence_classes(query)
+    if not classes or query._wheres is None:
+        return
+
+    wheres = split_conjuncts(query._wheres)
+    left_joins = {join.table_id: join for join in query._joins if join.how in _left_joins}
+    existing = set(_predicate_key(criterion)
+                   for criterion in wheres + [c for join in query._joins for c in split_conjuncts(join.criteria)])
+
+    for criterion in list(wheres):
+        column = _restricted_column(criterion)
+        if column is None:
+            continue
+
+        for target in classes.get(field_key(column), []):
+            derived = _restrict_column(criterion, target)
+            key = _predicate_key(derived)
+            if key in existing:
+                continue
+
+            existing.add(key)
+            join = left_joins.get(_table_id(target))
+            if join is not None:
+                join.criteria &= derived
+            else:
+                wheres.append(derived)
+
+    query._wheres = conjoin(wheres)
+
+
+def _equivalence_classes(query):
+    """
+    Returns a dict mapping the key of each column that appears in an equi-join equality to the list of other columns
+    that it is transitively equal to.
+    """
+    parents, fields = {}, {}
+
+    def find(key):
+        while parents[key] != key:
+            key = parents[key]
+        return key
+
+    for join in query._joins:
+        if join.how is not JoinType.inner and join.how not in _left_joins:
+            continue
+
+        for conjunct in split_conjuncts(join.criteria):
+            if not isinstance(conjunct, BasicCriterion) or isinstance(conjunct, ComplexCriterion) \
+                    or conjunct.comparator is not Equality.eq \
+                    or not isinstance(conjunct.left, Field) or not isinstance(conjunct.right, Field):
+                continue
+
+            # An equality in the criterion of an outer join only holds for the rows which are joined, so it is only
+            # known to hold between a column of the joined table and the column it is matched with
+            if join.how is JoinType.left_outer \
+                    and join.table_id not in (_table_id(conjunct.left), _table_id(conjunct.right)):
+                continue
+
+            keys = []
+            for field in (conjunct.left, conjunct.right):
+                key = field_key(field)
+                parents.setdefault(key, key)
+                fields.setdefault(key, field)
+                keys.append(key)
+            parents[find(keys[0])] = find(keys[1])
+
+    members = {}
+    for key in parents:
+        members.setdefault(find(key), []).append(key)
+
+    return {key: [fields[other] for other in members[find(key)] if other != key]
+            for key in parents}
+
+
+def _restricted_column(criterion):
+    """
+    Returns the column restricted by a criterion if the criterion compares a single column to literal values, or
+    ``None`` otherwise.
+    """
+    if isinstance(criterion, BasicCriterion) and not isinstance(criterion, ComplexCriterion):
+        normalized = normalize_comparison(criterion)
+        if normalized is not None and isinstance(normalized[1], Field):
+            return normalized[1]
+
+    elif isinstance(criterion, ContainsCriterion):
+        if isinstance(criterion.field, Field) and isinstance(criterion.container, ListField) \
+                and all(isinstance(value, ValueWrapper) for value in criterion.container.values):
+            return criterion.field
+
+    elif isinstance(criterion, BetweenCriterion):
+        if isinstance(criterion.field, Field) and isinstance(criterion.start, ValueWrapper) \
+                and isinstance(criterion.end, ValueWrapper):
+            return criterion.field
+
+    return None
+
+
+def _restrict_column(criterion, column):
+    """
+    Returns a copy of a criterion accepted by ``_restricted_column`` which restricts ``column`` instead.
+    """
+    if isinstance(criterion, ContainsCriterion):
+        restricted = ContainsCriterion(column, criterion.container)
+        return restricted.negate() if criterion._is_negated else restricted
+
+    if isinstance(criterion, BetweenCriterion):
+        return BetweenCriterion(column, criterion.start, criterion.end)
+
+    comparator, _, value = normalize_comparison(criterion)
+    return BasicCriterion(comparator, column, ValueWrapper(value))
+
+
+def _predicate_key(criterion):
+    """
+    Returns a hashable key identifying a criterion accepted by ``_restricted_column``, or the criterion itself for
+    any other criterion.
+    """
+    column = _restricted_column(criterion)
+    if column is None:
+        return criterion
+
+    if isinstance(criterion, ContainsCriterion):
+        return 'IN', criterion._is_negated, field_key(column), criterion.container.get_sql()
+
+    if isinstance(criterion, BetweenCriterion):
+        return 'BETWEEN', field_key(column), criterion.start.get_sql(), criterion.end.get_sql()
+
+    comparator, _, value = normalize_comparison(criterion)
+    return comparator, field_key(column), ValueWrapper(value).get_sql()
+
+
+def flatten_subqueries(query):
+    """
+    Merges subqueries used in the FROM clause or joined to a query into the query itself, so that databases which
+    materialize derived tables do not need to.  The fields of the subquery referenced in the query are replaced by
+    the fields of its tables and the WHERE clause of the subquery is merged into the query.
+
+    A subquery is only merged when it selects plain fields from a table and has no aggregation, DISTINCT, ORDER BY,
+    UNION or ROLLUP.  A joined subquery must not have joins of its own and must be joined with an inner or left join,
+    in which case its WHERE clause is merged into the join criterion.
+
+    :param query:
+        Type: QueryBuilder
+
+        The query to rewrite.
+    :return:
+        A rewritten copy of the query.
+    """
+    query = copy.deepcopy(query)
+    _flatten_subqueries(query)
+    return query
+
+
+def _flatten_subqueries(query):
+    for subquery in nested_queries(query):
+        _flatten_subqueries(subquery)
+
+    for subquery in subqueries(query):
+        if not _is_simple_subquery(subquery):
+            continue
+
+        if query._from is subquery:
+            _flatten_subquery(query, subquery, None)
+            continue
+
+        join = next(join for join in query._joins if join.table_id == subquery.item_id)
+        if not subquery._joins and (join.how is JoinType.inner or join.how in _left_joins):
+            _flatten_subquery(query, subquery, join)
+
+
+def _is_simple_subquery(subquery):
+    from pypika.queries import Table
+    return isinstance(subquery._from, Table) and bool(subquery._selects) \
+        and all(isinstance(term, Field) for term in subquery._selects) \
+        and not (subquery._groupbys or subquery._havings is not None or subquery._distinct
+                 or subquery._orderbys or subquery._unions or subquery._mysql_rollup
+                 or subquery._insert_table is not None or subquery._with
+                 or subquery._limit is not None or subquery._offset is not None or subquery._top is not None)
+
+
+def _projection(subquery, name):
+    """
+    Returns the field of a subquery's tables that the subquery selects as ``name``, or ``None``.
+    """
+    star_tables = []
+    for term in subquery._selects:
+        if isinstance(term, Star):
+            star_tables.append(term.table or subquery._from)
+        elif (term.alias or term.name) == name:
+            return term
+
+    if subquery._select_star and subquery._joins or len(star_tables) != 1:
+        return None
+    return Field(name, table=star_tables[0])
+
+
+def _flatten_subquery(query, subquery, join):
+    if any(item_id in query._selectables for item_id in subquery._selectables):
+        return
+
+    fields, stars = [], []
+    for clause in query_clauses(query):
+        for node in iter_terms(clause):
+            if not isinstance(node, Field) or _table_id(node) != subquery.item_id:
+                continue
+            if isinstance(node, Star):
+                stars.append(node)
+                continue
+
+            projected = _projection(subquery, node.name)
+            if projected is None:
+                return
+            fields.append((node, projected))
+
+    if any(not any(star is select for select in query._selects) for star in stars):
+        # A star on the subquery can only be expanded in the SELECT clause
+        return
+
+    if query._select_star and not (subquery._select_star or join is None and not query._joins):
+        return
+
+    for node, projected in fields:
+        if node.alias is None and any(node is select for select in query._selects) and projected.name != node.name:
+            node.alias = node.name
+        node.name, node.table = projected.name, projected.table
+
+    selects = []
+    for select in query._selects:
+        if any(select is star for star in stars) or isinstance(select, Star) and select.table is None:
+            selects += subquery._selects
+        else:
+            selects.append(select)
+    query._selects = selects
+    query._select_star = query._select_star and subquery._select_star
+    query._select_star_tables = set(table for table in query._select_star_tables
+                                    if table.item_id != subquery.item_id)
+
+    selectables = list(query._selectables.items())
+    query._selectables.clear()
+    for item_id, item in selectables:
+        if item_id == subquery.item_id:
+            query._selectables.update(subquery._selectables)
+        else:
+            query._selectables[item_id] = item
+
+    if join is None:
+        query._from = subquery._from
+        query._joins = subquery._joins + query._joins
+        query._wheres = conjoin([criterion
+                                 for criterion in (subquery._wheres, query._wheres)
+                                 if criterion is not None])
+
+    else:
+        join.table_id = subquery._from.item_id
+        if subquery._wheres is not None:
+            join.criteria &= subquery._wheres
+
+
+def rewrite_semijoins(query, vendor=None):
+    """
+    Rewrites ``IN`` and ``NOT IN`` criteria with a subquery into correlated ``EXISTS`` and ``NOT EXISTS`` criteria,
+    which databases can stop evaluating at the first matching row instead of materializing the whole subquery.
+
+    For vendors which execute anti-joins better as outer joins, such as MySQL, a ``NOT IN`` criterion in the top
+    level conjunction of the WHERE clause is instead rewritten into a ``LEFT OUTER JOIN`` on the subquery with an
+    ``IS NULL`` check.
+
+    ``NOT IN`` is never true when the field of the outer query is ``NULL`` or when the subquery returns a ``NULL``,
+    whereas ``NOT EXISTS`` and the anti-join only exclude the rows which have a match.  A rewritten ``NOT IN``
+    criterion therefore also checks that the field is not ``NULL`` and, unless the WHERE clause of the subquery
+    excludes nulls, for example with ``IS NOT NULL`` or a comparison of its column, that the subquery returns no
+    ``NULL``.
+
+    A criterion is only rewritten when the subquery selects a single field and has no aggregation or UNION.
+
+    :param query:
+        Type: QueryBuilder
+
+        The query to rewrite.
+    :param vendor:
+        (Optional) The database vendor the query is written for, for example ``'mysql'``.
+    :return:
+        A rewritten copy of the query.
+    """
+    query = copy.deepcopy(query)
+    _rewrite_semijoins(query, vendor)
+    return query
+
+
+def _rewrite_semijoins(query, vendor):
+    for subquery in nested_queries(query):
+        _rewrite_semijoins(subquery, vendor)
+
+    if query._wheres is None:
+        return
+
+    wheres = []
+    for criterion in split_conjuncts(query._wheres):
+        anti_join = _anti_join(query, criterion) if vendor in _anti_join_vendors else None
+        wheres.append(anti_join if anti_join is not None else _rewrite_contains(query, criterion))
+
+    query._wheres = conjoin(wheres)
+
+
+def _is_correlatable(query, criterion):
+    from pypika.queries import QueryBuilder, Table
+    if not isinstance(criterion, ContainsCriterion) or not isinstance(criterion.container, QueryBuilder) \
+            or not isinstance(criterion.field, Field):
+        return False
+
+    subquery = criterion.container
+    if len(subquery._selects) != 1 or not isinstance(subquery._selects[0], Field) \
+            or isinstance(subquery._selects[0], Star) \
+            or subquery._groupbys or subquery._havings is not None or subquery._unions \
+            or subquery._mysql_rollup or subquery._insert_table is not None \
+            or subquery._limit is not None or subquery._offset is not None or subquery._top is not None:
+        return False
+
+    # The outer tables must be distinguishable from the tables of the subquery
+    return (query._joins or isinstance(query._from, Table)) \
+        and not any(item_id in query._selectables for item_id in subquery._selectables)
+
+
+def _alias_tables(query, prefix):
+    for i, table in enumerate(query._selectables.values()):
+        table.alias = table.alias or '%s%d' % (prefix, i)
+
+
+def _rewrite_contains(query, criterion):
+    if isinstance(criterion, ComplexCriterion):
+        return ComplexCriterion(criterion.comparator,
+                                _rewrite_contains(query, criterion.left),
+                                _rewrite_contains(query, criterion.right))
+
+    if not _is_correlatable(query, criterion):
+        return criterion
+
+    subquery = criterion.container
+    column = subquery._selects[0]
+
+    # The outer tables are aliased the same way as when the query is rendered, the tables of the subquery must not
+    # shadow them.
+    _alias_tables(query, 't')
+    if subquery._joins:
+        _alias_tables(subquery, 's')
+    nulls = _null_check(subquery) if criterion._is_negated else None
+
+    subquery._selects = [ValueWrapper(1)]
+    subquery._distinct = False
+    subquery._orderbys = []
+    subquery._wheres = conjoin([c
+                                for c in (subquery._wheres, column == criterion.field)
+                                if c is not None])
+
+    if criterion._is_negated:
+        # NOT IN is never true for a NULL or when the subquery returns a NULL, whereas NOT EXISTS is true
+        return conjoin([c for c in (criterion.field.notnull(), NotExists(subquery), nulls) if c is not None])
+    return Exists(subquery)
+
+
+def _anti_join(query, criterion):
+    """
+    Joins the subquery of a ``NOT IN`` criterion to the query with a left outer join and returns the criterion which
+    replaces it, or returns ``None`` if the criterion cannot be rewritten.
+    """
+    # Selecting every column would also select the columns of the joined table
+    if not _is_correlatable(query, criterion) or not criterion._is_negated or query._select_star:
+        return None
+
+    subquery = criterion.container
+    column = subquery._selects[0]
+    nulls = _null_check(subquery)
+
+    if _is_simple_subquery(subquery) and not subquery._joins:
+        join_criterion = conjoin([c
+                                  for c in (column == criterion.field, subquery._wheres)
+                                  if c is not None])
+        query.do_join(subquery._from, join_criterion, JoinType.left_outer)
+    else:
+        column = Field(column.alias or column.name, table=subquery)
+        query.do_join(subquery, column == criterion.field, JoinType.left_outer)
+
+    return conjoin([c for c in (criterion.field.notnull(), column.isnull(), nulls) if c is not None])
+
+
+def _null_check(subquery):
+    """
+    Returns a criterion which is false when the subquery of a ``NOT IN`` criterion returns a ``NULL``, or ``None`` if
+    its WHERE clause excludes nulls from its column.
+    """
+    key = field_key(subquery._selects[0])
+    for conjunct in split_conjuncts(subquery._wheres) if subquery._wheres is not None else []:
+        if isinstance(conjunct, NullCriterion) and not conjunct.isnull:
+            column = conjunct.field
+        else:
+            # A comparison is never true for a NULL
+            column = _restricted_column(conjunct)
+        if isinstance(column, Field) and field_key(column) == key:
+            return None
+
+    nulls = copy.deepcopy(subquery)
+    column, nulls._selects = nulls._selects[0], [ValueWrapper(1)]
+    nulls._distinct = False
+    nulls._orderbys = []
+    nulls._wheres = conjoin([c for c in (nulls._wheres, column.isnull()) if c is not None])
+    return NotExists(nulls)
+
+
+def hoist_ctes(query, prefix='cte'):
+    """
+    Moves subqueries which appear more than once in a query, for example both in a join and in an ``IN`` criterion,
+    into a single common table expression in the WITH clause of the query.  Each occurrence is replaced by a
+    reference to the expression, so that it is written and evaluated only once.
+
+    Subqueries are considered identical when they render the same SQL.  Correlated subqueries, which reference the
+    tables of the outer query, are not moved.
+
+    :param query:
+        Type: QueryBuilder
+
+        The query to rewrite.
+    :param prefix:
+        (Optional) The prefix used to name the common table expressions.  A number is appended to make each name
+        unique.
+    :return:
+        A rewritten copy of the query.
+    """
+    from pypika.queries import AliasedQuery
+    query = copy.deepcopy(query)
+    names = set(expression.query_name for expression in query._with)
+    references = set()
+
+    while True:
+        occurrences = OrderedDict()
+        for occurrence in _subquery_occurrences(query):
+            subquery = occurrence[-1]
+            if subquery.item_id not in references:
+                occurrences.setdefault(subquery.get_sql(with_unions=True), []).append(occurrence)
+
+        repeated = next((group for group in occurrences.values() if len(group) > 1), None)
+        if repeated is None:
+            return query
+
+        name = next(name for name in ('%s%d' % (prefix, i) for i in count()) if name not in names)
+        names.add(name)
+
+        # Expressions hoisted later are nested in the ones hoisted before, so must be defined before them
+        query._with.insert(0, AliasedQuery(name, repeated[0][-1]))
+        for occurrence in repeated:
+            references.add(_replace_subquery(name, *occurrence))
+
+
+def _subquery_occurrences(query):
+    """
+    Yields a tuple of (holder, subquery) for each subquery nested in a query, where the holder is either the query
+    which selects from the subquery or the criterion which contains it.
+    """
+    from pypika.queries import QueryBuilder
+    for subquery in subqueries(query):
+        yield query, subquery
+        for occurrence in _subquery_occurrences(subquery):
+            yield occurrence
+
+    for clause in query_clauses(query):
+        for node in iter_terms(clause, descend=False):
+            if isinstance(node, ContainsCriterion) and isinstance(node.container, QueryBuilder):
+                subquery = node.container
+            elif isinstance(node, Exists):
+                subquery = node.subquery
+            else:
+                continue
+
+            if _is_self_contained(subquery):
+                yield node, subquery
+            for occurrence in _subquery_occurrences(subquery):
+                yield occurrence
+
+    for other in [expression.query for expression in query._with] + [other for _, other in query._unions]:
+        for occurrence in _subquery_occurrences(other):
+            yield occurrence
+
+
+def _is_self_contained(subquery):
+    """
+    Returns true if every field in a subquery belongs to one of the tables of the subquery or of its own subqueries.
+    """
+    from pypika.queries import QueryBuilder
+    table_ids, field_ids = set(), set()
+    for node in iter_terms(subquery):
+        if isinstance(node, QueryBuilder):
+            table_ids.update(node._selectables)
+        elif isinstance(node, Field) and node.table is not None:
+            field_ids.add(_table_id(node))
+    return field_ids <= table_ids
+
+
+def _replace_subquery(name, holder, subquery):
+    """
+    Replaces a subquery with a reference to the common table expression ``name`` and returns the item id of the
+    reference.
+    """
+    from pypika.queries import AliasedQuery, QueryBuilder
+    if isinstance(holder, (ContainsCriterion, Exists)):
+        reference = QueryBuilder().from_(AliasedQuery(name)).select('*')
+        if isinstance(holder, Exists):
+            holder.subquery = reference
+        else:
+            holder.container = reference
+        return reference.item_id
+
+    reference = AliasedQuery(name)
+    reference.item_id = subquery.item_id
+    reference.alias = subquery.alias
+
+    holder._selectables[subquery.item_id] = reference
+    if holder._from is subquery:
+        holder._from = reference
+
+    holder._select_star_tables = set(reference if table.item_id == subquery.item_id else table
+                                     for table in holder._select_star_tables)
+    for clause in query_clauses(holder):
+        for node in iter_terms(clause, descend=False):
+            if isinstance(node, Field) and _table_id(node) == subquery.item_id:
+                node.table = reference
+
+    return reference.item_id
+
+
+def _rewrite_dates(criterion):
+    if isinstance(criterion, ComplexCriterion):
+        if criterion.comparator is not Boolean.and_:
+            return ComplexCriterion(criterion.comparator,
+                                    _rewrite_dates(criterion.left),
+                                    _rewrite_dates(criterion.right))
+
+        conjuncts = split_conjuncts(criterion)
+        rewritten = _rewrite_extract_chains(conjuncts)
+        return conjoin([_rewrite_dates(c) if isinstance(c, ComplexCriterion) else _rewrite_date_predicate(c)
+                        for c in rewritten])
+
+    return _rewrite_date_predicate(criterion)
+
+
+def _range_criterion(field, comparator, lower, upper):
+    """
+    Builds the criterion on ``field`` that is equivalent to comparing a value truncated to the interval
+    ``[lower, upper)`` with ``comparator``.
+    """
+    if comparator is Equality.eq:
+        return (field >= lower) & (field < upper)
+    if comparator is Equality.ne:
+        return (field < lower) | (field >= upper)
+    if comparator is Equality.gt:
+        return field >= upper
+    if comparator is Equality.gte:
+        return field >= lower
+    if comparator is Equality.lt:
+        return field < lower
+    return field < upper
+
+
+def _rewrite_date_predicate(criterion):
+    normalized = normalize_comparison(criterion)
+    if normalized is None:
+        return criterion
+
+    comparator, term, value = normalized
+    if not isinstance(term, (Date, Timestamp, Cast, Extract)):
+        return criterion
+
+    field = term.params[1] if isinstance(term, Extract) else term.params[0]
+    if not isinstance(field, Field):
+        return criterion
+
+    if isinstance(term, Timestamp):
+        return BasicCriterion(comparator, field, ValueWrapper(value))
+
+    if isinstance(term, Extract):
+        if param_value(term.params[0]) is not DatePart.year or not isinstance(value, int) \
+                or not MINYEAR <= value < MAXYEAR:
+            # The range of the year must be representable as dates
+            return criterion
+        return _range_criterion(field, comparator, date(value, 1, 1), date(value + 1, 1, 1))
+
+    if isinstance(term, Cast) and param_value(term.params[1]) not in (SqlTypes.DATE, 'DATE'):
+        return criterion
+
+    day = as_date(value)
+    if day is None:
+        return criterion
+    if isinstance(day, datetime):
+        if day != datetime(day.year, day.month, day.day):
+            return criterion
+        day = day.date()
+
+    if day == date.max:
+        return criterion
+    return _range_criterion(field, comparator, day, day + timedelta(days=1))
+
+
+def _extract_equality(criterion):
+    normalized = normalize_comparison(criterion)
+    if normalized is None:
+        return None
+
+    comparator, term, value = normalized
+    if comparator is not Equality.eq or not isinstance(term, Extract) or not isinstance(term.params[1], Field) \
+            or not isinstance(value, int):
+        return None
+
+    return param_value(term.params[0]), term.params[1], value
+
+
+def _rewrite_extract_chains(conjuncts):
+    """
+    Replaces equalities on several ``Extract`` parts of the same field, such as year and month, with a single range
+    on the field.  Conjuncts which do not belong to a complete chain are returned unchanged.
+    """
+    parts_by_field = {}
+    for i, conjunct in enumerate(conjuncts):
+        extracted = _extract_equality(conjunct)
+        if extracted is None:
+            continue
+        part, field, value = extracted
+        parts_by_field.setdefault(field_key(field), (field, {}))[1].setdefault(part, (i, value))
+
+    replacements = {}
+    for field, parts in parts_by_field.values():
+        if DatePart.year not in parts or len(parts) == 1:
+            continue
+
+        try:
+            chain = _extract_range(parts)
+        except (ValueError, OverflowError):
+            # The bounds of the range are not representable as dates, for example after the year 9999
+            chain = None
+        if chain is None:
+            continue
+
+        used, lower, upper = chain
+        replacements[min(used)] = _range_criterion(field, Equality.eq, lower, upper)
+        replacements.update((i, None) for i in used if i != min(used))
+
+    return [replacements.get(i, conjunct)
+            for i, conjunct in enumerate(conjuncts)
+            if replacements.get(i, conjunct) is not None]
+
+
+def _extract_range(parts):
+    used = [parts[DatePart.year][0]]
+    year = parts[DatePart.year][1]
+
+    if DatePart.quarter in parts and DatePart.month not in parts:
+        i, quarter = parts[DatePart.quarter]
+        if not 1 <= quarter <= 4:
+            return None
+        lower = date(year, 3 * quarter - 2, 1)
+        return used + [i], lower, add_months(lower, 3)
+
+    if DatePart.month not in parts:
+        return None
+    i, month = parts[DatePart.month]
+    if not 1 <= month <= 12:
+        return None
+    used.append(i)
+    lower = date(year, month, 1)
+    upper = add_months(lower, 1)
+
+    if DatePart.day not in parts:
+        return used, lower, upper
+    i, day = parts[DatePart.day]
+    try:
+        lower = date(year, month, day)
+    except ValueError:
+        return None
+    used.append(i)
+    upper = lower + timedelta(days=1)
+
+    if DatePart.hour not in parts:
+        return used, lower, upper
+    i, hour = parts[DatePart.hour]
+    if not 0 <= hour <= 23:
+        return None
+    used.append(i)
+    lower = datetime(year, month, day, hour)
+    return used, lower, lower + timedelta(hours=1)
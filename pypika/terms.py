@@ -1,6 +1,7 @@
 # coding: utf8
 import re
 from datetime import date
+from functools import reduce
 
 from aenum import Enum
 
@@ -142,11 +143,16 @@ class Term(object):
 class ValueWrapper(Term):
     def __init__(self, value):
         self.value = value
+        # Rendered instead of the value when the query is rendered with parameters
+        self.placeholder = None
 
     def fields(self):
         return []
 
     def get_sql(self, **kwargs):
+        if self.placeholder is not None:
+            return self.placeholder
+
         # FIXME escape values
         if isinstance(self.value, Enum):
             return self.value.value
@@ -174,6 +180,9 @@ class Field(Term):
             return ContainsCriterion(self, ListField([self._wrap(value) for value in arg]))
         return ContainsCriterion(self, arg)
 
+    def notin(self, arg):
+        return self.isin(arg).negate()
+
     @builder
     def for_(self, table):
         """
@@ -244,6 +253,28 @@ class ListField(object):
         )
 
 
+class Tuple(Term):
+    def __init__(self, *values):
+        """
+        A wrapper for a row value such as ``("a","b")``, which can be compared to other row values.
+
+        :param values:
+            The terms or values in the row.
+        """
+        super(Tuple, self).__init__()
+        self.values = [self._wrap(value) for value in values]
+
+    def fields(self):
+        return [field
+                for value in self.values
+                for field in value.fields()]
+
+    def get_sql(self, **kwargs):
+        return '({values})'.format(
+            values=','.join(value.get_sql(**kwargs) for value in self.values)
+        )
+
+
 class Criterion(object):
     def __and__(self, other):
         return ComplexCriterion(Boolean.and_, self, other)
@@ -314,15 +345,50 @@ class ContainsCriterion(Criterion):
         """
         self.field = field
         self.container = container
+        self._is_negated = False
+
+    @builder
+    def negate(self):
+        self._is_negated = True
+        return self
 
     def fields(self):
         return [self.field] + self.field.fields() if self.field.fields else []
 
     def get_sql(self, **kwargs):
         # FIXME escape
-        return "{field} IN {container}".format(
+        return "{field}{not_} IN {container}".format(
             field=self.field.get_sql(**kwargs),
-            container=self.container.get_sql(**kwargs)
+            container=self.container.get_sql(**kwargs),
+            not_=' NOT' if self._is_negated else '',
+        )
+
+
+class Exists(Criterion):
+    def __init__(self, subquery):
+        """
+        A wrapper for an "EXISTS" criterion.  This is true when the subquery returns at least one row.
+
+
+        :param subquery:
+            The subquery to check for rows.
+        """
+        self.subquery = subquery
+
+    def fields(self):
+        # Subqueries have their own fields.
+        return []
+
+    def get_sql(self, **kwargs):
+        return "EXISTS {subquery}".format(
+            subquery=self.subquery.get_sql(subquery=True),
+        )
+
+
+class NotExists(Exists):
+    def get_sql(self, **kwargs):
+        return "NOT {exists}".format(
+            exists=super(NotExists, self).get_sql(**kwargs),
         )
 
 
@@ -542,6 +608,171 @@ class Function(Term):
         return self
 
 
+class AnalyticFunction(Function):
+    """
+    A function which can be evaluated over a window of rows with an ``OVER`` clause.  The window is defined by
+    calling ``over`` with the terms to partition by, ``orderby`` with the terms to order each partition by, and
+    ``rows`` or ``range`` with the bounds of the frame.
+    """
+
+    def __init__(self, name, *params, **kwargs):
+        super(AnalyticFunction, self).__init__(name, *params, **kwargs)
+        self._include_over = False
+        self._partition = []
+        self._orderbys = []
+        self._frame = None
+
+    @builder
+    def over(self, *terms):
+        self._include_over = True
+        self._partition += [self._wrap(term) for term in terms]
+        return self
+
+    @builder
+    def orderby(self, *terms, **kwargs):
+        self._include_over = True
+        self._orderbys += [(self._wrap(term), kwargs.get('order'))
+                           for term in terms]
+        return self
+
+    @builder
+    def rows(self, bound, and_bound=None):
+        """
+        Sets a ``ROWS`` frame for the window.
+
+        :param bound:
+            The start of the frame, either a ``Preceding``, a ``Following`` or ``CURRENT_ROW``.  When ``and_bound`` is
+            not given, the frame ends at the current row.
+        :param and_bound:
+            (Optional) The end of the frame.
+        """
+        self._include_over = True
+        self._frame = ('ROWS', bound, and_bound)
+        return self
+
+    @builder
+    def range(self, bound, and_bound=None):
+        """
+        Sets a ``RANGE`` frame for the window.  See ``rows`` for the parameters.
+        """
+        self._include_over = True
+        self._frame = ('RANGE', bound, and_bound)
+        return self
+
+    @builder
+    def for_(self, table):
+        self.params = [param.for_(table) if hasattr(param, 'for_')
+                       else param
+                       for param in self.params]
+        self._partition = [term.for_(table) if hasattr(term, 'for_')
+                           else term
+                           for term in self._partition]
+        self._orderbys = [(term.for_(table) if hasattr(term, 'for_') else term, order)
+                          for term, order in self._orderbys]
+        return self
+
+    def get_sql(self, with_alias=False, **kwargs):
+        function_sql = super(AnalyticFunction, self).get_sql(with_alias=False, **kwargs)
+
+        if self._include_over:
+            function_sql += ' OVER({window})'.format(window=self._window_sql())
+
+        return '{function}{alias}'.format(
+            function=function_sql,
+            alias=' \"{}\"'.format(self.alias) if self.alias is not None and with_alias else ''
+        )
+
+    def _window_sql(self):
+        clauses = []
+
+        if self._partition:
+            clauses.append('PARTITION BY {terms}'.format(
+                terms=','.join(term.get_sql(with_quotes=True) for term in self._partition)
+            ))
+
+        if self._orderbys:
+            clauses.append('ORDER BY {terms}'.format(
+                terms=','.join('{term} {order}'.format(term=term.get_sql(with_quotes=True), order=order.value)
+                               if order is not None else
+                               term.get_sql(with_quotes=True)
+                               for term, order in self._orderbys)
+            ))
+
+        if self._frame is not None:
+            unit, bound, and_bound = self._frame
+            clauses.append('{unit} {bound}'.format(unit=unit, bound=bound)
+                           if and_bound is None else
+                           '{unit} BETWEEN {bound} AND {and_bound}'.format(unit=unit, bound=bound,
+                                                                           and_bound=and_bound))
+
+        return ' '.join(clauses)
+
+    def fields(self):
+        return super(AnalyticFunction, self).fields() + [field
+                                                        for term in self._partition + [t for t, _ in self._orderbys]
+                                                        for field in term.fields()]
+
+
+class AggregateFunction(AnalyticFunction):
+    """
+    A function which aggregates the values of a group of rows.  Aggregate functions can also be evaluated over a
+    window with an ``OVER`` clause.
+
+    ``combine`` is the name of the aggregate function which combines the results of this function over disjoint sets of
+    rows into its result over all of the rows, or ``None`` if the partial results cannot be combined directly.
+    Aggregates whose results cannot be combined directly declare how they are decomposed into partial aggregates by
+    overriding ``partials`` and ``merge``.
+    """
+    combine = None
+
+    def partials(self):
+        """
+        Returns the list of terms which are computed over each partition of the rows in order to compute this function
+        over all rows, or ``None`` if this function cannot be decomposed.  The results of a partial aggregate are
+        combined with the function named by its ``combine`` attribute.  A partial term which is not an aggregate is
+        added to the GROUP BY clause and its results are combined into the set of its distinct values.
+        """
+        if self.combine is None or self._include_over:
+            return None
+        return [self]
+
+    def merge(self, values):
+        """
+        Computes the result of this function from the combined results of its partials.
+
+        :param values:
+            A list with the combined result of each term returned by ``partials``.
+        """
+        return values[0]
+
+
+class Preceding(object):
+    """
+    A frame bound for a number of rows preceding the current row, or all preceding rows when no value is given.
+    """
+
+    def __init__(self, value=None):
+        self.value = value
+
+    def __str__(self):
+        return '{value} PRECEDING'.format(value='UNBOUNDED' if self.value is None else self.value)
+
+
+class Following(object):
+    """
+    A frame bound for a number of rows following the current row, or all following rows when no value is given.
+    """
+
+    def __init__(self, value=None):
+        self.value = value
+
+    def __str__(self):
+        return '{value} FOLLOWING'.format(value='UNBOUNDED' if self.value is None else self.value)
+
+
+CURRENT_ROW = 'CURRENT ROW'
+
+
 class Interval(object):
     units = ['years', 'months', 'days', 'hours', 'minutes', 'seconds', 'microseconds']
     labels = ['YEAR', 'MONTH', 'DAY', 'HOUR', 'MINUTE', 'SECOND', 'MICROSECOND']
@@ -616,3 +847,174 @@ class Mod(Function):
 class Rollup(Function):
     def __init__(self, *terms):
         super(Rollup, self).__init__('ROLLUP', *terms)
+
+
+class Cube(Function):
+    def __init__(self, *terms):
+        super(Cube, self).__init__('CUBE', *terms)
+
+
+class GroupingSets(Function):
+    def __init__(self, *groups):
+        """
+        A wrapper for the "GROUPING SETS" modifier of the GROUP BY clause, which aggregates over each of the given
+        groups in a single query.
+
+        :param groups:
+            Each group is either a single term or a list or tuple of terms.  An empty tuple is the grand total.
+        """
+        super(GroupingSets, self).__init__('GROUPING SETS')
+        self.groups = [[self._wrap(term) for term in group]
+                       if isinstance(group, (list, tuple))
+                       else [self._wrap(group)]
+                       for group in groups]
+
+    @builder
+    def for_(self, table):
+        self.groups = [[term.for_(table) if hasattr(term, 'for_') else term
+                        for term in group]
+                       for group in self.groups]
+        return self
+
+    def get_sql(self, **kwargs):
+        return '{name}({groups})'.format(
+            name=self.name,
+            groups=','.join(
+                group[0].get_sql(with_quotes=True, with_alias=False)
+                if len(group) == 1 else
+                '({terms})'.format(terms=','.join(term.get_sql(with_quotes=True, with_alias=False)
+                                                  for term in group))
+                for group in self.groups
+            ),
+        )
+
+    def fields(self):
+        return [field
+                for group in self.groups
+                for term in group
+                for field in term.fields()]
+
+
+_flipped = {
+    Equality.eq: Equality.eq,
+    Equality.ne: Equality.ne,
+    Equality.gt: Equality.lt,
+    Equality.gte: Equality.lte,
+    Equality.lt: Equality.gt,
+    Equality.lte: Equality.gte,
+}
+
+
+def iter_terms(node, descend=True):
+    """
+    Yields a term or criterion and every term or criterion nested within it, including the clauses of subqueries
+    unless ``descend`` is false.
+    """
+    from .queries import QueryBuilder
+    yield node
+
+    if isinstance(node, QueryBuilder):
+        children = query_clauses(node) + nested_queries(node) if descend else []
+        children += [other for _, other in node._unions]
+    elif isinstance(node, (BasicCriterion, ArithmeticExpression)):
+        children = [node.left, node.right]
+    elif isinstance(node, ContainsCriterion):
+        children = [node.field, node.container]
+    elif isinstance(node, BetweenCriterion):
+        children = [node.field, node.start, node.end]
+    elif isinstance(node, NullCriterion):
+        children = [node.field]
+    elif isinstance(node, Exists):
+        children = [node.subquery]
+    elif isinstance(node, GroupingSets):
+        children = [term for group in node.groups for term in group]
+    elif isinstance(node, AnalyticFunction):
+        children = node.params + node._partition + [term for term, _ in node._orderbys]
+    elif isinstance(node, Function):
+        children = node.params
+    elif isinstance(node, (ListField, Tuple)):
+        children = node.values
+    elif isinstance(node, Case):
+        children = [term for case in node._cases for term in case]
+        children += [node._else] if node._else is not None else []
+    else:
+        children = []
+
+    for child in children:
+        for term in iter_terms(child, descend):
+            yield term
+
+
+def query_clauses(query, skip=None):
+    """
+    Returns the terms and criteria of the SELECT, WHERE, GROUP BY, HAVING and ORDER BY clauses of a query and the
+    criteria of its joins, except the join ``skip``.
+    """
+    clauses = list(query._selects) + list(query._groupbys) + [field for field, _ in query._orderbys]
+    clauses += [criterion for criterion in (query._wheres, query._havings) if criterion is not None]
+    clauses += [join.criteria for join in query._joins if join is not skip]
+    return clauses
+
+
+def subqueries(query):
+    """
+    Returns the queries nested directly in the FROM and JOIN clauses of a query.
+    """
+    from .queries import QueryBuilder
+    return [selectable
+            for selectable in query._selectables.values()
+            if isinstance(selectable, QueryBuilder)]
+
+
+def nested_queries(query):
+    """
+    Returns the queries nested directly in the FROM and JOIN clauses of a query and in its WITH clause.
+    """
+    return subqueries(query) + [expression.query for expression in query._with]
+
+
+def split_conjuncts(criterion):
+    """
+    Splits a criterion into the list of criteria which are combined with AND.
+    """
+    if isinstance(criterion, ComplexCriterion) and criterion.comparator is Boolean.and_:
+        return split_conjuncts(criterion.left) + split_conjuncts(criterion.right)
+    return [criterion]
+
+
+def conjoin(criteria):
+    """
+    Combines a list of criteria with AND.  Returns ``None`` for an empty list.
+    """
+    if not criteria:
+        return None
+    return reduce(lambda left, right: left & right, criteria)
+
+
+def normalize_comparison(criterion):
+    """
+    Returns a tuple of (comparator, term, value) for a criterion that compares a term to a literal, or ``None``.  The
+    literal is always returned on the right side, flipping the comparator where required.
+    """
+    if not isinstance(criterion, BasicCriterion) or isinstance(criterion, ComplexCriterion) \
+            or criterion.comparator not in _flipped:
+        return None
+
+    if isinstance(criterion.right, ValueWrapper) and not isinstance(criterion.left, ValueWrapper):
+        return criterion.comparator, criterion.left, criterion.right.value
+
+    if isinstance(criterion.left, ValueWrapper) and not isinstance(criterion.right, ValueWrapper):
+        return _flipped[criterion.comparator], criterion.right, criterion.left.value
+
+    return None
+
+
+def field_key(field):
+    """
+    Returns a key which identifies the column of a field by its table, regardless of the alias of the field.
+    """
+    return getattr(field.table, 'item_id', None), field.name
+
+
+def param_value(param):
+    return param.value if isinstance(param, ValueWrapper) else param
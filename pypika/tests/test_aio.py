@@ -0,0 +1,236 @@
+# coding: utf8
+"""
+The tests do not use ``async`` and ``await`` themselves, so that this module can be imported by the versions of Python
+which cannot parse them, and are skipped there.
+"""
+import sys
+import time
+import unittest
+
+from pypika import Query, Table, functions as fn
+from pypika.execution import sqlite_pool
+
+if sys.version_info >= (3, 7):
+    import asyncio
+    from pypika.aio import AsyncPool, BatchLoader, ThreadedDriver
+
+__author__ = "Timothy Heys"
+__email__ = "theys@kayak.com"
+
+# A query which counts forever unless it is interrupted
+_endless = 'WITH RECURSIVE "c"("x") AS (SELECT 1 UNION ALL SELECT "x"+1 FROM "c") SELECT COUNT(*) FROM "c"'
+
+_requires_aio = unittest.skipIf(sys.version_info < (3, 7), 'pypika.aio requires Python 3.7 or later')
+
+
+class AsyncTestCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.loop.shutdown_asyncgens())
+        self.loop.close()
+
+    def run_async(self, awaitable):
+        return self.loop.run_until_complete(awaitable)
+
+    def collect(self, rows, limit=None):
+        """
+        Reads the rows of an asynchronous iterator, at most ``limit`` of them.
+        """
+        collected = []
+        while limit is None or len(collected) < limit:
+            try:
+                collected.append(self.run_async(rows.__anext__()))
+            except StopAsyncIteration:
+                break
+        return collected
+
+
+@_requires_aio
+class AsyncPoolTests(AsyncTestCase):
+    t = Table('abc')
+
+    def setUp(self):
+        super(AsyncPoolTests, self).setUp()
+        self.sync_pool = sqlite_pool(max_size=2)
+        self.sync_pool.execute('CREATE TABLE "abc" ("foo" INTEGER)')
+        self.sync_pool.execute(Query.into(self.t).insert(*[(i,) for i in range(10)]))
+        self.pool = AsyncPool(ThreadedDriver(self.sync_pool), max_concurrency=2)
+
+    def tearDown(self):
+        super(AsyncPoolTests, self).tearDown()
+        self.sync_pool.close()
+
+    def test_fetch(self):
+        q = Query.from_(self.t).select(self.t.foo).where(self.t.foo > 7)
+
+        self.assertEqual([(8,), (9,)], self.run_async(self.pool.fetch(q)))
+
+    def test_fetch_without_offloading(self):
+        self.pool.offload_render = False
+        q = Query.from_(self.t).select(self.t.foo).where(self.t.foo == 3)
+
+        self.assertEqual([(3,)], self.run_async(self.pool.fetch(q)))
+
+    def test_fetch_many(self):
+        queries = [Query.from_(self.t).select(self.t.foo).where(self.t.foo == i) for i in range(5)]
+
+        self.assertEqual([[(i,)] for i in range(5)], self.run_async(self.pool.fetch_many(queries)))
+
+    def test_stream(self):
+        rows = self.pool.stream(Query.from_(self.t).select(self.t.foo), batch_size=3)
+
+        self.assertEqual([(i,) for i in range(10)], self.collect(rows))
+
+    def test_concurrency_limit(self):
+        running, peak = [0], [0]
+        driver = self.pool.driver
+        fetch, checkout = driver.fetch, self.sync_pool.checkout
+
+        def slow_checkout():
+            time.sleep(0.01)
+            return checkout()
+
+        def finished(task):
+            running[0] -= 1
+
+        def counting_fetch(sql, parameters):
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+            task = asyncio.ensure_future(fetch(sql, parameters))
+            task.add_done_callback(finished)
+            return task
+
+        self.sync_pool.checkout = slow_checkout
+        driver.fetch = counting_fetch
+        queries = [Query.from_(self.t).select(self.t.foo)] * 6
+
+        self.assertEqual(6, len(self.run_async(self.pool.fetch_many(queries))))
+        self.assertEqual(2, peak[0])
+
+    def test_cancel(self):
+        task = self.loop.create_task(self.pool.fetch(_endless))
+        self.run_async(asyncio.sleep(0.1))
+        task.cancel()
+        start = time.time()
+        with self.assertRaises(asyncio.CancelledError):
+            self.run_async(task)
+
+        self.assertLess(time.time() - start, 1)
+        self.assertEqual(self.sync_pool._size, len(self.sync_pool._idle))
+
+    def test_failure_cancels_others(self):
+        with self.assertRaises(Exception):
+            self.run_async(self.pool.fetch_many([_endless, 'SELECT * FROM "missing"']))
+
+        self.assertEqual(self.sync_pool._size, len(self.sync_pool._idle))
+
+    def test_closed_stream_releases_connection(self):
+        rows = self.pool.stream(Query.from_(self.t).select(self.t.foo), batch_size=2)
+        first = self.collect(rows, limit=1)
+        self.run_async(rows.aclose())
+
+        self.assertEqual([(0,)], first)
+        self.assertEqual(self.sync_pool._size, len(self.sync_pool._idle))
+
+
+@_requires_aio
+class BatchLoaderTests(AsyncTestCase):
+    t = Table('abc')
+
+    def setUp(self):
+        super(BatchLoaderTests, self).setUp()
+        self.sync_pool = sqlite_pool(max_size=2)
+        self.sync_pool.execute('CREATE TABLE "abc" ("foo" INTEGER, "bar" TEXT, "baz" INTEGER)')
+        self.sync_pool.execute(Query.into(self.t).insert(*[(i, 'x%d' % i, i % 2) for i in range(10)]))
+        self.pool = AsyncPool(ThreadedDriver(self.sync_pool), max_concurrency=2)
+        self.loader = BatchLoader(self.pool)
+
+        self.queries = []
+        fetch_many = self.pool.fetch_many
+
+        def recording_fetch_many(queries):
+            self.queries.extend(str(query) for query in queries)
+            return fetch_many(queries)
+
+        self.pool.fetch_many = recording_fetch_many
+
+    def tearDown(self):
+        super(BatchLoaderTests, self).tearDown()
+        self.sync_pool.close()
+
+    def load_all(self, queries, return_exceptions=False, **kwargs):
+        tasks = [self.loop.create_task(self.loader.load(query, **kwargs)) for query in queries]
+        return self.run_async(asyncio.gather(*tasks, return_exceptions=return_exceptions))
+
+    def lookup(self, foo):
+        return Query.from_(self.t).select(self.t.bar).where(self.t.foo == foo)
+
+    def test_batched(self):
+        results = self.load_all([self.lookup(3), self.lookup(1), self.lookup(42), self.lookup(3)])
+
+        self.assertEqual([[('x3',)], [('x1',)], [], [('x3',)]], results)
+        self.assertEqual(['SELECT "bar","foo" FROM "abc" WHERE "foo" IN (3,1,42)'], self.queries)
+
+    def test_converted_key(self):
+        results = self.load_all([self.lookup('3'), self.lookup('1'), self.lookup(1)])
+
+        self.assertEqual([[('x3',)], [('x1',)], [('x1',)]], results)
+        self.assertEqual(['SELECT "bar","foo" FROM "abc" WHERE "foo" IN (\'3\',\'1\')',
+                          'SELECT "bar","foo" FROM "abc" WHERE "foo" IN (1)',
+                          'SELECT "bar","foo" FROM "abc" WHERE "foo" IN (\'3\')',
+                          'SELECT "bar","foo" FROM "abc" WHERE "foo" IN (\'1\')'], self.queries)
+
+    def test_key_selected(self):
+        queries = [Query.from_(self.t).select(self.t.foo, self.t.bar).where(self.t.foo == foo) for foo in (1, 2)]
+
+        self.assertEqual([[(1, 'x1')], [(2, 'x2')]], self.load_all(queries))
+        self.assertEqual(['SELECT "foo","bar" FROM "abc" WHERE "foo" IN (1,2)'], self.queries)
+
+    def test_star(self):
+        queries = [Query.from_(self.t).select('*').where(self.t.foo == foo) for foo in (1, 2)]
+
+        self.assertEqual([[(1, 'x1', 1)], [(2, 'x2', 0)]], self.load_all(queries))
+
+    def test_other_criteria_and_order(self):
+        queries = [Query.from_(self.t).select(self.t.foo).where((self.t.foo == 1) | (self.t.foo > 7))
+                   .where(self.t.baz == bar).orderby(self.t.foo) for bar in (0, 1)]
+
+        self.assertEqual([[(8,)], [(1,), (9,)]], self.load_all(queries))
+        self.assertEqual(1, len(self.queries))
+
+    def test_explicit_key(self):
+        queries = [Query.from_(self.t).select(self.t.foo).where(self.t.baz == baz).where(self.t.foo == 1)
+                   for baz in (0, 1)]
+
+        self.assertEqual([[], [(1,)]], self.load_all(queries, key=self.t.baz))
+        self.assertEqual(['SELECT "foo","baz" FROM "abc" WHERE "foo"=1 AND "baz" IN (0,1)'], self.queries)
+
+    def test_different_shapes(self):
+        other = Query.from_(self.t).select(self.t.foo).where(self.t.foo == 2)
+
+        self.assertEqual([[('x1',)], [(2,)]], self.load_all([self.lookup(1), other]))
+        self.assertEqual(2, len(self.queries))
+
+    def test_chunked(self):
+        self.loader.max_batch = 3
+
+        results = self.load_all([self.lookup(i) for i in range(8)])
+
+        self.assertEqual([[('x%d' % i,)] for i in range(8)], results)
+        self.assertEqual(3, len(self.queries))
+
+    def test_aggregate_not_batched(self):
+        queries = [Query.from_(self.t).select(fn.Count('*')).where(self.t.baz == baz) for baz in (0, 1)]
+
+        self.assertEqual([[(5,)], [(5,)]], self.load_all(queries))
+        self.assertEqual([], self.queries)
+
+    def test_failure(self):
+        missing = Table('missing')
+        queries = [Query.from_(missing).select('*').where(missing.id == i) for i in (1, 2)]
+
+        results = self.load_all(queries, return_exceptions=True)
+        self.assertTrue(all(isinstance(result, Exception) for result in results))
+        self.assertEqual(1, len(self.queries))
@@ -0,0 +1,358 @@
+# coding: utf8
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from pypika import Query, Table
+from pypika import caching
+from pypika.caching import DiskCache, ResultCache
+from pypika.execution import sqlite_pool
+
+__author__ = "Timothy Heys"
+__email__ = "theys@kayak.com"
+
+
+class ResultCacheTests(unittest.TestCase):
+    t = Table('abc')
+
+    def setUp(self):
+        self.pool = sqlite_pool(max_size=4, timeout=5)
+        self.pool.execute('CREATE TABLE "abc" ("foo" INTEGER, "bar" TEXT)')
+        self.pool.execute(Query.into(self.t).insert((1, 'a'), (2, 'b'), (3, 'c')))
+        self.cache = ResultCache(self.pool)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def query(self, foo):
+        return Query.from_(self.t).select(self.t.bar).where(self.t.foo == foo)
+
+    def test_hit(self):
+        self.assertEqual([('a',)], self.cache.execute(self.query(1)))
+        self.pool.execute('UPDATE "abc" SET "bar"=\'z\'')
+
+        self.assertEqual([('a',)], self.cache.execute(self.query(1)))
+        self.assertEqual(1, self.cache.metrics.hits)
+        self.assertEqual(1, self.cache.metrics.misses)
+
+    def test_keyed_by_parameters(self):
+        self.assertEqual([('a',)], self.cache.execute(self.query(1)))
+        self.assertEqual([('b',)], self.cache.execute(self.query(2)))
+        self.assertEqual(2, self.cache.metrics.misses)
+
+    def test_normalized_sql(self):
+        self.cache.execute('SELECT "bar"  FROM "abc"\n WHERE "foo"=?', [1])
+
+        self.assertEqual([('a',)], self.cache.execute('SELECT "bar" FROM "abc" WHERE "foo"=?', [1]))
+        self.assertEqual(1, self.cache.metrics.hits)
+        self.assertNotEqual(self.cache.key("SELECT 'a  b'"), self.cache.key("SELECT 'a b'"))
+
+    def test_insert_not_cached(self):
+        self.cache.execute(Query.into(self.t).insert(4, 'd'))
+
+        self.assertEqual(0, len(self.cache))
+        self.assertEqual([(4,)], self.pool.execute('SELECT COUNT(*) FROM "abc"'))
+
+    def test_sql_string_write_not_cached(self):
+        self.cache.execute(self.query(1))
+        self.cache.execute('DELETE FROM "abc" WHERE "foo"=?', [1])
+
+        self.assertEqual(0, len(self.cache))
+        self.assertEqual([], self.cache.execute(self.query(1)))
+
+    def test_insert_invalidates_readers(self):
+        other = Table('xyz')
+        self.pool.execute('CREATE TABLE "xyz" ("foo" INTEGER)')
+        self.cache.execute(self.query(1))
+        self.cache.execute(Query.from_(other).select(other.foo))
+        self.cache.execute('SELECT 1')
+
+        self.cache.execute(Query.into(self.t).insert(4, 'd'))
+
+        self.assertEqual(1, len(self.cache))
+        self.cache.execute(Query.from_(other).select(other.foo))
+        self.assertEqual(1, self.cache.metrics.hits)
+
+    def test_write_during_read_not_cached(self):
+        execute = self.pool.execute
+
+        def racing_execute(query, parameters=None):
+            rows = execute(query, parameters)
+            self.pool.execute = execute
+            # The insert completes after the read has returned its rows, but before they are cached
+            self.cache.execute(Query.into(self.t).insert(1, 'd'))
+            return rows
+
+        self.pool.execute = racing_execute
+
+        self.assertEqual([('a',)], self.cache.execute(self.query(1)))
+        self.assertEqual(0, len(self.cache))
+        self.assertEqual([('a',), ('d',)], self.cache.execute(self.query(1)))
+
+    def test_write_to_other_table_during_read(self):
+        execute = self.pool.execute
+        self.pool.execute('CREATE TABLE "xyz" ("foo" INTEGER)')
+
+        def racing_execute(query, parameters=None):
+            self.pool.execute = execute
+            self.cache.execute(Query.into(Table('xyz')).insert(1))
+            return execute(query, parameters)
+
+        self.pool.execute = racing_execute
+        self.cache.execute(self.query(1))
+
+        self.assertEqual(1, len(self.cache))
+
+    def test_invalidate_tables(self):
+        self.cache.execute(self.query(1))
+        self.cache.invalidate_tables([('xyz', None)])
+        self.assertEqual(1, len(self.cache))
+
+        self.cache.invalidate_tables([('abc', None)])
+        self.assertEqual(0, len(self.cache))
+        self.assertEqual(0, self.cache.size)
+
+    def test_lru_eviction(self):
+        self.cache.max_entries = 2
+        self.cache.execute(self.query(1))
+        self.cache.execute(self.query(2))
+        self.cache.execute(self.query(1))
+        self.cache.execute(self.query(3))
+
+        self.assertEqual(2, len(self.cache))
+        self.assertEqual(1, self.cache.metrics.evictions)
+        self.cache.execute(self.query(1))
+        self.assertEqual(2, self.cache.metrics.hits)
+
+    def test_byte_budget(self):
+        self.cache.execute(self.query(1))
+        self.cache.max_bytes = self.cache.size + 1
+        self.cache.execute(self.query(2))
+
+        self.assertEqual(1, len(self.cache))
+        self.assertLessEqual(self.cache.size, self.cache.max_bytes)
+        self.assertEqual(1, self.cache.metrics.evictions)
+
+    def test_too_large_not_cached(self):
+        self.cache.max_bytes = 10
+        self.cache.execute(self.query(1))
+
+        self.assertEqual(0, len(self.cache))
+        self.assertEqual(0, self.cache.size)
+
+    def test_ttl(self):
+        now = [0]
+        clock, caching._clock = caching._clock, lambda: now[0]
+        try:
+            self.cache.execute(self.query(1), ttl=10)
+            now[0] = 5
+            self.cache.execute(self.query(1))
+            now[0] = 10
+            self.cache.execute(self.query(1))
+        finally:
+            caching._clock = clock
+
+        self.assertEqual(1, self.cache.metrics.hits)
+        self.assertEqual(2, self.cache.metrics.misses)
+        self.assertEqual(1, self.cache.metrics.expirations)
+
+    def test_invalidate(self):
+        self.cache.execute(self.query(1))
+        self.cache.invalidate(self.query(1))
+
+        self.assertEqual(0, len(self.cache))
+        self.assertEqual(0, self.cache.size)
+
+    def test_single_flight(self):
+        executed = threading.Event()
+        release = threading.Event()
+        calls = []
+        execute = self.pool.execute
+
+        def slow_execute(query, parameters=None):
+            calls.append(query)
+            executed.set()
+            release.wait(5)
+            return execute(query, parameters)
+
+        self.pool.execute = slow_execute
+        results = []
+
+        def run():
+            results.append(self.cache.execute(self.query(1)))
+
+        threads = [threading.Thread(target=run) for _ in range(4)]
+        threads[0].start()
+        executed.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        while self.cache.metrics.shared < 3:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(1, len(calls))
+        self.assertEqual([[('a',)]] * 4, results)
+        self.assertEqual(3, self.cache.metrics.shared)
+
+    def test_failure_shared(self):
+        with self.assertRaises(Exception):
+            self.cache.execute('SELECT * FROM "missing"')
+
+        self.assertEqual({}, self.cache._flights)
+        self.assertEqual(0, len(self.cache))
+
+
+@unittest.skipUnless(numpy is not None, 'numpy is not installed')
+class DiskCacheTests(unittest.TestCase):
+    t = Table('abc')
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.pool = sqlite_pool(max_size=4, timeout=5)
+        self.pool.execute('CREATE TABLE "abc" ("foo" INTEGER, "bar" TEXT)')
+        self.pool.execute(Query.into(self.t).insert((1, 'a'), (2, 'b'), (3, 'c')))
+        self.cache = DiskCache(self.pool, self.directory)
+
+    def tearDown(self):
+        self.pool.close()
+        shutil.rmtree(self.directory)
+
+    def query(self, foo):
+        return Query.from_(self.t).select(self.t.foo, self.t.bar).where(self.t.foo >= foo).orderby(self.t.foo)
+
+    def test_hit(self):
+        result = self.cache.execute(self.query(2))
+        self.assertIsInstance(result['foo'], numpy.memmap)
+        self.assertEqual([2, 3], result['foo'].tolist())
+        self.assertEqual(['b', 'c'], result['bar'][:])
+
+        self.pool.execute('DELETE FROM "abc"')
+
+        self.assertEqual([2, 3], self.cache.execute(self.query(2))['foo'].tolist())
+        self.assertEqual(1, self.cache.metrics.hits)
+        self.assertEqual(1, self.cache.metrics.misses)
+
+    def test_bytes(self):
+        self.cache.execute('SELECT X\'00FF\' "a" UNION ALL SELECT NULL')
+
+        self.assertEqual([b'\x00\xff', None], self.cache.execute('SELECT X\'00FF\' "a" UNION ALL SELECT NULL')['a'][:])
+        self.assertEqual(1, self.cache.metrics.hits)
+
+    def test_shared_between_caches(self):
+        self.cache.execute(self.query(1))
+
+        # The pool of the other cache does not have the table
+        other_pool = sqlite_pool()
+        try:
+            other = DiskCache(other_pool, self.directory)
+            self.assertEqual([1, 2, 3], other.execute(self.query(1))['foo'].tolist())
+        finally:
+            other_pool.close()
+        self.assertEqual(1, other.metrics.hits)
+
+    def test_single_producer(self):
+        calls = []
+        spill_columns = self.pool.spill_columns
+
+        def slow_spill_columns(*args, **kwargs):
+            calls.append(1)
+            time.sleep(0.05)
+            return spill_columns(*args, **kwargs)
+
+        self.pool.spill_columns = slow_spill_columns
+        caches = [DiskCache(self.pool, self.directory) for _ in range(3)]
+        results = []
+        threads = [threading.Thread(target=lambda cache=cache: results.append(cache.execute(self.query(1))))
+                   for cache in caches]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(1, len(calls))
+        self.assertEqual([[1, 2, 3]] * 3, [result['foo'].tolist() for result in results])
+
+    def test_no_temporary_files_left(self):
+        self.cache.execute(self.query(1))
+
+        self.assertEqual({'index.json', 'locks', self.cache.fingerprint(self.query(1))},
+                         set(os.listdir(self.directory)))
+
+    def test_size_eviction(self):
+        self.cache.execute(self.query(1))
+        self.cache.max_bytes = self.cache.size + 1
+        self.cache.execute(self.query(2))
+
+        self.assertEqual(1, len(self.cache))
+        self.assertEqual(1, self.cache.metrics.evictions)
+        self.assertFalse(os.path.exists(os.path.join(self.directory, self.cache.fingerprint(self.query(1)))))
+
+    def test_evicted_result_stays_readable(self):
+        result = self.cache.execute(self.query(1))
+        self.cache.clear()
+
+        self.assertEqual(0, len(self.cache))
+        self.assertEqual([1, 2, 3], result['foo'].tolist())
+
+    def test_ttl(self):
+        self.cache.execute(self.query(1))
+        self.pool.execute('DELETE FROM "abc" WHERE "foo"=1')
+
+        self.assertEqual([2, 3], self.cache.execute(self.query(1), ttl=0)['foo'].tolist())
+        self.assertEqual(1, self.cache.metrics.expirations)
+        self.assertEqual(1, len(self.cache))
+
+    def test_insert_invalidates_readers(self):
+        self.cache.execute(self.query(1))
+        self.cache.execute(Query.into(self.t).insert(4, 'd'))
+
+        self.assertEqual(0, len(self.cache))
+        self.assertEqual([1, 2, 3, 4], self.cache.execute(self.query(1))['foo'].tolist())
+
+    def test_sql_string_write_not_cached(self):
+        self.cache.execute(self.query(1))
+        self.cache.execute('DELETE FROM "abc" WHERE "foo"=?', [1])
+
+        self.assertEqual(0, len(self.cache))
+        self.assertEqual([2, 3], self.cache.execute(self.query(1))['foo'].tolist())
+
+    def test_invalidate(self):
+        self.cache.execute(self.query(1))
+        self.cache.invalidate(self.query(1))
+
+        self.assertEqual(0, len(self.cache))
+        self.assertEqual(0, self.cache.size)
+
+    def test_write_during_read_not_cached(self):
+        spill_columns = self.pool.spill_columns
+
+        def racing_spill_columns(*args, **kwargs):
+            result = spill_columns(*args, **kwargs)
+            self.pool.spill_columns = spill_columns
+            # Another worker inserts a row after the result was read, but before it is cached
+            DiskCache(self.pool, self.directory).execute(Query.into(self.t).insert(1, 'd'))
+            return result
+
+        self.pool.spill_columns = racing_spill_columns
+
+        self.assertEqual(['a', 'b', 'c'], self.cache.execute(self.query(1))['bar'][:])
+        self.assertEqual(0, len(self.cache))
+        self.assertEqual({'index.json', 'locks'}, set(os.listdir(self.directory)))
+        self.assertEqual(['a', 'd', 'b', 'c'], self.cache.execute(self.query(1))['bar'][:])
+
+    def test_failure_not_cached(self):
+        with self.assertRaises(Exception):
+            self.cache.execute('SELECT * FROM "missing"')
+
+        self.assertEqual(0, len(self.cache))
+        self.assertEqual({'locks'}, set(os.listdir(self.directory)))
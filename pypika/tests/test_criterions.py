@@ -2,7 +2,7 @@
 import unittest
 from datetime import date, datetime
 
-from pypika import Field, Table, functions as fn
+from pypika import Field, Query, Table, Tables, Exists, NotExists, functions as fn
 from pypika.terms import Mod
 
 __author__ = "Timothy Heys"
@@ -407,3 +407,39 @@ class CriterionOperationsTests(unittest.TestCase):
         f = self.t0.foo.notnull().for_(self.t1)
 
         self.assertEqual('\"t1\".\"foo\" IS NOT NULL', str(f))
+
+
+class SubqueryCriterionTests(unittest.TestCase):
+    t, t2 = Tables('abc', 'efg')
+
+    def test_isin_subquery(self):
+        c = self.t.foo.isin(Query.from_(self.t2).select(self.t2.bar))
+
+        self.assertEqual('"foo" IN (SELECT "bar" FROM "efg")', c.get_sql(subquery=True))
+
+    def test_notin_list(self):
+        c = self.t.foo.notin([1, 2])
+
+        self.assertEqual('"foo" NOT IN (1,2)', str(c))
+
+    def test_notin_subquery(self):
+        c = self.t.foo.notin(Query.from_(self.t2).select(self.t2.bar))
+
+        self.assertEqual('"foo" NOT IN (SELECT "bar" FROM "efg")', c.get_sql(subquery=True))
+
+    def test_exists(self):
+        c = Exists(Query.from_(self.t2).select(self.t2.bar))
+
+        self.assertEqual('EXISTS (SELECT "bar" FROM "efg")', str(c))
+
+    def test_not_exists(self):
+        c = NotExists(Query.from_(self.t2).select(self.t2.bar))
+
+        self.assertEqual('NOT EXISTS (SELECT "bar" FROM "efg")', str(c))
+
+    def test_exists_in_where(self):
+        q = Query.from_(self.t).select(self.t.foo).where(
+            Exists(Query.from_(self.t2).select(self.t2.bar)) & (self.t.foo == 1)
+        )
+
+        self.assertEqual('SELECT "foo" FROM "abc" WHERE EXISTS (SELECT "bar" FROM "efg") AND "foo"=1', str(q))
@@ -0,0 +1,383 @@
+# coding: utf8
+import os
+import pickle
+import re
+import shutil
+import tempfile
+import threading
+import tracemalloc
+import unittest
+from datetime import datetime, timedelta, timezone
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from pypika import Query, Table, ExecutionException, functions as fn
+from pypika import execution
+from pypika.execution import ConnectionPool, MappedResult, sqlite_pool
+
+__author__ = "Timothy Heys"
+__email__ = "theys@kayak.com"
+
+
+class ConnectionPoolTests(unittest.TestCase):
+    t = Table('abc')
+
+    def setUp(self):
+        self.pool = sqlite_pool(max_size=2, timeout=5)
+        self.pool.execute('CREATE TABLE "abc" ("foo" INTEGER, "bar" TEXT)')
+        self.pool.execute(Query.into(self.t).insert((1, 'a'), (2, "b'c"), (3, 'd')))
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_execute(self):
+        q = Query.from_(self.t).select(self.t.foo).where(self.t.bar.isin(['a', "b'c"])).orderby(self.t.foo)
+
+        self.assertEqual([(1,), (2,)], self.pool.execute(q))
+
+    def test_execute_sql(self):
+        self.assertEqual([(3,)], self.pool.execute('SELECT "foo" FROM "abc" WHERE "bar"=?', ['d']))
+
+    def test_statement_without_rows(self):
+        self.assertEqual([], self.pool.execute(Query.into(self.t).insert(4, 'e')))
+        self.assertEqual([(4,)], self.pool.execute('SELECT COUNT(*) FROM "abc"'))
+
+    def test_memory_without_uri(self):
+        sqlite_uri, execution._sqlite_uri = execution._sqlite_uri, False
+        try:
+            with sqlite_pool(max_size=2) as pool:
+                pool.execute('CREATE TABLE "abc" ("foo" INTEGER)')
+                pool.execute('INSERT INTO "abc" VALUES (1)')
+
+                self.assertEqual(1, pool.max_size)
+                self.assertEqual([(1,)], pool.execute('SELECT "foo" FROM "abc"'))
+        finally:
+            execution._sqlite_uri = sqlite_uri
+
+    def test_rollback(self):
+        with self.assertRaises(ValueError):
+            with self.pool.connection() as connection:
+                connection.execute('INSERT INTO "abc" VALUES (5, \'f\')')
+                raise ValueError()
+
+        self.assertEqual([(3,)], self.pool.execute('SELECT COUNT(*) FROM "abc"'))
+
+    def test_connections_reused(self):
+        with self.pool.connection() as first:
+            pass
+        with self.pool.connection() as second:
+            pass
+
+        self.assertIs(first, second)
+
+    def test_bounded(self):
+        first, second = self.pool.checkout(), self.pool.checkout()
+        self.pool.timeout = 0.01
+
+        with self.assertRaises(ExecutionException):
+            self.pool.checkout()
+
+        self.pool.checkin(first)
+        self.assertIs(first, self.pool.checkout())
+        self.assertEqual(1, self.pool.metrics.timeouts)
+        self.pool.checkin(first)
+        self.pool.checkin(second)
+
+    def test_threads(self):
+        q = Query.from_(self.t).select(self.t.foo).where(self.t.foo > 1)
+        results = []
+
+        def work():
+            for _ in range(20):
+                results.append(self.pool.execute(q))
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([[(2,), (3,)]] * 80, results)
+        self.assertLessEqual(self.pool._size, 2)
+
+    def test_metrics(self):
+        checkouts = self.pool.metrics.checkouts
+        self.pool.execute(Query.from_(self.t).select(self.t.foo))
+
+        self.assertEqual(checkouts + 1, self.pool.metrics.checkouts)
+        self.assertGreater(self.pool.metrics.checkout_time, 0)
+        self.assertGreaterEqual(self.pool.metrics.max_wait, self.pool.metrics.mean_wait)
+
+    def test_closed(self):
+        self.pool.close()
+
+        with self.assertRaises(ExecutionException):
+            self.pool.checkout()
+
+    def test_failed_connect_releases_slot(self):
+        attempts = []
+
+        def connect():
+            attempts.append(1)
+            raise IOError()
+
+        pool = ConnectionPool(connect, max_size=1, timeout=0.01)
+        for _ in range(2):
+            with self.assertRaises(IOError):
+                pool.checkout()
+
+        self.assertEqual(2, len(attempts))
+
+
+class IterateTests(unittest.TestCase):
+    def setUp(self):
+        self.pool = sqlite_pool(max_size=1, timeout=5)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_iterate(self):
+        rows = self.pool.iterate('SELECT 1 UNION ALL SELECT 2 UNION ALL SELECT 3', batch_size=2)
+
+        self.assertEqual([(1,), (2,), (3,)], list(rows))
+
+    def test_flat_memory(self):
+        sql = ('WITH RECURSIVE "n"("i") AS (SELECT 1 UNION ALL SELECT "i"+1 FROM "n" WHERE "i"<?) '
+               'SELECT "i",\'abcdefghij\' FROM "n"')
+
+        tracemalloc.start()
+        try:
+            count = sum(1 for _ in self.pool.iterate(sql, [200000], batch_size=500))
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        self.assertEqual(200000, count)
+        # Holding all rows would take tens of megabytes
+        self.assertLess(peak, 2 * 1024 * 1024)
+
+    def test_closed_iteration_releases_connection(self):
+        rows = self.pool.iterate('SELECT 1 UNION ALL SELECT 2')
+        next(rows)
+        rows.close()
+
+        self.assertEqual([(1,)], self.pool.execute('SELECT 1'))
+
+    def test_declared_cursor(self):
+        statements = []
+        batches = [[(1,), (2,)], [(3,)], []]
+
+        class Cursor(object):
+            def execute(self, sql, parameters=()):
+                statements.append(re.sub(r'pypika_\w+', 'c', sql))
+
+            def fetchall(self):
+                return batches.pop(0)
+
+            def close(self):
+                statements.append('close')
+
+        class Connection(object):
+            cursor = Cursor
+            commit = rollback = close = lambda self: None
+
+        pool = ConnectionPool(Connection, vendor='postgresql')
+        rows = list(pool.iterate('SELECT "foo" FROM "abc"', batch_size=2))
+
+        self.assertEqual([(1,), (2,), (3,)], rows)
+        self.assertEqual(['DECLARE "c" NO SCROLL CURSOR FOR SELECT "foo" FROM "abc"',
+                          'FETCH 2 FROM "c"', 'FETCH 2 FROM "c"', 'FETCH 2 FROM "c"', 'CLOSE "c"', 'close'],
+                         statements)
+
+
+@unittest.skipUnless(numpy is not None, 'numpy is not installed')
+class FetchColumnsTests(unittest.TestCase):
+    t = Table('abc')
+
+    def setUp(self):
+        self.pool = sqlite_pool(max_size=1)
+        self.pool.execute('CREATE TABLE "abc" ("foo" INTEGER, "bar" REAL, "day" TEXT, "time" TEXT, "name" TEXT)')
+        self.pool.execute(Query.into(self.t).insert(
+            (1, 1.5, '2018-01-01', '2018-01-01 10:00:00', 'a'),
+            (2, None, None, '2018-01-02 11:30:00', 'b'),
+            (3, 3, '2018-01-03', None, None),
+        ))
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_columns(self):
+        q = Query.from_(self.t).select(self.t.foo, self.t.bar.as_('baz'), self.t.day, self.t.time, self.t.name)
+
+        columns = self.pool.fetch_columns(q, batch_size=2)
+
+        self.assertEqual(['foo', 'baz', 'day', 'time', 'name'], list(columns))
+        self.assertEqual(numpy.int64, columns['foo'].dtype)
+        self.assertEqual([1, 2, 3], columns['foo'].tolist())
+        self.assertTrue(numpy.isnan(columns['baz'][1]))
+        self.assertEqual(numpy.dtype('datetime64[D]'), columns['day'].dtype)
+        self.assertTrue(numpy.isnat(columns['day'][1]))
+        self.assertEqual(numpy.datetime64('2018-01-02T11:30'), columns['time'][1])
+        self.assertEqual(['a', 'b', None], columns['name'].tolist())
+
+    def test_promoted_by_later_batch(self):
+        columns = self.pool.fetch_columns('SELECT 1 "a",\'x\' "b" UNION ALL SELECT 2.5,3', batch_size=1)
+
+        self.assertEqual(numpy.float64, columns['a'].dtype)
+        self.assertEqual([1.0, 2.5], columns['a'].tolist())
+        self.assertEqual(['x', 3], columns['b'].tolist())
+
+    def test_cast(self):
+        q = Query.from_(self.t).select(fn.Cast(self.t.foo, 'FLOAT').as_('foo'))
+
+        self.assertEqual(numpy.float64, self.pool.fetch_columns(q)['foo'].dtype)
+
+    def test_star(self):
+        columns = self.pool.fetch_columns(Query.from_(self.t).select('*'))
+
+        self.assertEqual(['foo', 'bar', 'day', 'time', 'name'], list(columns))
+
+    def test_empty(self):
+        columns = self.pool.fetch_columns('SELECT "foo" FROM "abc" WHERE "foo">?', [5])
+
+        self.assertEqual(0, len(columns['foo']))
+
+    def test_without_numpy(self):
+        numpy_module, execution.numpy = execution.numpy, None
+        try:
+            with self.assertRaises(ExecutionException):
+                self.pool.fetch_columns(Query.from_(self.t).select(self.t.foo))
+        finally:
+            execution.numpy = numpy_module
+
+
+@unittest.skipUnless(numpy is not None, 'numpy is not installed')
+class SpillColumnsTests(unittest.TestCase):
+    t = Table('abc')
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.pool = sqlite_pool(max_size=1)
+        self.pool.execute('CREATE TABLE "abc" ("foo" INTEGER, "bar" TEXT, "day" TEXT)')
+        self.pool.execute(Query.into(self.t).insert(
+            (1, 'a', '2018-01-01'),
+            (2, None, None),
+            (3, u'\xe9t\xe9', '2018-01-03'),
+        ))
+
+    def tearDown(self):
+        self.pool.close()
+        shutil.rmtree(self.directory)
+
+    def spill(self, query, parameters=None, **kwargs):
+        return self.pool.spill_columns(query, parameters, directory=os.path.join(self.directory, 'result'), **kwargs)
+
+    def test_spill(self):
+        result = self.spill(Query.from_(self.t).select(self.t.foo, self.t.bar, self.t.day), batch_size=2)
+
+        self.assertEqual(['foo', 'bar', 'day'], result.names)
+        self.assertEqual(3, len(result))
+        self.assertIsInstance(result['foo'], numpy.memmap)
+        self.assertEqual([2, 3], result['foo'][1:].tolist())
+        self.assertEqual(['a', None, u'\xe9t\xe9'], result['bar'][:])
+        self.assertEqual(u'\xe9t\xe9', result['bar'][-1])
+        self.assertEqual(numpy.datetime64('2018-01-03'), result['day'][2])
+
+    def test_reopen(self):
+        self.spill(Query.from_(self.t).select(self.t.foo, self.t.bar))
+
+        result = MappedResult(os.path.join(self.directory, 'result'))
+
+        self.assertEqual([1, 2, 3], result['foo'].tolist())
+        self.assertEqual(['a', None, u'\xe9t\xe9'], list(result['bar']))
+
+    def test_pickle(self):
+        result = pickle.loads(pickle.dumps(self.spill(Query.from_(self.t).select(self.t.foo))))
+
+        self.assertIsInstance(result['foo'], numpy.memmap)
+        self.assertEqual([1, 2, 3], result['foo'].tolist())
+
+    def test_widened_by_later_batch(self):
+        result = self.spill('SELECT 1 "a",NULL "b" UNION ALL SELECT 2.5,\'x\'', batch_size=1)
+
+        self.assertEqual([1.0, 2.5], result['a'].tolist())
+        self.assertEqual([None, 'x'], result['b'][:])
+
+    def spill_rows(self, rows, **kwargs):
+        batches = [rows]
+
+        class Cursor(object):
+            description = [('a',)]
+
+            def execute(self, sql, parameters=()):
+                pass
+
+            def fetchmany(self, size):
+                batch, batches[0] = batches[0][:size], batches[0][size:]
+                return batch
+
+            def close(self):
+                pass
+
+        class Connection(object):
+            cursor = Cursor
+            commit = rollback = close = lambda self: None
+
+        pool = ConnectionPool(Connection)
+        return pool.spill_columns('SELECT "a"', directory=os.path.join(self.directory, 'result'), **kwargs)
+
+    def test_bytes(self):
+        result = self.spill('SELECT NULL "a" UNION ALL SELECT X\'00FF\' UNION ALL SELECT X\'\'', batch_size=1)
+
+        self.assertEqual([None, b'\x00\xff', b''], result['a'][:])
+
+    def test_nullable_bool(self):
+        result = self.spill_rows([(True,), (False,), (None,)], batch_size=2)
+
+        self.assertEqual('float64', result['a'].dtype)
+        self.assertEqual([1.0, 0.0], result['a'][:2].tolist())
+        self.assertTrue(numpy.isnan(result['a'][2]))
+
+    def test_timezone_aware_timestamps(self):
+        tz = timezone(timedelta(hours=2))
+        result = self.spill_rows([(datetime(2018, 1, 1, 12, tzinfo=tz),), (None,), (datetime(2018, 1, 2),)])
+
+        self.assertEqual([numpy.datetime64('2018-01-01T10:00'), numpy.datetime64('2018-01-02T00:00')],
+                         list(result['a'][[0, 2]]))
+        self.assertTrue(numpy.isnat(result['a'][1]))
+
+    def test_unsupported_type(self):
+        with self.assertRaisesRegex(ExecutionException, 'list'):
+            self.spill_rows([([1],)])
+
+    def test_mixed_strings_and_bytes(self):
+        with self.assertRaises(ExecutionException):
+            self.spill_rows([('a',), (b'b',)])
+
+    def test_empty(self):
+        result = self.spill('SELECT "foo","bar" FROM "abc" WHERE "foo">?', [5])
+
+        self.assertEqual(0, len(result))
+        self.assertEqual(0, len(result['foo']))
+
+    def test_delete(self):
+        result = self.spill(Query.from_(self.t).select(self.t.foo))
+        result.delete()
+
+        self.assertFalse(os.path.exists(result.directory))
+
+    def test_temporary_directory(self):
+        result = self.pool.spill_columns(Query.from_(self.t).select(self.t.foo))
+        try:
+            self.assertEqual(3, len(result['foo']))
+        finally:
+            result.delete()
+
+    def test_failure_removes_directory(self):
+        with self.assertRaises(Exception):
+            self.spill('SELECT * FROM "missing"')
+
+        self.assertFalse(os.path.exists(os.path.join(self.directory, 'result')))
@@ -1,7 +1,8 @@
 # coding: utf8
 import unittest
 
-from pypika import Query as Q, Table as T, Field as F, functions as fn, CaseException, Case, Interval, DatePart
+from pypika import Query as Q, Table as T, Field as F, functions as fn, CaseException, Case, Interval, DatePart, Order
+from pypika import Preceding, Following, CURRENT_ROW
 from pypika.enums import SqlTypes
 
 __author__ = "Timothy Heys"
@@ -533,3 +534,100 @@ class DateFunctionsTests(unittest.TestCase):
 
     def test_extract_year(self):
         self._test_extract_datepart(DatePart.year)
+
+
+class AnalyticTests(unittest.TestCase):
+    t = T('abc')
+
+    def test_row_number(self):
+        q = Q.from_(self.t).select(fn.RowNumber().over(self.t.foo).orderby(self.t.date))
+
+        self.assertEqual('SELECT ROW_NUMBER() OVER(PARTITION BY "foo" ORDER BY "date") FROM "abc"', str(q))
+
+    def test_rank_and_dense_rank(self):
+        q = Q.from_(self.t).select(
+            fn.Rank().over(self.t.foo).orderby(self.t.bar, order=Order.desc),
+            fn.DenseRank().orderby(self.t.bar),
+        )
+
+        self.assertEqual('SELECT RANK() OVER(PARTITION BY "foo" ORDER BY "bar" DESC),'
+                         'DENSE_RANK() OVER(ORDER BY "bar") FROM "abc"', str(q))
+
+    def test_empty_over(self):
+        q = Q.from_(self.t).select(fn.Sum(self.t.bar).over())
+
+        self.assertEqual('SELECT SUM("bar") OVER() FROM "abc"', str(q))
+
+    def test_multiple_partitions_and_orders(self):
+        q = Q.from_(self.t).select(
+            fn.RowNumber().over(self.t.foo, self.t.fiz).orderby(self.t.bar, order=Order.asc).orderby(self.t.buz)
+        )
+
+        self.assertEqual('SELECT ROW_NUMBER() OVER(PARTITION BY "foo","fiz" ORDER BY "bar" ASC,"buz") FROM "abc"',
+                         str(q))
+
+    def test_lag_and_lead(self):
+        q = Q.from_(self.t).select(
+            fn.Lag(self.t.bar).over(self.t.foo).orderby(self.t.date),
+            fn.Lead(self.t.bar, 2, 0).over(self.t.foo).orderby(self.t.date),
+        )
+
+        self.assertEqual('SELECT LAG("bar",1) OVER(PARTITION BY "foo" ORDER BY "date"),'
+                         'LEAD("bar",2,0) OVER(PARTITION BY "foo" ORDER BY "date") FROM "abc"', str(q))
+
+    def test_first_and_last_value(self):
+        q = Q.from_(self.t).select(
+            fn.FirstValue(self.t.bar).over(self.t.foo).orderby(self.t.date),
+            fn.LastValue(self.t.bar).over(self.t.foo).orderby(self.t.date).rows(Preceding(), Following()),
+        )
+
+        self.assertEqual('SELECT FIRST_VALUE("bar") OVER(PARTITION BY "foo" ORDER BY "date"),'
+                         'LAST_VALUE("bar") OVER(PARTITION BY "foo" ORDER BY "date" '
+                         'ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING) FROM "abc"', str(q))
+
+    def test_running_total(self):
+        q = Q.from_(self.t).select(
+            fn.Sum(self.t.bar).over(self.t.foo).orderby(self.t.date).rows(Preceding(), CURRENT_ROW).as_('total')
+        )
+
+        self.assertEqual('SELECT SUM("bar") OVER(PARTITION BY "foo" ORDER BY "date" '
+                         'ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW) "total" FROM "abc"', str(q))
+
+    def test_moving_average_single_bound(self):
+        q = Q.from_(self.t).select(
+            fn.Avg(self.t.bar).orderby(self.t.date).range(Preceding(7)),
+        )
+
+        self.assertEqual('SELECT AVG("bar") OVER(ORDER BY "date" RANGE 7 PRECEDING) FROM "abc"', str(q))
+
+    def test_aggregate_without_over_unchanged(self):
+        q = Q.from_(self.t).select(fn.Sum(self.t.bar)).groupby(self.t.foo)
+
+        self.assertEqual('SELECT SUM("bar") FROM "abc" GROUP BY "foo"', str(q))
+
+    def test_in_orderby(self):
+        q = Q.from_(self.t).select(self.t.foo).orderby(fn.RowNumber().over(self.t.foo).orderby(self.t.date))
+
+        self.assertEqual('SELECT "foo" FROM "abc" ORDER BY ROW_NUMBER() OVER(PARTITION BY "foo" ORDER BY "date")',
+                         str(q))
+
+    def test_top_n_per_group_subquery(self):
+        ranked = Q.from_(self.t).select(
+            self.t.origin,
+            self.t.route,
+            fn.RowNumber().over(self.t.origin).orderby(self.t.flights, order=Order.desc).as_('rn'),
+        )
+        q = Q.from_(ranked).select(ranked.origin, ranked.route).where(ranked.rn <= 10)
+
+        self.assertEqual('SELECT "origin","route" FROM ('
+                         'SELECT "origin","route",ROW_NUMBER() OVER(PARTITION BY "origin" ORDER BY "flights" DESC) "rn" '
+                         'FROM "abc") WHERE "rn"<=10', str(q))
+
+    def test_joined_table_in_window(self):
+        t2 = T('efg')
+        q = Q.from_(self.t).join(t2).on(self.t.id == t2.abc_id).select(
+            fn.RowNumber().over(t2.foo).orderby(self.t.date)
+        )
+
+        self.assertEqual('SELECT ROW_NUMBER() OVER(PARTITION BY "t1"."foo" ORDER BY "t0"."date") '
+                         'FROM "abc" "t0" JOIN "efg" "t1" ON "t0"."id"="t1"."abc_id"', str(q))
@@ -1,7 +1,7 @@
 # coding: utf-8
 import unittest
 
-from pypika import Table, Query, Rollup, functions as fn, RollupException
+from pypika import Table, Query, Rollup, Cube, GroupingSets, functions as fn, RollupException, GroupingException
 
 __author__ = "Timothy Heys"
 __email__ = "theys@kayak.com"
@@ -142,3 +142,88 @@ class RollupTests(unittest.TestCase):
         )
 
         self.assertEqual('SELECT "foo","fiz",SUM("bar") FROM "abc" GROUP BY ROLLUP("foo"),ROLLUP("fiz")', str(q))
+
+
+class CubeTests(unittest.TestCase):
+    table = Table('abc')
+
+    def test_func_cube(self):
+        q = Query.from_(self.table).select(
+            self.table.foo,
+            self.table.fiz,
+            fn.Sum(self.table.bar)
+        ).groupby(
+            Cube(self.table.foo, self.table.fiz)
+        )
+
+        self.assertEqual('SELECT "foo","fiz",SUM("bar") FROM "abc" GROUP BY CUBE("foo","fiz")', str(q))
+
+    def test_cube(self):
+        q = Query.from_(self.table).select(
+            self.table.foo,
+            self.table.fiz,
+            fn.Sum(self.table.bar)
+        ).groupby(
+            self.table.buz
+        ).cube(
+            self.table.foo,
+            self.table.fiz,
+        )
+
+        self.assertEqual('SELECT "foo","fiz",SUM("bar") FROM "abc" GROUP BY "buz",CUBE("foo","fiz")', str(q))
+
+    def test_cube_unsupported_vendor(self):
+        for vendor in ['mysql', 'sqlite']:
+            with self.assertRaises(GroupingException):
+                Query.from_(self.table).select(
+                    self.table.foo,
+                    fn.Sum(self.table.bar)
+                ).cube(self.table.foo, vendor=vendor)
+
+
+class GroupingSetsTests(unittest.TestCase):
+    table = Table('abc')
+
+    def test_func_grouping_sets(self):
+        q = Query.from_(self.table).select(
+            self.table.foo,
+            self.table.fiz,
+            fn.Sum(self.table.bar)
+        ).groupby(
+            GroupingSets((self.table.foo, self.table.fiz), self.table.foo, ())
+        )
+
+        self.assertEqual('SELECT "foo","fiz",SUM("bar") FROM "abc" '
+                         'GROUP BY GROUPING SETS(("foo","fiz"),"foo",())', str(q))
+
+    def test_grouping_sets(self):
+        q = Query.from_(self.table).select(
+            self.table.foo,
+            self.table.fiz,
+            fn.Grouping(self.table.foo, self.table.fiz),
+            fn.Sum(self.table.bar)
+        ).grouping_sets(
+            [self.table.foo],
+            [self.table.fiz],
+        )
+
+        self.assertEqual('SELECT "foo","fiz",GROUPING("foo","fiz"),SUM("bar") FROM "abc" '
+                         'GROUP BY GROUPING SETS("foo","fiz")', str(q))
+
+    def test_grouping_alias(self):
+        q = Query.from_(self.table).select(
+            self.table.foo,
+            fn.Grouping(self.table.foo, alias='is_total'),
+            fn.Sum(self.table.bar)
+        ).grouping_sets(self.table.foo, ())
+
+        self.assertEqual('SELECT "foo",GROUPING("foo") "is_total",SUM("bar") FROM "abc" '
+                         'GROUP BY GROUPING SETS("foo",())', str(q))
+
+    def test_grouping_sets_unsupported_vendor(self):
+        for vendor in ['mysql', 'sqlite']:
+            with self.assertRaises(GroupingException):
+                Query.from_(self.table).select(
+                    self.table.foo,
+                    fn.Sum(self.table.bar)
+                ).grouping_sets(self.table.foo, (), vendor=vendor)
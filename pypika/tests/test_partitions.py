@@ -0,0 +1,547 @@
+# coding: utf8
+import unittest
+from collections import OrderedDict
+from datetime import date, datetime
+
+from pypika import Query, Table, ShardedTable, DatePart, Order, QueryException, functions as fn, partitions
+
+__author__ = "Timothy Heys"
+__email__ = "theys@kayak.com"
+
+
+class SplitTests(unittest.TestCase):
+    t = Table('abc')
+
+    def test_split_at_boundaries(self):
+        queries, recombination = Query.from_(self.t).select(self.t.foo).split(self.t.id, boundaries=[10, 20])
+
+        self.assertEqual(['SELECT "foo" FROM "abc" WHERE "id"<10 OR "id" IS NULL',
+                          'SELECT "foo" FROM "abc" WHERE "id">=10 AND "id"<20',
+                          'SELECT "foo" FROM "abc" WHERE "id">=20'], [str(q) for q in queries])
+        self.assertEqual(OrderedDict([('foo', 'concat')]), recombination)
+
+    def test_split_into_n(self):
+        queries, _ = Query.from_(self.t).select(self.t.foo).split(self.t.id, 4, lower=0, upper=100)
+
+        self.assertEqual(['SELECT "foo" FROM "abc" WHERE "id"<25 OR "id" IS NULL',
+                          'SELECT "foo" FROM "abc" WHERE "id">=25 AND "id"<50',
+                          'SELECT "foo" FROM "abc" WHERE "id">=50 AND "id"<75',
+                          'SELECT "foo" FROM "abc" WHERE "id">=75'], [str(q) for q in queries])
+
+    def test_split_narrow_range(self):
+        queries, _ = Query.from_(self.t).select(self.t.foo).split(self.t.id, 4, lower=0, upper=2)
+
+        self.assertEqual(['SELECT "foo" FROM "abc" WHERE "id"<1 OR "id" IS NULL',
+                          'SELECT "foo" FROM "abc" WHERE "id">=1'], [str(q) for q in queries])
+
+    def test_split_into_one(self):
+        q = Query.from_(self.t).select(self.t.foo)
+        queries, _ = q.split(self.t.id, 1)
+
+        self.assertEqual(['SELECT "foo" FROM "abc"'], [str(q) for q in queries])
+
+    def test_split_range_from_where(self):
+        q = Query.from_(self.t).select(self.t.foo).where(self.t.dt[date(2016, 1, 1):date(2016, 1, 31)])
+        queries, _ = q.split(self.t.dt, 3)
+
+        self.assertEqual([
+            'SELECT "foo" FROM "abc" WHERE "dt" BETWEEN \'2016-01-01\' AND \'2016-01-31\' '
+            'AND ("dt"<\'2016-01-11\' OR "dt" IS NULL)',
+            'SELECT "foo" FROM "abc" WHERE "dt" BETWEEN \'2016-01-01\' AND \'2016-01-31\' '
+            'AND "dt">=\'2016-01-11\' AND "dt"<\'2016-01-21\'',
+            'SELECT "foo" FROM "abc" WHERE "dt" BETWEEN \'2016-01-01\' AND \'2016-01-31\' '
+            'AND "dt">=\'2016-01-21\'',
+        ], [str(q) for q in queries])
+
+    def test_split_range_from_inequalities(self):
+        q = Query.from_(self.t).select(self.t.foo).where((self.t.id >= 0) & (self.t.id < 10))
+        queries, _ = q.split(self.t.id, 2)
+
+        self.assertEqual('SELECT "foo" FROM "abc" WHERE "id">=0 AND "id"<10 AND "id">=5', str(queries[1]))
+
+    def test_split_requires_range(self):
+        with self.assertRaises(QueryException):
+            Query.from_(self.t).select(self.t.foo).split(self.t.id, 2)
+
+    def test_split_requires_increasing_boundaries(self):
+        with self.assertRaises(QueryException):
+            Query.from_(self.t).select(self.t.foo).split(self.t.id, boundaries=[20, 10])
+
+    def test_split_limited_query(self):
+        with self.assertRaises(QueryException):
+            Query.from_(self.t).select(self.t.foo).limit(10).split(self.t.id, boundaries=[10])
+
+    def test_recombination_of_aggregates(self):
+        q = Query.from_(self.t).select(self.t.foo, fn.Count('*'), fn.Sum(self.t.bar, alias='total'),
+                                       fn.Min(self.t.bar), fn.Max(self.t.bar)).groupby(self.t.foo)
+        _, recombination = q.split(self.t.id, boundaries=[10])
+
+        self.assertEqual(OrderedDict([('foo', 'group'), ('COUNT(*)', 'SUM'), ('total', 'SUM'),
+                                      ('MIN("bar")', 'MIN'), ('MAX("bar")', 'MAX')]), recombination)
+
+    def test_recombination_when_split_by_group(self):
+        q = Query.from_(self.t).select(self.t.id, fn.Count('*')).groupby(self.t.id)
+        _, recombination = q.split(self.t.id, boundaries=[10])
+
+        self.assertEqual(OrderedDict([('id', 'concat'), ('COUNT(*)', 'concat')]), recombination)
+
+    def test_recombination_of_distinct_query(self):
+        _, recombination = Query.from_(self.t).select(self.t.foo).distinct().split(self.t.id, boundaries=[10])
+
+        self.assertEqual(OrderedDict([('foo', 'group')]), recombination)
+
+    def test_recombination_with_unselected_group(self):
+        q = Query.from_(self.t).select(fn.Count('*')).groupby(self.t.foo)
+
+        with self.assertRaises(QueryException):
+            q.split(self.t.id, boundaries=[10])
+
+    def test_recombination_of_uncombinable_aggregate(self):
+        for term in [fn.Avg(self.t.bar), fn.Count(self.t.bar).distinct(), fn.Sum(self.t.bar) / 2]:
+            with self.assertRaises(QueryException):
+                Query.from_(self.t).select(term).split(self.t.id, boundaries=[10])
+
+    def test_recombination_with_having(self):
+        q = Query.from_(self.t).select(self.t.foo, fn.Count('*')).groupby(self.t.foo).having(fn.Count('*') > 1)
+
+        with self.assertRaises(QueryException):
+            q.split(self.t.id, boundaries=[10])
+
+    def test_split_results_recombine(self):
+        import sqlite3
+        connection = sqlite3.connect(':memory:')
+        connection.execute('CREATE TABLE "abc" ("id" INTEGER, "foo" TEXT)')
+        connection.executemany('INSERT INTO "abc" VALUES (?, ?)',
+                               [(i, 'ab'[i % 2]) for i in range(100)] + [(None, 'a')])
+
+        q = Query.from_(self.t).select(self.t.foo, fn.Count('*')).groupby(self.t.foo)
+        queries, _ = q.split(self.t.id, 3, lower=0, upper=99)
+
+        totals = {}
+        for query in queries:
+            for foo, count in connection.execute(str(query)):
+                totals[foo] = totals.get(foo, 0) + count
+
+        self.assertEqual(dict(connection.execute(str(q))), totals)
+
+
+class CombineTests(unittest.TestCase):
+    def test_concat(self):
+        recombination = OrderedDict([('foo', 'concat'), ('bar', 'concat')])
+
+        self.assertEqual([(1, 2), (3, 4), (5, 6)], partitions.combine(recombination, [[(1, 2)], [], [(3, 4), (5, 6)]]))
+
+    def test_group(self):
+        recombination = OrderedDict([('foo', 'group'), ('count', 'SUM'), ('min', 'MIN'), ('max', 'MAX')])
+        results = [[('a', 1, 5, 5), ('b', 2, 1, 3)], [('a', 3, 2, 9)], [('b', 1, None, None)]]
+
+        self.assertEqual([('a', 4, 2, 9), ('b', 3, 1, 3)], partitions.combine(recombination, results))
+
+    def test_nulls(self):
+        recombination = OrderedDict([('total', 'SUM')])
+
+        self.assertEqual([(None,)], partitions.combine(recombination, [[(None,)], [(None,)]]))
+        self.assertEqual([(4,)], partitions.combine(recombination, [[(1,)], [(None,)], [(3,)]]))
+
+
+class SplitByPeriodTests(unittest.TestCase):
+    t = Table('abc')
+
+    def test_split_by_day(self):
+        q = Query.from_(self.t).select(fn.Count('*')).where(self.t.dt >= date(2016, 1, 30))
+        buckets, recombination = partitions.split_by_period(q, self.t.dt, DatePart.day, now=date(2016, 2, 1))
+
+        self.assertEqual([(date(2016, 1, 30), date(2016, 1, 31), True),
+                          (date(2016, 1, 31), date(2016, 2, 1), True),
+                          (date(2016, 2, 1), date(2016, 2, 2), False)],
+                         [(bucket.start, bucket.end, bucket.complete) for bucket in buckets])
+        self.assertEqual('SELECT COUNT(*) FROM "abc" WHERE "dt">=\'2016-01-31\' AND "dt"<\'2016-02-01\'',
+                         str(buckets[1].query))
+        self.assertEqual(OrderedDict([('COUNT(*)', 'SUM')]), recombination)
+
+    def test_split_by_week(self):
+        q = Query.from_(self.t).select(self.t.foo).where((self.t.dt >= date(2016, 1, 6)) & (self.t.foo == 1))
+        buckets, _ = partitions.split_by_period(q, self.t.dt, DatePart.week, now=date(2016, 1, 12))
+
+        self.assertEqual([
+            'SELECT "foo" FROM "abc" WHERE "dt">=\'2016-01-06\' AND "foo"=1 '
+            'AND "dt">=\'2016-01-04\' AND "dt"<\'2016-01-11\'',
+            'SELECT "foo" FROM "abc" WHERE "foo"=1 AND "dt">=\'2016-01-11\' AND "dt"<\'2016-01-18\'',
+        ], [str(bucket.query) for bucket in buckets])
+        self.assertEqual([True, False], [bucket.clipped for bucket in buckets])
+        self.assertEqual([True, False], [bucket.complete for bucket in buckets])
+
+    def test_split_by_month_between(self):
+        q = Query.from_(self.t).select(self.t.foo).where(self.t.dt[date(2016, 1, 1):date(2016, 3, 1)])
+        buckets, _ = partitions.split_by_period(q, self.t.dt, DatePart.month, now=date(2016, 6, 1))
+
+        self.assertEqual([date(2016, 1, 1), date(2016, 2, 1), date(2016, 3, 1)], [bucket.start for bucket in buckets])
+        self.assertEqual([False, False, True], [bucket.clipped for bucket in buckets])
+        self.assertTrue(all(bucket.complete for bucket in buckets))
+
+    def test_split_by_month_exclusive_upper(self):
+        q = Query.from_(self.t).select(self.t.foo).where((self.t.dt >= date(2016, 1, 1))
+                                                         & (self.t.dt < date(2016, 3, 1)))
+        buckets, _ = partitions.split_by_period(q, self.t.dt, DatePart.month, now=date(2016, 6, 1))
+
+        self.assertEqual([date(2016, 1, 1), date(2016, 2, 1)], [bucket.start for bucket in buckets])
+
+    def test_split_datetimes_by_quarter(self):
+        q = Query.from_(self.t).select(self.t.foo).where(self.t.ts > datetime(2016, 2, 10, 12))
+        buckets, _ = partitions.split_by_period(q, self.t.ts, DatePart.quarter, now=datetime(2016, 5, 1))
+
+        self.assertEqual([datetime(2016, 1, 1), datetime(2016, 4, 1)], [bucket.start for bucket in buckets])
+        self.assertEqual([True, False], [bucket.complete for bucket in buckets])
+
+    def test_same_query_for_sliding_range(self):
+        def bucket_queries(start):
+            q = Query.from_(self.t).select(self.t.foo).where(self.t.dt >= start)
+            buckets, _ = partitions.split_by_period(q, self.t.dt, DatePart.month, now=date(2016, 6, 1))
+            return [str(bucket.query) for bucket in buckets if not bucket.clipped]
+
+        self.assertEqual(bucket_queries(date(2016, 1, 10))[1:], bucket_queries(date(2016, 2, 10)))
+
+    def test_requires_lower_bound(self):
+        q = Query.from_(self.t).select(self.t.foo).where(self.t.dt < date(2016, 1, 1))
+
+        with self.assertRaises(QueryException):
+            partitions.split_by_period(q, self.t.dt, DatePart.day)
+
+    def test_unselected_group(self):
+        q = Query.from_(self.t).select(fn.Count('*')).where(self.t.dt >= date(2016, 1, 1)).groupby(self.t.foo)
+
+        with self.assertRaises(QueryException):
+            partitions.split_by_period(q, self.t.dt, DatePart.day, now=date(2016, 1, 3))
+
+    def test_unsupported_period(self):
+        q = Query.from_(self.t).select(self.t.foo).where(self.t.dt >= date(2016, 1, 1))
+
+        with self.assertRaises(QueryException):
+            partitions.split_by_period(q, self.t.dt, DatePart.hour)
+
+
+class RouteTests(unittest.TestCase):
+    def setUp(self):
+        self.orders = ShardedTable('orders', 'customer_id', lambda customer_id: customer_id % 3, [0, 1, 2],
+                                   table_format='{name}_{shard}')
+        self.customers = ShardedTable('customers', 'id', lambda customer_id: customer_id % 3, [0, 1, 2])
+
+    def test_route_equality(self):
+        q = Query.from_(self.orders).select(self.orders.id).where(self.orders.customer_id == 4)
+
+        self.assertEqual([(1, 'SELECT "id" FROM "orders_1" WHERE "customer_id"=4')],
+                         [(shard, str(query)) for shard, query in partitions.route(q)])
+
+    def test_route_isin(self):
+        q = Query.from_(self.orders).select(self.orders.id).where(self.orders.customer_id.isin([1, 2, 4, 7])
+                                                                 & (self.orders.total > 10))
+
+        self.assertEqual([(1, 'SELECT "id" FROM "orders_1" WHERE "customer_id" IN (1,4,7) AND "total">10'),
+                          (2, 'SELECT "id" FROM "orders_2" WHERE "customer_id" IN (2) AND "total">10')],
+                         [(shard, str(query)) for shard, query in partitions.route(q)])
+
+    def test_route_equality_and_isin(self):
+        q = Query.from_(self.orders).select(self.orders.id).where(self.orders.customer_id.isin([1, 2])
+                                                                 & (self.orders.customer_id == 2))
+
+        self.assertEqual([2], [shard for shard, _ in partitions.route(q)])
+
+    def test_fan_out(self):
+        for criterion in [self.orders.total > 10, self.orders.customer_id > 10,
+                          self.orders.customer_id.notin([1]), (self.orders.customer_id == 1) | (self.orders.id == 1)]:
+            q = Query.from_(self.orders).select(self.orders.id).where(criterion)
+
+            self.assertEqual(['orders_0', 'orders_1', 'orders_2'],
+                             [query._from.table_name for _, query in partitions.route(q)])
+
+    def test_route_join(self):
+        q = Query.from_(self.orders).join(self.customers).on(
+            self.orders.customer_id == self.customers.id
+        ).select(self.orders.id).where(self.customers.id == 5)
+
+        self.assertEqual([(2, 'SELECT "t0"."id" FROM "orders_2" "t0" JOIN "customers" "t1" '
+                              'ON "t0"."customer_id"="t1"."id" WHERE "t1"."id"=5')],
+                         [(shard, str(query)) for shard, query in partitions.route(q)])
+
+    def test_original_query_unchanged(self):
+        q = Query.from_(self.orders).select(self.orders.id).where(self.orders.customer_id.isin([1, 2]))
+        partitions.route(q)
+
+        self.assertEqual('SELECT "id" FROM "orders" WHERE "customer_id" IN (1,2)', str(q))
+
+    def test_unsharded_query(self):
+        with self.assertRaises(QueryException):
+            partitions.route(Query.from_(Table('abc')).select('foo'))
+
+    def test_sharded_subquery(self):
+        q = Query.from_(self.orders).select(self.orders.id).where(self.orders.customer_id.isin(
+            Query.from_(self.customers).select(self.customers.id)))
+
+        with self.assertRaises(QueryException):
+            partitions.route(q)
+
+
+class DecomposeTests(unittest.TestCase):
+    t = Table('abc')
+
+    def test_decompose_avg(self):
+        q = Query.from_(self.t).select(self.t.foo, fn.Avg(self.t.bar)).groupby(self.t.foo)
+        partial, combiner = partitions.decompose(q)
+
+        self.assertEqual('SELECT "foo",SUM("bar"),COUNT("bar") FROM "abc" GROUP BY "foo"', str(partial))
+        self.assertEqual([('a', 2.5), ('b', 2.0)],
+                         combiner.combine([[('a', 4, 2), ('b', 2, 1)], [('a', 6, 2)]]))
+
+    def test_decompose_count_distinct(self):
+        q = Query.from_(self.t).select(fn.Count(self.t.bar).distinct(), fn.Count('*'))
+        partial, combiner = partitions.decompose(q)
+
+        self.assertEqual('SELECT "bar",COUNT(*) FROM "abc" GROUP BY "bar"', str(partial))
+        self.assertEqual([(3, 10)], combiner.combine([[(1, 2), (2, 1)], [(2, 2), (3, 1), (None, 4)]]))
+
+    def test_decompose_unselected_group(self):
+        q = Query.from_(self.t).select(fn.Count('*')).groupby(self.t.foo)
+        partial, combiner = partitions.decompose(q)
+
+        self.assertEqual('SELECT COUNT(*),"foo" FROM "abc" GROUP BY "foo"', str(partial))
+        self.assertEqual([(3,), (3,)], combiner.combine([[(2, 'a'), (3, 'b')], [(1, 'a')]]))
+
+    def test_decompose_std(self):
+        q = Query.from_(self.t).select(fn.Std(self.t.bar), fn.StdDev(self.t.bar))
+        partial, combiner = partitions.decompose(q)
+
+        self.assertEqual('SELECT COUNT("bar"),SUM("bar"),SUM("bar"*"bar"),COUNT("bar"),SUM("bar"),SUM("bar"*"bar") '
+                         'FROM "abc"', str(partial))
+        # The values 1, 2, 3 and 6 split over two partitions
+        (std, stddev), = combiner.combine([[(2, 3, 5, 2, 3, 5)], [(2, 9, 45, 2, 9, 45)]])
+        self.assertAlmostEqual(1.8708287, std)
+        self.assertAlmostEqual(2.1602469, stddev)
+
+    def test_decompose_combinable(self):
+        q = Query.from_(self.t).select(self.t.foo, fn.Sum(self.t.bar), fn.Max(self.t.bar)).groupby(self.t.foo)
+        partial, combiner = partitions.decompose(q)
+
+        self.assertEqual(str(q), str(partial))
+        self.assertEqual([('a', 3, 7), ('b', None, None)],
+                         combiner.combine([[('a', 1, 7), ('b', None, None)], [('a', 2, 5)]]))
+
+    def test_decompose_without_numpy(self):
+        q = Query.from_(self.t).select(self.t.foo, fn.Sum(self.t.bar), fn.Min(self.t.bar)).groupby(self.t.foo)
+        _, combiner = partitions.decompose(q)
+
+        numpy, partitions.numpy = partitions.numpy, None
+        try:
+            self.assertEqual([('a', 3, 1)], combiner.combine([[('a', 1, 1)], [('a', 2, 2)]]))
+        finally:
+            partitions.numpy = numpy
+
+    def test_decompose_large_integer_sum(self):
+        _, combiner = partitions.decompose(Query.from_(self.t).select(fn.Sum(self.t.bar)))
+
+        self.assertEqual([(2 ** 63,)], combiner.combine([[(2 ** 62,)], [(2 ** 62,)]]))
+
+    def test_decompose_without_rows(self):
+        q = Query.from_(self.t).select(fn.Count(self.t.foo).distinct(), fn.Sum(self.t.bar), fn.Count('*'))
+        _, combiner = partitions.decompose(q)
+
+        self.assertEqual([(0, None, 0)], combiner.combine([[], []]))
+
+    def test_decompose_distinct_rows(self):
+        q = Query.from_(self.t).select(self.t.foo).distinct()
+        _, combiner = partitions.decompose(q)
+
+        self.assertEqual([('a',), ('b',)], combiner.combine([[('a',), ('b',)], [('a',)]]))
+
+    def test_decompose_rows(self):
+        _, combiner = partitions.decompose(Query.from_(self.t).select(self.t.foo))
+
+        self.assertEqual([('a',), ('b',), ('a',)], combiner.combine([[('a',), ('b',)], [('a',)]]))
+
+    def test_original_query_unchanged(self):
+        q = Query.from_(self.t).select(fn.Avg(self.t.bar))
+        partitions.decompose(q)
+
+        self.assertEqual('SELECT AVG("bar") FROM "abc"', str(q))
+
+    def test_ordered_query(self):
+        with self.assertRaises(QueryException):
+            partitions.decompose(Query.from_(self.t).select(fn.Avg(self.t.bar)).orderby(self.t.foo))
+
+    def test_expression_of_aggregates(self):
+        with self.assertRaises(QueryException):
+            partitions.decompose(Query.from_(self.t).select(fn.Sum(self.t.bar) / fn.Count('*')))
+
+    def test_decomposed_results(self):
+        import sqlite3
+        connection = sqlite3.connect(':memory:')
+        connection.execute('CREATE TABLE "abc" ("id" INTEGER, "foo" TEXT, "bar" INTEGER)')
+        connection.executemany('INSERT INTO "abc" VALUES (?, ?, ?)', [(i, 'ab'[i % 2], i % 7) for i in range(100)])
+
+        q = Query.from_(self.t).select(self.t.foo, fn.Avg(self.t.bar), fn.Count(self.t.bar).distinct(),
+                                       fn.Min(self.t.bar)).groupby(self.t.foo)
+        partial, combiner = partitions.decompose(q)
+        queries, _ = partial.split(self.t.id, 3, lower=0, upper=99)
+
+        self.assertEqual(sorted(connection.execute(str(q))),
+                         sorted(combiner.combine(connection.execute(str(query)).fetchall() for query in queries)))
+
+
+class PushDownOrderTests(unittest.TestCase):
+    t = Table('abc')
+
+    def test_push_down_limit(self):
+        q = Query.from_(self.t).select(self.t.foo, self.t.bar).orderby(self.t.bar).limit(10).offset(20)
+        partition_query, _ = partitions.push_down_order(q)
+
+        self.assertEqual('SELECT "foo","bar" FROM "abc" ORDER BY "bar" LIMIT 30', str(partition_query))
+
+    def test_push_down_unselected_order(self):
+        q = Query.from_(self.t).select(self.t.foo).orderby(self.t.bar, order=Order.desc)
+        partition_query, merge = partitions.push_down_order(q)
+
+        self.assertEqual('SELECT "foo","bar" FROM "abc" ORDER BY "bar" DESC', str(partition_query))
+        self.assertEqual([('b',), ('a',), ('c',)], list(merge.merge([[('b', 3), ('c', 1)], [('a', 2)]])))
+
+    def test_push_down_star(self):
+        q = Query.from_(self.t).select('*').orderby(self.t.bar)
+        partition_query, merge = partitions.push_down_order(q)
+
+        self.assertEqual('SELECT *,"bar" FROM "abc" ORDER BY "bar"', str(partition_query))
+        self.assertEqual([(2, 'a'), (1, 'b')], list(merge.merge([[(2, 'a', 1)], [(1, 'b', 2)]])))
+
+    def test_merge_directions(self):
+        q = Query.from_(self.t).select(self.t.foo, self.t.bar).orderby(self.t.foo).orderby(self.t.bar,
+                                                                                          order=Order.desc)
+        _, merge = partitions.push_down_order(q)
+
+        self.assertEqual([(1, 3), (1, 2), (1, 1), (2, 5)],
+                         list(merge.merge([[(1, 3), (1, 1)], [(1, 2), (2, 5)]])))
+
+    def test_merge_offset_and_limit(self):
+        q = Query.from_(self.t).select(self.t.foo).orderby(self.t.foo).limit(2).offset(1)
+        _, merge = partitions.push_down_order(q)
+
+        self.assertEqual([(2,), (3,)], list(merge.merge([[(1,), (3,)], [(2,), (4,)]])))
+
+    def test_merge_nulls(self):
+        q = Query.from_(self.t).select(self.t.foo).orderby(self.t.foo)
+        _, merge = partitions.push_down_order(q)
+        _, merge_last = partitions.push_down_order(q, vendor='postgresql')
+
+        self.assertEqual([(None,), (1,), (2,)], list(merge.merge([[(None,), (2,)], [(1,)]])))
+        self.assertEqual([(1,), (2,), (None,)], list(merge_last.merge([[(2,), (None,)], [(1,)]])))
+
+    def test_merge_stops_reading(self):
+        q = Query.from_(self.t).select(self.t.foo).orderby(self.t.foo).limit(2)
+        _, merge = partitions.push_down_order(q)
+        read = []
+
+        def cursor(values):
+            for value in values:
+                read.append(value)
+                yield (value,)
+
+        self.assertEqual([(1,), (2,)], list(merge.merge([cursor([1, 2, 5, 6]), cursor([3, 4])])))
+        self.assertEqual([1, 3, 2], read)
+
+    def test_aggregating_query(self):
+        with self.assertRaises(QueryException):
+            partitions.push_down_order(Query.from_(self.t).select(fn.Count('*')).orderby(self.t.foo))
+
+    def test_merged_results(self):
+        import sqlite3
+        connection = sqlite3.connect(':memory:')
+        connection.execute('CREATE TABLE "abc" ("id" INTEGER, "foo" INTEGER)')
+        connection.executemany('INSERT INTO "abc" VALUES (?, ?)', [(i, (i * 37) % 101) for i in range(100)])
+
+        q = Query.from_(self.t).select(self.t.id).orderby(self.t.foo, order=Order.desc).limit(10)
+        partition_query, merge = partitions.push_down_order(q)
+        queries = [partition_query.where(criterion)
+                   for criterion in partitions.range_criteria(self.t.id, partitions.split_boundaries(0, 99, 4))]
+
+        self.assertEqual(connection.execute(str(q)).fetchall(),
+                         list(merge.merge([connection.execute(str(query)) for query in queries])))
+
+
+class MergeQueriesTests(unittest.TestCase):
+    t, u = Table('abc'), Table('efg')
+
+    def base(self, t=None, u=None):
+        t, u = t or self.t, u or self.u
+        return Query.from_(t).join(u).on(t.id == u.abc_id).where(t.day >= '2018-01-01').groupby(t.day)
+
+    def test_merge(self):
+        queries = [
+            self.base().select(self.t.day, fn.Sum(self.t.foo).as_('foo')),
+            self.base().select(self.t.day, fn.Sum(self.u.bar)),
+            self.base().select(fn.Sum(self.t.foo).as_('foo')),
+        ]
+
+        merged, splitter = partitions.merge_queries(queries)
+
+        self.assertEqual(['SELECT "t0"."day",SUM("t0"."foo") "foo",SUM("t1"."bar") FROM "abc" "t0" '
+                          'JOIN "efg" "t1" ON "t0"."id"="t1"."abc_id" WHERE "t0"."day">=\'2018-01-01\' '
+                          'GROUP BY "t0"."day"'], [str(query) for query in merged])
+        self.assertEqual([[('2018-01-01', 1)], [('2018-01-01', 2)], [(1,)]],
+                         splitter.split([[('2018-01-01', 1, 2)]]))
+
+    def test_same_names_in_different_tables(self):
+        queries = [self.base().select(fn.Sum(self.t.foo)), self.base().select(fn.Sum(self.u.foo))]
+
+        merged, splitter = partitions.merge_queries(queries)
+
+        self.assertEqual(1, len(merged))
+        self.assertEqual(2, len(merged[0]._selects))
+        self.assertEqual([[(1,)], [(2,)]], splitter.split([iter([(1, 2)])]))
+
+    def test_other_table_objects(self):
+        t, u = Table('abc'), Table('efg')
+        queries = [self.base().select(fn.Sum(self.t.foo)), self.base(t, u).select(fn.Sum(u.bar))]
+
+        merged, _ = partitions.merge_queries(queries)
+
+        self.assertEqual('SELECT SUM("t0"."foo"),SUM("t1"."bar") FROM "abc" "t0" JOIN "efg" "t1" '
+                         'ON "t0"."id"="t1"."abc_id" WHERE "t0"."day">=\'2018-01-01\' GROUP BY "t0"."day"',
+                         str(merged[0]))
+
+    def test_different_queries_not_merged(self):
+        queries = [
+            self.base().select(fn.Sum(self.t.foo)),
+            Query.from_(self.t).select(self.t.foo).where(self.t.foo > 1),
+            self.base().where(self.t.foo > 1).select(fn.Sum(self.t.foo)),
+            self.base().select(fn.Max(self.t.foo)),
+        ]
+
+        merged, splitter = partitions.merge_queries(queries)
+
+        self.assertEqual(3, len(merged))
+        self.assertEqual('SELECT "foo" FROM "abc" WHERE "foo">1', str(merged[1]))
+        self.assertEqual([[(1,)], [(5,)], [(3,)], [(2,)]], splitter.split([[(1, 2)], [(5,)], [(3,)]]))
+
+    def test_aggregate_not_merged_with_rows(self):
+        queries = [Query.from_(self.t).select(self.t.foo), Query.from_(self.t).select(fn.Sum(self.t.bar))]
+
+        merged, splitter = partitions.merge_queries(queries)
+
+        self.assertEqual(['SELECT "foo" FROM "abc"', 'SELECT SUM("bar") FROM "abc"'], [str(query) for query in merged])
+        self.assertEqual([[(1,), (2,)], [(3,)]], splitter.split([[(1,), (2,)], [(3,)]]))
+
+    def test_alias_conflict_not_merged(self):
+        queries = [self.base().select(fn.Sum(self.t.foo).as_('x')), self.base().select(fn.Sum(self.t.bar).as_('x'))]
+
+        merged, _ = partitions.merge_queries(queries)
+
+        self.assertEqual(2, len(merged))
+
+    def test_star_not_merged(self):
+        queries = [Query.from_(self.t).select('*'), Query.from_(self.t).select('*')]
+
+        merged, splitter = partitions.merge_queries(queries)
+
+        self.assertEqual(2, len(merged))
+        self.assertEqual([[(1, 2)], [(3, 4)]], splitter.split([[(1, 2)], [(3, 4)]]))
+
+    def test_distinct_not_merged(self):
+        queries = [Query.from_(self.t).select(self.t.foo).distinct(), Query.from_(self.t).select(self.t.bar).distinct()]
+
+        self.assertEqual(2, len(partitions.merge_queries(queries)[0]))
@@ -0,0 +1,547 @@
+# coding: utf8
+import unittest
+from datetime import date, datetime
+
+from pypika import Query, Table, Tables, DatePart, JoinType, functions as fn, rewrites
+from pypika.enums import SqlTypes
+
+__author__ = "Timothy Heys"
+__email__ = "theys@kayak.com"
+
+
+class SargableDatesTests(unittest.TestCase):
+    t, t2 = Tables('abc', 'efg')
+
+    def test_date_equals(self):
+        q = Query.from_(self.t).select(self.t.foo).where(fn.Date(self.t.ts) == date(2016, 1, 1))
+
+        self.assertEqual('SELECT "foo" FROM "abc" WHERE "ts">=\'2016-01-01\' AND "ts"<\'2016-01-02\'',
+                         str(rewrites.sargable_dates(q)))
+
+    def test_date_equals_str(self):
+        q = Query.from_(self.t).select(self.t.foo).where(fn.Date(self.t.ts) == '2016-02-28')
+
+        self.assertEqual('SELECT "foo" FROM "abc" WHERE "ts">=\'2016-02-28\' AND "ts"<\'2016-02-29\'',
+                         str(rewrites.sargable_dates(q)))
+
+    def test_date_inequalities(self):
+        d = date(2016, 1, 1)
+
+        for criterion, expected in [(fn.Date(self.t.ts) > d, '"ts">=\'2016-01-02\''),
+                                    (fn.Date(self.t.ts) >= d, '"ts">=\'2016-01-01\''),
+                                    (fn.Date(self.t.ts) < d, '"ts"<\'2016-01-01\''),
+                                    (fn.Date(self.t.ts) <= d, '"ts"<\'2016-01-02\''),
+                                    (fn.Date(self.t.ts) != d, '"ts"<\'2016-01-01\' OR "ts">=\'2016-01-02\'')]:
+            q = Query.from_(self.t).select(self.t.foo).where(criterion)
+            self.assertEqual('SELECT "foo" FROM "abc" WHERE ' + expected, str(rewrites.sargable_dates(q)))
+
+    def test_cast_date(self):
+        q = Query.from_(self.t).select(self.t.foo).where(fn.Cast(self.t.ts, SqlTypes.DATE) == date(2016, 1, 1))
+
+        self.assertEqual('SELECT "foo" FROM "abc" WHERE "ts">=\'2016-01-01\' AND "ts"<\'2016-01-02\'',
+                         str(rewrites.sargable_dates(q)))
+
+    def test_cast_other_type_untouched(self):
+        q = Query.from_(self.t).select(self.t.foo).where(fn.Cast(self.t.ts, SqlTypes.SIGNED) == 1)
+
+        self.assertEqual(str(q), str(rewrites.sargable_dates(q)))
+
+    def test_timestamp(self):
+        q = Query.from_(self.t).select(self.t.foo).where(fn.Timestamp(self.t.ts) < datetime(2016, 1, 1, 12))
+
+        self.assertEqual('SELECT "foo" FROM "abc" WHERE "ts"<\'2016-01-01T12:00:00\'',
+                         str(rewrites.sargable_dates(q)))
+
+    def test_extract_year(self):
+        q = Query.from_(self.t).select(self.t.foo).where(fn.Extract(DatePart.year, self.t.ts) == 2016)
+
+        self.assertEqual('SELECT "foo" FROM "abc" WHERE "ts">=\'2016-01-01\' AND "ts"<\'2017-01-01\'',
+                         str(rewrites.sargable_dates(q)))
+
+    def test_extract_year_reversed(self):
+        q = Query.from_(self.t).select(self.t.foo).where(2016 < fn.Extract(DatePart.year, self.t.ts))
+
+        self.assertEqual('SELECT "foo" FROM "abc" WHERE "ts">=\'2017-01-01\'', str(rewrites.sargable_dates(q)))
+
+    def test_extract_year_and_month(self):
+        q = Query.from_(self.t).select(self.t.foo).where(
+            (fn.Extract(DatePart.year, self.t.ts) == 2016)
+            & (self.t.bar == 1)
+            & (fn.Extract(DatePart.month, self.t.ts) == 12)
+        )
+
+        self.assertEqual('SELECT "foo" FROM "abc" WHERE "ts">=\'2016-12-01\' AND "ts"<\'2017-01-01\' AND "bar"=1',
+                         str(rewrites.sargable_dates(q)))
+
+    def test_extract_quarter(self):
+        q = Query.from_(self.t).select(self.t.foo).where(
+            (fn.Extract(DatePart.year, self.t.ts) == 2016) & (fn.Extract(DatePart.quarter, self.t.ts) == 2)
+        )
+
+        self.assertEqual('SELECT "foo" FROM "abc" WHERE "ts">=\'2016-04-01\' AND "ts"<\'2016-07-01\'',
+                         str(rewrites.sargable_dates(q)))
+
+    def test_extract_day_and_hour(self):
+        q = Query.from_(self.t).select(self.t.foo).where(
+            (fn.Extract(DatePart.year, self.t.ts) == 2016)
+            & (fn.Extract(DatePart.month, self.t.ts) == 2)
+            & (fn.Extract(DatePart.day, self.t.ts) == 29)
+            & (fn.Extract(DatePart.hour, self.t.ts) == 23)
+        )
+
+        self.assertEqual('SELECT "foo" FROM "abc" '
+                         'WHERE "ts">=\'2016-02-29T23:00:00\' AND "ts"<\'2016-03-01T00:00:00\'',
+                         str(rewrites.sargable_dates(q)))
+
+    def test_extract_month_without_year_untouched(self):
+        q = Query.from_(self.t).select(self.t.foo).where(fn.Extract(DatePart.month, self.t.ts) == 2)
+
+        self.assertEqual(str(q), str(rewrites.sargable_dates(q)))
+
+    def test_out_of_range_dates_untouched(self):
+        year, month = fn.Extract(DatePart.year, self.t.ts), fn.Extract(DatePart.month, self.t.ts)
+        for criterion in [year > 0, year == 9999, (year == 9999) & (month == 12), (year == 0) & (month == 1),
+                          fn.Date(self.t.ts) == date.max]:
+            q = Query.from_(self.t).select(self.t.foo).where(criterion)
+
+            self.assertEqual(str(q), str(rewrites.sargable_dates(q)))
+
+    def test_rewrite_inside_or(self):
+        q = Query.from_(self.t).select(self.t.foo).where(
+            (fn.Date(self.t.ts) == date(2016, 1, 1)) | (self.t.bar == 1)
+        )
+
+        self.assertEqual('SELECT "foo" FROM "abc" WHERE ("ts">=\'2016-01-01\' AND "ts"<\'2016-01-02\') OR "bar"=1',
+                         str(rewrites.sargable_dates(q)))
+
+    def test_rewrite_subquery(self):
+        subquery = Query.from_(self.t2).select(self.t2.id).where(fn.Date(self.t2.ts) == date(2016, 1, 1))
+        q = Query.from_(subquery).select('*')
+
+        self.assertEqual('SELECT * FROM (SELECT "id" FROM "efg" '
+                         'WHERE "ts">=\'2016-01-01\' AND "ts"<\'2016-01-02\')',
+                         str(rewrites.sargable_dates(q)))
+
+    def test_original_query_unchanged(self):
+        q = Query.from_(self.t).select(self.t.foo).where(fn.Date(self.t.ts) == date(2016, 1, 1))
+        rewrites.sargable_dates(q)
+
+        self.assertEqual('SELECT "foo" FROM "abc" WHERE DATE("ts")=\'2016-01-01\'', str(q))
+
+
+class PruneJoinsTests(unittest.TestCase):
+    facts = Table('facts')
+    dim_a = Table('dim_a', unique_keys=['id'])
+    dim_b = Table('dim_b', unique_keys=[('id', 'version')])
+    other = Table('other')
+
+    def test_unreferenced_unique_join_removed(self):
+        q = Query.from_(self.facts).join(self.dim_a, how=JoinType.left_outer).on(
+            self.facts.a_id == self.dim_a.id
+        ).select(self.facts.foo)
+
+        self.assertEqual('SELECT "foo" FROM "facts"', str(rewrites.prune_joins(q)))
+
+    def test_referenced_join_kept(self):
+        for q in [
+            Query.from_(self.facts).join(self.dim_a, how=JoinType.left_outer).on(self.facts.a_id == self.dim_a.id).select(self.dim_a.name),
+            Query.from_(self.facts).join(self.dim_a, how=JoinType.left_outer).on(self.facts.a_id == self.dim_a.id).select(
+                self.facts.foo).where(self.dim_a.name == 'x'),
+            Query.from_(self.facts).join(self.dim_a, how=JoinType.left_outer).on(self.facts.a_id == self.dim_a.id).select(
+                self.facts.foo).groupby(self.dim_a.name),
+            Query.from_(self.facts).join(self.dim_a, how=JoinType.left_outer).on(self.facts.a_id == self.dim_a.id).select(
+                self.facts.foo).orderby(self.dim_a.name),
+            Query.from_(self.facts).join(self.dim_a, how=JoinType.left_outer).on(self.facts.a_id == self.dim_a.id).select(
+                self.facts.foo).having(fn.Sum(self.dim_a.bar) > 1),
+            Query.from_(self.facts).join(self.dim_a, how=JoinType.left_outer).on(self.facts.a_id == self.dim_a.id).select('*'),
+        ]:
+            self.assertEqual(str(q), str(rewrites.prune_joins(q)))
+
+    def test_referenced_in_window_kept(self):
+        q = Query.from_(self.facts).join(self.dim_a, how=JoinType.left_outer).on(self.facts.a_id == self.dim_a.id).select(
+            fn.RowNumber().over(self.dim_a.name).orderby(self.facts.foo)
+        )
+
+        self.assertEqual(str(q), str(rewrites.prune_joins(q)))
+
+    def test_non_unique_join_kept(self):
+        q = Query.from_(self.facts).join(self.other, how=JoinType.left_outer).on(
+            self.facts.other_id == self.other.id
+        ).select(self.facts.foo)
+
+        self.assertEqual(str(q), str(rewrites.prune_joins(q)))
+
+    def test_partial_unique_key_kept(self):
+        q = Query.from_(self.facts).join(self.dim_b, how=JoinType.left_outer).on(
+            self.facts.b_id == self.dim_b.id
+        ).select(self.facts.foo)
+
+        self.assertEqual(str(q), str(rewrites.prune_joins(q)))
+
+    def test_composite_unique_key_removed(self):
+        q = Query.from_(self.facts).join(self.dim_b, how=JoinType.left_outer).on(
+            (self.facts.b_id == self.dim_b.id) & (self.dim_b.version == 2)
+        ).select(self.facts.foo)
+
+        self.assertEqual('SELECT "foo" FROM "facts"', str(rewrites.prune_joins(q)))
+
+    def test_declared_unique_join_removed(self):
+        q = Query.from_(self.facts).join(self.other, how=JoinType.left_outer, unique=True).on(
+            self.facts.other_id == self.other.id
+        ).select(self.facts.foo)
+
+        self.assertEqual('SELECT "foo" FROM "facts"', str(rewrites.prune_joins(q)))
+
+    def test_default_join_kept(self):
+        # JoinType.left renders a plain JOIN, which drops the rows without a match
+        q = Query.from_(self.facts).join(self.dim_a).on(
+            self.facts.a_id == self.dim_a.id
+        ).select(self.facts.foo)
+
+        self.assertEqual(str(q), str(rewrites.prune_joins(q)))
+
+    def test_inner_join_kept(self):
+        q = Query.from_(self.facts).join(self.dim_a, how=JoinType.inner).on(
+            self.facts.a_id == self.dim_a.id
+        ).select(self.facts.foo)
+
+        self.assertEqual(str(q), str(rewrites.prune_joins(q)))
+
+    def test_chained_joins_removed(self):
+        q = Query.from_(self.facts).join(self.dim_b, how=JoinType.left_outer).on(
+            (self.facts.b_id == self.dim_b.id) & (self.facts.version == self.dim_b.version)
+        ).join(self.dim_a, how=JoinType.left_outer).on(
+            self.dim_b.a_id == self.dim_a.id
+        ).select(self.facts.foo)
+
+        self.assertEqual('SELECT "foo" FROM "facts"', str(rewrites.prune_joins(q)))
+
+    def test_only_unreferenced_join_removed(self):
+        q = Query.from_(self.facts).join(self.dim_a, how=JoinType.left_outer).on(
+            self.facts.a_id == self.dim_a.id
+        ).join(self.other, how=JoinType.left_outer).on(
+            self.facts.other_id == self.other.id
+        ).select(self.facts.foo, self.other.bar)
+
+        self.assertEqual('SELECT "t0"."foo","t1"."bar" FROM "facts" "t0" '
+                         'LEFT OUTER JOIN "other" "t1" ON "t0"."other_id"="t1"."id"', str(rewrites.prune_joins(q)))
+
+    def test_grouped_subquery_removed(self):
+        subquery = Query.from_(self.other).select(self.other.id, fn.Sum(self.other.bar)).groupby(self.other.id)
+        q = Query.from_(self.facts).join(subquery, how=JoinType.left_outer).on(
+            self.facts.other_id == subquery.id
+        ).select(self.facts.foo)
+
+        self.assertEqual('SELECT "foo" FROM "facts"', str(rewrites.prune_joins(q)))
+
+
+class PropagatePredicatesTests(unittest.TestCase):
+    a, b, c = Tables('a', 'b', 'c')
+
+    def test_equality_propagated(self):
+        q = Query.from_(self.a).join(self.b, how=JoinType.inner).on(
+            self.a.id == self.b.a_id
+        ).select(self.b.foo).where(self.a.id == 5)
+
+        self.assertEqual('SELECT "t1"."foo" FROM "a" "t0" INNER JOIN "b" "t1" ON "t0"."id"="t1"."a_id" '
+                         'WHERE "t0"."id"=5 AND "t1"."a_id"=5', str(rewrites.propagate_predicates(q)))
+
+    def test_isin_propagated(self):
+        q = Query.from_(self.a).join(self.b, how=JoinType.inner).on(
+            self.a.id == self.b.a_id
+        ).select(self.b.foo).where(self.b.a_id.isin([1, 2]))
+
+        self.assertEqual('SELECT "t1"."foo" FROM "a" "t0" INNER JOIN "b" "t1" ON "t0"."id"="t1"."a_id" '
+                         'WHERE "t1"."a_id" IN (1,2) AND "t0"."id" IN (1,2)', str(rewrites.propagate_predicates(q)))
+
+    def test_range_propagated(self):
+        q = Query.from_(self.a).join(self.b, how=JoinType.inner).on(
+            self.a.id == self.b.a_id
+        ).select(self.b.foo).where((self.a.id > 5) & self.a.id[1:10])
+
+        self.assertEqual('SELECT "t1"."foo" FROM "a" "t0" INNER JOIN "b" "t1" ON "t0"."id"="t1"."a_id" '
+                         'WHERE "t0"."id">5 AND "t0"."id" BETWEEN 1 AND 10 '
+                         'AND "t1"."a_id">5 AND "t1"."a_id" BETWEEN 1 AND 10', str(rewrites.propagate_predicates(q)))
+
+    def test_transitive_through_two_joins(self):
+        q = Query.from_(self.a).join(self.b, how=JoinType.inner).on(
+            self.a.id == self.b.a_id
+        ).join(self.c, how=JoinType.inner).on(
+            self.b.a_id == self.c.a_id
+        ).select(self.c.foo).where(5 == self.a.id)
+
+        self.assertEqual('SELECT "t2"."foo" FROM "a" "t0" INNER JOIN "b" "t1" ON "t0"."id"="t1"."a_id" '
+                         'INNER JOIN "c" "t2" ON "t1"."a_id"="t2"."a_id" '
+                         'WHERE "t0"."id"=5 AND "t1"."a_id"=5 AND "t2"."a_id"=5', str(rewrites.propagate_predicates(q)))
+
+    def test_left_join_predicate_added_to_join_criterion(self):
+        q = Query.from_(self.a).join(self.b).on(
+            self.a.id == self.b.a_id
+        ).select(self.b.foo).where(self.a.id == 5)
+
+        self.assertEqual('SELECT "t1"."foo" FROM "a" "t0" JOIN "b" "t1" ON "t0"."id"="t1"."a_id" AND "t1"."a_id"=5 '
+                         'WHERE "t0"."id"=5', str(rewrites.propagate_predicates(q)))
+
+    def test_outer_join_equality_on_other_tables_not_used(self):
+        q = Query.from_(self.a).join(self.b, how=JoinType.inner).on(
+            self.a.id == self.b.a_id
+        ).join(self.c, how=JoinType.left_outer).on(
+            (self.c.id == self.b.c_id) & (self.a.x == self.b.y)
+        ).select(self.a.id, self.b.a_id, self.c.id).where(self.a.x == 5)
+
+        rewritten = rewrites.propagate_predicates(q)
+        self.assertEqual('SELECT "t0"."id","t1"."a_id","t2"."id" FROM "a" "t0" INNER JOIN "b" "t1" '
+                         'ON "t0"."id"="t1"."a_id" LEFT OUTER JOIN "c" "t2" ON "t2"."id"="t1"."c_id" '
+                         'AND "t0"."x"="t1"."y" WHERE "t0"."x"=5', str(rewritten))
+
+        import sqlite3
+        connection = sqlite3.connect(':memory:')
+        connection.execute('CREATE TABLE "a" ("id" INTEGER, "x" INTEGER)')
+        connection.execute('CREATE TABLE "b" ("a_id" INTEGER, "c_id" INTEGER, "y" INTEGER)')
+        connection.execute('CREATE TABLE "c" ("id" INTEGER)')
+        connection.execute('INSERT INTO "a" VALUES (1, 5)')
+        connection.execute('INSERT INTO "b" VALUES (1, 1, 6)')
+        connection.execute('INSERT INTO "c" VALUES (1)')
+
+        self.assertEqual([(1, 1, None)], connection.execute(str(rewritten)).fetchall())
+
+    def test_outer_join_not_used(self):
+        q = Query.from_(self.a).join(self.b, how=JoinType.outer).on(
+            self.a.id == self.b.a_id
+        ).select(self.b.foo).where(self.a.id == 5)
+
+        self.assertEqual(str(q), str(rewrites.propagate_predicates(q)))
+
+    def test_existing_predicate_not_duplicated(self):
+        q = Query.from_(self.a).join(self.b, how=JoinType.inner).on(
+            self.a.id == self.b.a_id
+        ).select(self.b.foo).where((self.a.id == 5) & (self.b.a_id == 5))
+
+        self.assertEqual(str(q), str(rewrites.propagate_predicates(q)))
+
+    def test_same_column_name_on_other_table_not_confused(self):
+        q = Query.from_(self.a).join(self.b, how=JoinType.inner).on(
+            self.a.id == self.b.a_id
+        ).select(self.b.foo).where((self.a.id == 5) & (self.b.id == 5))
+
+        self.assertEqual('SELECT "t1"."foo" FROM "a" "t0" INNER JOIN "b" "t1" ON "t0"."id"="t1"."a_id" '
+                         'WHERE "t0"."id"=5 AND "t1"."id"=5 AND "t1"."a_id"=5', str(rewrites.propagate_predicates(q)))
+
+
+class FlattenSubqueriesTests(unittest.TestCase):
+    t, u = Tables('abc', 'efg')
+
+    def test_from_subquery_flattened(self):
+        subquery = Query.from_(self.t).select(self.t.foo, self.t.bar).where(self.t.bar > 1)
+        q = Query.from_(subquery).select(subquery.foo).where(subquery.foo == 2)
+
+        self.assertEqual('SELECT "foo" FROM "abc" WHERE "bar">1 AND "foo"=2', str(rewrites.flatten_subqueries(q)))
+
+    def test_aliases_remapped(self):
+        subquery = Query.from_(self.t).select(self.t.foo.as_('x'), self.t.bar)
+        q = Query.from_(subquery).select(subquery.x, subquery.bar.as_('y')).where(subquery.x == 2)
+
+        self.assertEqual('SELECT "foo" "x","bar" "y" FROM "abc" WHERE "foo"=2', str(rewrites.flatten_subqueries(q)))
+
+    def test_star_expanded(self):
+        subquery = Query.from_(self.t).select(self.t.foo, self.t.bar)
+        q = Query.from_(subquery).select('*')
+
+        self.assertEqual('SELECT "foo","bar" FROM "abc"', str(rewrites.flatten_subqueries(q)))
+
+    def test_star_subquery(self):
+        subquery = Query.from_(self.t).select('*').where(self.t.bar == 1)
+        q = Query.from_(subquery).select(subquery.foo)
+
+        self.assertEqual('SELECT "foo" FROM "abc" WHERE "bar"=1', str(rewrites.flatten_subqueries(q)))
+
+    def test_joined_subquery_flattened(self):
+        subquery = Query.from_(self.u).select(self.u.id, self.u.name).where(self.u.active == 1)
+        q = Query.from_(self.t).join(subquery).on(
+            self.t.u_id == subquery.id
+        ).select(self.t.foo, subquery.name)
+
+        self.assertEqual('SELECT "t0"."foo","t1"."name" FROM "abc" "t0" '
+                         'JOIN "efg" "t1" ON "t0"."u_id"="t1"."id" AND "t1"."active"=1',
+                         str(rewrites.flatten_subqueries(q)))
+
+    def test_nested_subqueries_flattened(self):
+        inner = Query.from_(self.t).select(self.t.foo, self.t.bar).where(self.t.bar > 1)
+        middle = Query.from_(inner).select(inner.foo).where(inner.foo < 5)
+        q = Query.from_(middle).select(middle.foo)
+
+        self.assertEqual('SELECT "foo" FROM "abc" WHERE "bar">1 AND "foo"<5', str(rewrites.flatten_subqueries(q)))
+
+    def test_from_subquery_with_join_flattened(self):
+        subquery = Query.from_(self.t).join(self.u).on(self.t.u_id == self.u.id).select(self.t.foo, self.u.name)
+        q = Query.from_(subquery).select(subquery.name)
+
+        self.assertEqual('SELECT "t1"."name" FROM "abc" "t0" JOIN "efg" "t1" ON "t0"."u_id"="t1"."id"',
+                         str(rewrites.flatten_subqueries(q)))
+
+    def test_unsafe_subqueries_kept(self):
+        for subquery in [
+            Query.from_(self.t).select(self.t.foo, fn.Sum(self.t.bar)).groupby(self.t.foo),
+            Query.from_(self.t).select(self.t.foo).distinct(),
+            Query.from_(self.t).select(self.t.foo).orderby(self.t.foo),
+            Query.from_(self.t).select(self.t.foo) + Query.from_(self.u).select(self.u.foo),
+            Query.from_(self.t).select(self.t.foo, self.t.bar + 1),
+        ]:
+            q = Query.from_(subquery).select(subquery.foo)
+            self.assertEqual(str(q), str(rewrites.flatten_subqueries(q)))
+
+    def test_outer_joined_subquery_kept(self):
+        subquery = Query.from_(self.u).select(self.u.id).where(self.u.active == 1)
+        q = Query.from_(self.t).join(subquery, how=JoinType.outer).on(
+            self.t.u_id == subquery.id
+        ).select(self.t.foo)
+
+        self.assertEqual(str(q), str(rewrites.flatten_subqueries(q)))
+
+
+class RewriteSemijoinsTests(unittest.TestCase):
+    t, u, v = Tables('abc', 'efg', 'hij')
+
+    def test_isin_to_exists(self):
+        subquery = Query.from_(self.u).select(self.u.abc_id).where(self.u.active == 1)
+        q = Query.from_(self.t).select(self.t.foo).where(self.t.id.isin(subquery))
+
+        self.assertEqual('SELECT "t0"."foo" FROM "abc" "t0" '
+                         'WHERE EXISTS (SELECT 1 FROM "efg" WHERE "active"=1 AND "abc_id"="t0"."id")',
+                         str(rewrites.rewrite_semijoins(q)))
+
+    def test_notin_to_not_exists(self):
+        subquery = Query.from_(self.u).select(self.u.abc_id)
+        q = Query.from_(self.t).select(self.t.foo).where(self.t.id.notin(subquery))
+
+        self.assertEqual('SELECT "t0"."foo" FROM "abc" "t0" '
+                         'WHERE "t0"."id" IS NOT NULL AND NOT EXISTS (SELECT 1 FROM "efg" WHERE "abc_id"="t0"."id") '
+                         'AND NOT EXISTS (SELECT 1 FROM "efg" WHERE "abc_id" IS NULL)',
+                         str(rewrites.rewrite_semijoins(q)))
+
+    def test_notin_with_non_null_subquery_column(self):
+        for criterion in [self.u.abc_id.notnull(), self.u.abc_id > 0]:
+            subquery = Query.from_(self.u).select(self.u.abc_id).where(criterion)
+            q = Query.from_(self.t).select(self.t.foo).where(self.t.id.notin(subquery))
+
+            self.assertNotIn('IS NULL', str(rewrites.rewrite_semijoins(q)))
+
+    def test_notin_with_null_in_subquery(self):
+        import sqlite3
+        connection = sqlite3.connect(':memory:')
+        connection.execute('CREATE TABLE "abc" ("id" INTEGER, "foo" INTEGER)')
+        connection.execute('CREATE TABLE "efg" ("abc_id" INTEGER)')
+        connection.executemany('INSERT INTO "abc" VALUES (?, ?)', [(1, 1), (4, 4), (None, 5)])
+        connection.executemany('INSERT INTO "efg" VALUES (?)', [(1,), (None,)])
+
+        q = Query.from_(self.t).select(self.t.foo).where(self.t.id.notin(Query.from_(self.u).select(self.u.abc_id)))
+
+        for expected in ([], [(4,)]):
+            self.assertEqual(expected, connection.execute(str(q)).fetchall())
+            for vendor in (None, 'mysql'):
+                rewritten = rewrites.rewrite_semijoins(q, vendor=vendor)
+                self.assertEqual(expected, connection.execute(str(rewritten)).fetchall())
+            connection.execute('DELETE FROM "efg" WHERE "abc_id" IS NULL')
+
+    def test_isin_inside_or(self):
+        subquery = Query.from_(self.u).select(self.u.abc_id)
+        q = Query.from_(self.t).select(self.t.foo).where(self.t.id.isin(subquery) | (self.t.foo == 1))
+
+        self.assertEqual('SELECT "t0"."foo" FROM "abc" "t0" '
+                         'WHERE EXISTS (SELECT 1 FROM "efg" WHERE "abc_id"="t0"."id") OR "t0"."foo"=1',
+                         str(rewrites.rewrite_semijoins(q)))
+
+    def test_subquery_with_joins_aliased(self):
+        subquery = Query.from_(self.u).join(self.v).on(self.u.id == self.v.efg_id).select(self.u.abc_id)
+        q = Query.from_(self.t).select(self.t.foo).where(self.t.id.isin(subquery))
+
+        self.assertEqual('SELECT "t0"."foo" FROM "abc" "t0" '
+                         'WHERE EXISTS (SELECT 1 FROM "efg" "s0" JOIN "hij" "s1" ON "s0"."id"="s1"."efg_id" '
+                         'WHERE "s0"."abc_id"="t0"."id")',
+                         str(rewrites.rewrite_semijoins(q)))
+
+    def test_notin_to_anti_join_for_mysql(self):
+        subquery = Query.from_(self.u).select(self.u.abc_id).where(self.u.active == 1)
+        q = Query.from_(self.t).select(self.t.foo).where(self.t.id.notin(subquery))
+
+        self.assertEqual('SELECT "t0"."foo" FROM "abc" "t0" '
+                         'LEFT OUTER JOIN "efg" "t1" ON "t1"."abc_id"="t0"."id" AND "t1"."active"=1 '
+                         'WHERE "t0"."id" IS NOT NULL AND "t1"."abc_id" IS NULL '
+                         'AND NOT EXISTS (SELECT 1 FROM "efg" WHERE "active"=1 AND "abc_id" IS NULL)',
+                         str(rewrites.rewrite_semijoins(q, vendor='mysql')))
+
+    def test_notin_to_anti_join_on_derived_table_for_mysql(self):
+        subquery = Query.from_(self.u).select(self.u.abc_id).distinct()
+        q = Query.from_(self.t).select(self.t.foo).where(self.t.id.notin(subquery))
+
+        self.assertEqual('SELECT "t0"."foo" FROM "abc" "t0" '
+                         'LEFT OUTER JOIN (SELECT distinct "abc_id" FROM "efg") "t1" ON "t1"."abc_id"="t0"."id" '
+                         'WHERE "t0"."id" IS NOT NULL AND "t1"."abc_id" IS NULL '
+                         'AND NOT EXISTS (SELECT 1 FROM "efg" WHERE "abc_id" IS NULL)',
+                         str(rewrites.rewrite_semijoins(q, vendor='mysql')))
+
+    def test_isin_list_untouched(self):
+        q = Query.from_(self.t).select(self.t.foo).where(self.t.id.isin([1, 2]))
+
+        self.assertEqual(str(q), str(rewrites.rewrite_semijoins(q)))
+
+    def test_aggregated_subquery_untouched(self):
+        subquery = Query.from_(self.u).select(self.u.abc_id).groupby(self.u.abc_id).having(fn.Count('*') > 1)
+        q = Query.from_(self.t).select(self.t.foo).where(self.t.id.isin(subquery))
+
+        self.assertEqual(str(q), str(rewrites.rewrite_semijoins(q)))
+
+    def test_same_table_untouched(self):
+        subquery = Query.from_(self.t).select(self.t.parent_id)
+        q = Query.from_(self.t).select(self.t.foo).where(self.t.id.isin(subquery))
+
+        self.assertEqual(str(q), str(rewrites.rewrite_semijoins(q)))
+
+
+class HoistCtesTests(unittest.TestCase):
+    t, u = Tables('abc', 'efg')
+
+    def subquery(self):
+        return Query.from_(self.u).select(self.u.abc_id).groupby(self.u.abc_id).having(fn.Sum(self.u.total) > 10)
+
+    def test_repeated_subquery_hoisted(self):
+        subquery = self.subquery()
+        q = Query.from_(self.t).join(subquery).on(
+            self.t.id == subquery.abc_id
+        ).select(self.t.foo).where(self.t.parent_id.isin(subquery))
+
+        self.assertEqual('WITH "cte0" AS (SELECT "abc_id" FROM "efg" GROUP BY "abc_id" HAVING SUM("total")>10) '
+                         'SELECT "t0"."foo" FROM "abc" "t0" JOIN "cte0" "t1" ON "t0"."id"="t1"."abc_id" '
+                         'WHERE "t0"."parent_id" IN (SELECT * FROM "cte0")', str(rewrites.hoist_ctes(q)))
+
+    def test_structurally_identical_subqueries_hoisted(self):
+        q = Query.from_(self.t).select(self.t.foo).where(
+            self.t.id.isin(self.subquery()) | self.t.parent_id.isin(self.subquery())
+        )
+
+        self.assertEqual('WITH "cte0" AS (SELECT "abc_id" FROM "efg" GROUP BY "abc_id" HAVING SUM("total")>10) '
+                         'SELECT "foo" FROM "abc" WHERE "id" IN (SELECT * FROM "cte0") '
+                         'OR "parent_id" IN (SELECT * FROM "cte0")', str(rewrites.hoist_ctes(q)))
+
+    def test_existing_cte_names_avoided(self):
+        q = Query.with_(Query.from_(self.u).select('foo'), 'cte0').from_(self.t).select(self.t.foo).where(
+            self.t.id.isin(self.subquery()) & self.t.parent_id.isin(self.subquery())
+        )
+
+        self.assertEqual('WITH "cte1" AS (SELECT "abc_id" FROM "efg" GROUP BY "abc_id" HAVING SUM("total")>10),'
+                         '"cte0" AS (SELECT "foo" FROM "efg") '
+                         'SELECT "foo" FROM "abc" WHERE "id" IN (SELECT * FROM "cte1") '
+                         'AND "parent_id" IN (SELECT * FROM "cte1")', str(rewrites.hoist_ctes(q)))
+
+    def test_single_subquery_untouched(self):
+        q = Query.from_(self.t).select(self.t.foo).where(self.t.id.isin(self.subquery()))
+
+        self.assertEqual(str(q), str(rewrites.hoist_ctes(q)))
+
+    def test_correlated_subquery_untouched(self):
+        q = rewrites.rewrite_semijoins(Query.from_(self.t).select(self.t.foo).where(
+            self.t.id.isin(Query.from_(self.u).select(self.u.abc_id))
+            | self.t.id.isin(Query.from_(self.u).select(self.u.abc_id))
+        ))
+
+        self.assertEqual(str(q), str(rewrites.hoist_ctes(q)))
@@ -1,7 +1,9 @@
 # coding: utf8
 import unittest
 
-from pypika import Query, Table, Tables, Field as F, Case, functions as fn, Order, JoinType
+from pypika import (Query, Table, Tables, Field as F, Case, functions as fn, Order, JoinType, AliasedQuery, RecursiveCTE,
+                    DatePart, Exists)
+from pypika.utils import JoinException, QueryException
 
 __author__ = "Timothy Heys"
 __email__ = "theys@kayak.com"
@@ -449,3 +451,327 @@ class SubqueryTests(unittest.TestCase):
                          '"foo" "foo_two","bar" '
                          'FROM "efg"'
                          ') "t1" ON "t0"."foo"="t1"."foo_two"', str(query))
+
+
+class WithTests(unittest.TestCase):
+    table_abc, table_efg = Tables('abc', 'efg')
+
+    def test_with(self):
+        sub_query = Query.from_(self.table_efg).select('fizz')
+        test_query = Query.with_(sub_query, 'an_alias').from_(AliasedQuery('an_alias')).select('*')
+
+        self.assertEqual('WITH "an_alias" AS (SELECT "fizz" FROM "efg") SELECT * FROM "an_alias"', str(test_query))
+
+    def test_with_on_query_builder(self):
+        sub_query = Query.from_(self.table_efg).select(self.table_efg.fizz)
+        an_alias = AliasedQuery('an_alias')
+        test_query = Query.from_(an_alias).with_(sub_query, 'an_alias').select(an_alias.fizz)
+
+        self.assertEqual('WITH "an_alias" AS (SELECT "fizz" FROM "efg") SELECT "fizz" FROM "an_alias"', str(test_query))
+
+    def test_join_with(self):
+        sub_query = Query.from_(self.table_efg).select(self.table_efg.fizz, self.table_efg.buzz)
+        an_alias = AliasedQuery('an_alias')
+        test_query = Query.with_(sub_query, 'an_alias').from_(self.table_abc).join(an_alias).on(
+            an_alias.fizz == self.table_abc.buzz
+        ).select(self.table_abc.star, an_alias.buzz)
+
+        self.assertEqual('WITH "an_alias" AS (SELECT "fizz","buzz" FROM "efg") '
+                         'SELECT "t0".*,"t1"."buzz" FROM "abc" "t0" JOIN "an_alias" "t1" ON "t1"."fizz"="t0"."buzz"',
+                         str(test_query))
+
+    def test_multiple_with(self):
+        test_query = Query.with_(
+            Query.from_(self.table_abc).select('foo'), 'a1'
+        ).with_(
+            Query.from_(self.table_efg).select('bar'), 'a2'
+        ).from_(AliasedQuery('a1')).select('*')
+
+        self.assertEqual('WITH "a1" AS (SELECT "foo" FROM "abc"),"a2" AS (SELECT "bar" FROM "efg") '
+                         'SELECT * FROM "a1"', str(test_query))
+
+
+class RecursiveCTETests(unittest.TestCase):
+    categories = Table('categories')
+
+    def anchor(self):
+        return Query.from_(self.categories).select(self.categories.id, self.categories.parent_id).where(
+            self.categories.id == 1
+        )
+
+    def recursive(self, tree):
+        return Query.from_(self.categories).join(tree).on(
+            self.categories.parent_id == tree.id
+        ).select(self.categories.id, self.categories.parent_id)
+
+    def test_recursive_cte(self):
+        tree = RecursiveCTE('tree', self.anchor())
+        tree = tree.recursive(self.recursive(tree))
+        q = Query.with_(tree).from_(tree).select('*')
+
+        self.assertEqual('WITH RECURSIVE "tree" AS ('
+                         'SELECT "id","parent_id" FROM "categories" WHERE "id"=1 '
+                         'UNION ALL '
+                         'SELECT "t0"."id","t0"."parent_id" FROM "categories" "t0" '
+                         'JOIN "tree" "t1" ON "t0"."parent_id"="t1"."id") '
+                         'SELECT * FROM "tree"', str(q))
+
+    def test_recursive_cte_with_depth_limit(self):
+        tree = RecursiveCTE('tree', self.anchor(), depth='depth', max_depth=5)
+        tree = tree.recursive(self.recursive(tree))
+        q = Query.with_(tree).from_(tree).select(tree.id, tree.depth)
+
+        self.assertEqual('WITH RECURSIVE "tree"("id","parent_id","depth") AS ('
+                         'SELECT "id","parent_id",0 FROM "categories" WHERE "id"=1 '
+                         'UNION ALL '
+                         'SELECT "t0"."id","t0"."parent_id","t1"."depth"+1 FROM "categories" "t0" '
+                         'JOIN "tree" "t1" ON "t0"."parent_id"="t1"."id" WHERE "t1"."depth"<5) '
+                         'SELECT "id","depth" FROM "tree"', str(q))
+
+    def test_recursive_cte_with_columns(self):
+        tree = RecursiveCTE('tree', self.anchor(), columns=['node', 'parent'])
+        tree = tree.recursive(self.recursive(tree))
+        q = Query.with_(tree).from_(tree).select(tree.node)
+
+        self.assertEqual('WITH RECURSIVE "tree"("node","parent") AS ('
+                         'SELECT "id","parent_id" FROM "categories" WHERE "id"=1 '
+                         'UNION ALL '
+                         'SELECT "t0"."id","t0"."parent_id" FROM "categories" "t0" '
+                         'JOIN "tree" "t1" ON "t0"."parent_id"="t1"."id") '
+                         'SELECT "node" FROM "tree"', str(q))
+
+    def test_recursive_member_must_join_cte(self):
+        tree = RecursiveCTE('tree', self.anchor())
+
+        with self.assertRaises(JoinException):
+            tree.recursive(Query.from_(self.categories).select(self.categories.id, self.categories.parent_id))
+
+    def test_recursive_member_required(self):
+        with self.assertRaises(QueryException):
+            Query.with_(RecursiveCTE('tree', self.anchor()))
+
+    def test_max_depth_requires_depth(self):
+        with self.assertRaises(QueryException):
+            RecursiveCTE('tree', self.anchor(), max_depth=5)
+
+
+class LimitTests(unittest.TestCase):
+    table_abc = Table('abc')
+
+    def test_limit(self):
+        q = Query.from_(self.table_abc).select('foo').limit(10)
+
+        self.assertEqual('SELECT "foo" FROM "abc" LIMIT 10', str(q))
+
+    def test_limit_offset(self):
+        q = Query.from_(self.table_abc).select('foo').orderby('foo').limit(10).offset(20)
+
+        self.assertEqual('SELECT "foo" FROM "abc" ORDER BY "foo" LIMIT 10 OFFSET 20', str(q))
+
+    def test_offset_without_limit(self):
+        q = Query.from_(self.table_abc).select('foo').offset(20)
+
+        self.assertEqual('SELECT "foo" FROM "abc" OFFSET 20', str(q))
+
+    def test_offset_without_limit_mysql(self):
+        q = Query.from_(self.table_abc).select('foo').offset(20, vendor='mysql')
+
+        self.assertEqual('SELECT "foo" FROM "abc" LIMIT 18446744073709551615 OFFSET 20', str(q))
+
+    def test_offset_without_limit_sqlite(self):
+        q = Query.from_(self.table_abc).select('foo').offset(20, vendor='sqlite')
+
+        self.assertEqual('SELECT "foo" FROM "abc" LIMIT -1 OFFSET 20', str(q))
+
+    def test_limit_offset_fetch_next(self):
+        for vendor in ['mssql', 'oracle']:
+            q = Query.from_(self.table_abc).select('foo').orderby('foo').limit(10, vendor=vendor).offset(20)
+
+            self.assertEqual('SELECT "foo" FROM "abc" ORDER BY "foo" OFFSET 20 ROWS FETCH NEXT 10 ROWS ONLY', str(q))
+
+    def test_top(self):
+        q = Query.from_(self.table_abc).select('foo').top(10)
+
+        self.assertEqual('SELECT TOP 10 "foo" FROM "abc"', str(q))
+
+    def test_limit_in_subquery(self):
+        subquery = Query.from_(self.table_abc).select('foo').orderby('foo').limit(10)
+        q = Query.from_(subquery).select('*')
+
+        self.assertEqual('SELECT * FROM (SELECT "foo" FROM "abc" ORDER BY "foo" LIMIT 10)', str(q))
+
+
+class KeysetPaginationTests(unittest.TestCase):
+    table_abc = Table('abc')
+
+    def query(self):
+        return Query.from_(self.table_abc).select(self.table_abc.id, self.table_abc.foo)
+
+    def test_first_page(self):
+        pages = self.query().iter_pages([self.table_abc.id], 100)
+
+        self.assertEqual('SELECT "id","foo" FROM "abc" ORDER BY "id" ASC LIMIT 100', str(next(pages)))
+
+    def test_next_page_single_key(self):
+        pages = self.query().where(self.table_abc.foo == 1).iter_pages([self.table_abc.id], 100)
+        next(pages)
+
+        self.assertEqual('SELECT "id","foo" FROM "abc" WHERE "foo"=1 AND "id">42 ORDER BY "id" ASC LIMIT 100',
+                         str(pages.send([42])))
+
+    def test_next_page_row_values(self):
+        pages = self.query().iter_pages([self.table_abc.day, self.table_abc.id], 100)
+        next(pages)
+
+        self.assertEqual('SELECT "id","foo" FROM "abc" WHERE ("day","id")>(\'2016-01-01\',42) '
+                         'ORDER BY "day" ASC,"id" ASC LIMIT 100', str(pages.send(['2016-01-01', 42])))
+
+    def test_next_page_descending(self):
+        pages = self.query().iter_pages([self.table_abc.day, self.table_abc.id], 100, order=Order.desc)
+        next(pages)
+
+        self.assertEqual('SELECT "id","foo" FROM "abc" WHERE ("day","id")<(\'2016-01-01\',42) '
+                         'ORDER BY "day" DESC,"id" DESC LIMIT 100', str(pages.send(['2016-01-01', 42])))
+
+    def test_next_page_expanded_row_values(self):
+        pages = self.query().iter_pages([self.table_abc.a, self.table_abc.b, self.table_abc.c], 100, vendor='mssql')
+        next(pages)
+
+        self.assertEqual('SELECT "id","foo" FROM "abc" WHERE "a">1 OR ("a"=1 AND "b">2) '
+                         'OR ("a"=1 AND "b"=2 AND "c">3) '
+                         'ORDER BY "a" ASC,"b" ASC,"c" ASC OFFSET 0 ROWS FETCH NEXT 100 ROWS ONLY',
+                         str(pages.send([1, 2, 3])))
+
+    def test_stops_when_none_sent(self):
+        pages = self.query().iter_pages([self.table_abc.id], 100)
+        next(pages)
+
+        with self.assertRaises(StopIteration):
+            pages.send(None)
+
+    def test_ordered_query_not_paginated(self):
+        with self.assertRaises(QueryException):
+            next(self.query().orderby(self.table_abc.foo).iter_pages([self.table_abc.id], 100))
+
+    def test_pages_sqlite(self):
+        import sqlite3
+        connection = sqlite3.connect(':memory:')
+        connection.execute('CREATE TABLE abc (id, day, foo)')
+        connection.executemany('INSERT INTO abc VALUES (?,?,?)', [(i, i % 3, i) for i in range(10)])
+
+        pages, rows = self.query().iter_pages([self.table_abc.day, self.table_abc.id], 4, vendor='sqlite'), []
+        page = next(pages)
+        while True:
+            page_rows = connection.execute(str(page)).fetchall()
+            rows += page_rows
+            if len(page_rows) < 4:
+                break
+            page = pages.send([page_rows[-1][0] % 3, page_rows[-1][0]])
+
+        self.assertEqual(sorted(range(10), key=lambda i: (i % 3, i)), [row[0] for row in rows])
+
+
+class ParameterizedTests(unittest.TestCase):
+    t = Table('abc')
+
+    def test_qmark(self):
+        q = Query.from_(self.t).select(self.t.foo).where((self.t.foo == 1) & self.t.bar.isin(['a', 'b']))
+
+        self.assertEqual(('SELECT "foo" FROM "abc" WHERE "foo"=? AND "bar" IN (?,?)', [1, 'a', 'b']),
+                         q.get_parameterized_sql())
+
+    def test_paramstyles(self):
+        q = Query.from_(self.t).select(self.t.foo).where((self.t.foo > 1) & self.t.bar.like('a%'))
+
+        self.assertEqual(('SELECT "foo" FROM "abc" WHERE "foo">%s AND "bar" LIKE %s', [1, 'a%']),
+                         q.get_parameterized_sql('format'))
+        self.assertEqual(('SELECT "foo" FROM "abc" WHERE "foo">:1 AND "bar" LIKE :2', [1, 'a%']),
+                         q.get_parameterized_sql('numeric'))
+        self.assertEqual(('SELECT "foo" FROM "abc" WHERE "foo">:p0 AND "bar" LIKE :p1', {'p0': 1, 'p1': 'a%'}),
+                         q.get_parameterized_sql('named'))
+        self.assertEqual(('SELECT "foo" FROM "abc" WHERE "foo">%(p0)s AND "bar" LIKE %(p1)s', {'p0': 1, 'p1': 'a%'}),
+                         q.get_parameterized_sql('pyformat'))
+
+    def test_percent_escaped(self):
+        q = Query.from_(self.t).select(fn.Concat(self.t.foo, '%')).where(self.t.foo == 1)
+
+        self.assertEqual(('SELECT CONCAT("foo",\'%%\') FROM "abc" WHERE "foo"=%s', [1]),
+                         q.get_parameterized_sql('format'))
+
+    def test_function_arguments_not_parameterized(self):
+        q = Query.from_(self.t).select(fn.Coalesce(self.t.foo, 0)).where(fn.Extract(DatePart.year, self.t.dt) == 2016)
+
+        self.assertEqual(('SELECT COALESCE("foo",0) FROM "abc" WHERE EXTRACT(YEAR FROM "dt")=?', [2016]),
+                         q.get_parameterized_sql())
+
+    def test_order_of_clauses(self):
+        sub = Query.from_(self.t).select(self.t.id).where(self.t.bar == 'b')
+        q = Query.from_(self.t).select(self.t.foo).where(self.t.id.isin(sub) & (self.t.foo == 'a')).groupby(
+            self.t.foo).having(fn.Count('*') > 2)
+
+        self.assertEqual(['b', 'a', 2], q.get_parameterized_sql()[1])
+
+    def test_between_and_tuple(self):
+        q = Query.from_(self.t).select(self.t.foo).where(self.t.id[1:5])
+        pages = Query.from_(self.t).select(self.t.foo).iter_pages([self.t.a, self.t.b], 10)
+        next(pages)
+
+        self.assertEqual(('SELECT "foo" FROM "abc" WHERE "id" BETWEEN ? AND ?', [1, 5]), q.get_parameterized_sql())
+        self.assertEqual([1, 2], pages.send([1, 2]).get_parameterized_sql()[1])
+
+    def test_insert(self):
+        q = Query.into(self.t).insert((1, 'a'), (2, 'b'))
+
+        self.assertEqual(('INSERT INTO "abc" VALUES (?,?),(?,?)', [1, 'a', 2, 'b']), q.get_parameterized_sql())
+
+    def test_query_unchanged(self):
+        q = Query.from_(self.t).select(self.t.foo).where(self.t.foo == 1)
+        q.get_parameterized_sql()
+
+        self.assertEqual('SELECT "foo" FROM "abc" WHERE "foo"=1', str(q))
+
+    def test_unknown_paramstyle(self):
+        with self.assertRaises(QueryException):
+            Query.from_(self.t).select(self.t.foo).get_parameterized_sql('dollar')
+
+
+class TableDependencyTests(unittest.TestCase):
+    a, b, c = Tables('a', 'b', 'c')
+
+    def test_from_and_joins(self):
+        b = Table('b', schema='s')
+        q = Query.from_(self.a).join(b).on(self.a.id == b.id).select(self.a.id)
+
+        self.assertEqual({('a', None), ('b', 's')}, q.tables_read())
+        self.assertEqual(set(), q.tables_written())
+
+    def test_subqueries(self):
+        inner = Query.from_(self.b).select(self.b.id)
+        exists = Query.from_(self.c).select(self.c.id).where(self.c.id == 1)
+        q = Query.from_(self.a).select(self.a.id).where(self.a.id.isin(inner) & Exists(exists))
+
+        self.assertEqual({('a', None), ('b', None), ('c', None)}, q.tables_read())
+
+    def test_from_subquery_and_union(self):
+        inner = Query.from_(self.a).select(self.a.id)
+        q = Query.from_(inner).select(inner.id) + Query.from_(self.b).select(self.b.id)
+
+        self.assertEqual({('a', None), ('b', None)}, q.tables_read())
+
+    def test_with(self):
+        cte = AliasedQuery('cte')
+        q = Query.with_(Query.from_(self.a).select(self.a.id), 'cte').from_(cte).select(cte.id)
+
+        self.assertEqual({('a', None)}, q.tables_read())
+
+    def test_insert(self):
+        q = Query.into(self.c).from_(self.a).select(self.a.id)
+
+        self.assertEqual({('a', None)}, q.tables_read())
+        self.assertEqual({('c', None)}, q.tables_written())
+
+    def test_insert_values(self):
+        q = Query.into(self.c).insert(1, 2)
+
+        self.assertEqual(set(), q.tables_read())
+        self.assertEqual({('c', None)}, q.tables_written())
@@ -1,4 +1,5 @@
 # coding: utf8
+from datetime import date, datetime
 
 __author__ = "Timothy Heys"
 __email__ = "theys@kayak.com"
@@ -28,6 +29,10 @@ class RollupException(Exception):
     pass
 
 
+class ExecutionException(Exception):
+    pass
+
+
 def builder(func):
     import copy
 
@@ -36,3 +41,24 @@ def builder(func):
         return func(self_copy, *args, **kwargs) or self_copy
 
     return _decorator
+
+
+def as_date(value):
+    """
+    Returns a date or datetime as is and parses a string in ISO format, or returns ``None``.
+    """
+    if isinstance(value, date):
+        return value
+    if isinstance(value, str):
+        for fmt in ('%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S'):
+            try:
+                parsed = datetime.strptime(value, fmt)
+            except ValueError:
+                continue
+            return parsed.date() if fmt == '%Y-%m-%d' else parsed
+    return None
+
+
+def add_months(value, months):
+    month = value.month - 1 + months
+    return value.replace(year=value.year + month // 12, month=month % 12 + 1)
@@ -62,5 +62,12 @@ setup(
     install_requires=[
         'aenum'
     ],
+    extras_require={
+        # Columnar results of pypika.execution and pypika.caching
+        'numpy': ['numpy'],
+    },
+    tests_require=[
+        'numpy'
+    ],
     test_suite="pypika.tests",
 )